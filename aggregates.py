@@ -0,0 +1,145 @@
+"""
+Aggregate functions for SELECT ... GROUP BY.
+
+Each aggregate keeps a small JSON-serializable state per group, so a result
+can be computed in one pass and, for materialized views, extended later with
+more rows instead of recomputed. Empty values are nulls and are ignored by
+every aggregate except COUNT(*). APPROX_COUNT_DISTINCT keeps a HyperLogLog
+sketch (see sketches), which dump_state turns into JSON.
+"""
+import sketches
+from planner import compare_values
+
+AGGREGATE_FUNCTIONS = ('COUNT', 'SUM', 'MIN', 'MAX', 'AVG', 'APPROX_COUNT_DISTINCT')
+# Estimated memory per state, for operators that budget memory
+STATE_SIZE = 64
+
+
+def _number(value, func):
+    """Parse a value for SUM/AVG"""
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{func} requires numeric values, got '{value}'")
+
+
+def _format_number(value):
+    """Render a numeric result the way it would be typed"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def new_state(func):
+    """Initial state of an aggregate"""
+    if func == 'COUNT':
+        return 0
+    if func in ('SUM', 'AVG'):
+        return [0, 0]
+    if func == 'APPROX_COUNT_DISTINCT':
+        return sketches.new_sketch()
+    return None
+
+
+def state_size(func):
+    """Estimated memory held by one state of an aggregate"""
+    if func == 'APPROX_COUNT_DISTINCT':
+        return STATE_SIZE + sketches.HLL_SIZE
+    return STATE_SIZE
+
+
+def dump_state(func, state):
+    """JSON-serializable form of a state"""
+    if func == 'APPROX_COUNT_DISTINCT':
+        return sketches.dumps(state)
+    return state
+
+
+def load_state(func, data):
+    """State from its dump_state form"""
+    if func == 'APPROX_COUNT_DISTINCT':
+        return sketches.loads(data)
+    return data
+
+
+def step(func, state, value):
+    """Fold one value into a state and return the new state.
+
+    value is None for COUNT(*), which counts rows rather than values.
+    """
+    if func == 'COUNT':
+        return state + 1 if value is None or value != '' else state
+    if value == '':
+        return state
+    if func == 'APPROX_COUNT_DISTINCT':
+        sketches.add(state, value)
+        return state
+    if func in ('SUM', 'AVG'):
+        state[0] += _number(value, func)
+        state[1] += 1
+        return state
+    if state is None:
+        return value
+    if func == 'MIN':
+        return value if compare_values(value, '<', state) else state
+    return value if compare_values(value, '>', state) else state
+
+
+def result(func, state):
+    """Final value of an aggregate; '' (null) when it saw no values"""
+    if func == 'COUNT':
+        return str(state)
+    if func == 'SUM':
+        return _format_number(state[0]) if state[1] else ''
+    if func == 'AVG':
+        return _format_number(state[0] / state[1]) if state[1] else ''
+    if func == 'APPROX_COUNT_DISTINCT':
+        return str(sketches.estimate(state))
+    return '' if state is None else state
+
+
+def aggregate_rows(columns, rows, items, group_by, groups=None):
+    """Fold rows into per-group aggregate states.
+
+    items are the parsed SELECT items; groups maps a tuple of GROUP BY values
+    to one state per item (None for plain columns) and is extended in place
+    when given, which is how views refresh incrementally.
+    """
+    if groups is None:
+        groups = {}
+    key_indices = [columns.index(col) for col in group_by]
+    steps = []
+    for i, item in enumerate(items):
+        if item['func'] is not None:
+            value_idx = None if item['column'] == '*' else columns.index(item['column'])
+            steps.append((i, item['func'], value_idx))
+
+    for row in rows:
+        key = tuple(row[k] for k in key_indices)
+        states = groups.get(key)
+        if states is None:
+            states = groups[key] = [new_state(item['func']) if item['func'] else None for item in items]
+        for i, func, value_idx in steps:
+            states[i] = step(func, states[i], None if value_idx is None else row[value_idx])
+    return groups
+
+
+def finalize(items, group_by, groups):
+    """Turn per-group states into result rows"""
+    if not groups and not group_by:
+        # An aggregate over no rows still returns one row
+        groups = {(): [new_state(item['func']) for item in items]}
+    rows = []
+    for key, states in groups.items():
+        row = []
+        for item, state in zip(items, states):
+            if item['func'] is None:
+                row.append(key[group_by.index(item['column'])])
+            else:
+                row.append(result(item['func'], state))
+        rows.append(row)
+    return rows
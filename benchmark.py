@@ -0,0 +1,305 @@
+"""
+Benchmark harness for the database engine.
+
+Generates synthetic tables of the requested sizes in a temporary data
+directory and measures each statement type through DatabaseEngine.execute:
+throughput, latency percentiles and peak traced memory. Results are written
+as JSON so runs from different commits on the same machine can be compared:
+
+    python benchmark.py --rows 1000 10000 100000 --output base.json
+    python benchmark.py --rows 1000 10000 100000 --output new.json --compare base.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import changelog
+from engine import DatabaseEngine
+from parser import SQLParser
+
+COLUMNS = ['id', 'name', 'dept', 'age', 'email']
+DEPARTMENTS = [f"d{i}" for i in range(10)]
+
+OPERATIONS = ['bulk_load', 'read_table', 'insert', 'point_select', 'range_select',
+              'update', 'delete', 'describe', 'parse', 'recovery']
+
+
+def generate_rows(count, seed):
+    """Build deterministic synthetic rows"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        rows.append([
+            str(i),
+            f"user{rng.randrange(count)}",
+            rng.choice(DEPARTMENTS),
+            str(rng.randint(18, 80)),
+            f"user{i}@example.com",
+        ])
+    return rows
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(op, size, latencies, peak_bytes):
+    """Turn raw latencies (seconds) into a result record"""
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        'op': op,
+        'rows': size,
+        'iterations': len(latencies),
+        'total_s': total,
+        'ops_per_s': len(latencies) / total if total else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        'peak_memory_bytes': peak_bytes,
+    }
+
+
+class BenchmarkRunner:
+    
+    def __init__(self, iterations=50, max_seconds=10.0, seed=42):
+        self.iterations = iterations
+        self.max_seconds = max_seconds
+        self.seed = seed
+    
+    def _measure(self, statements, run):
+        """Time run(stmt) per statement until iterations or the time budget run out.
+        
+        At least three samples are always taken. One extra untimed call is
+        traced with tracemalloc to record peak memory for the operation.
+        """
+        latencies = []
+        deadline = time.perf_counter() + self.max_seconds
+        for stmt in statements:
+            start = time.perf_counter()
+            run(stmt)
+            end = time.perf_counter()
+            latencies.append(end - start)
+            if len(latencies) >= 3 and end > deadline:
+                break
+        
+        tracemalloc.start()
+        try:
+            run(statements[len(latencies) % len(statements)])
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return latencies, peak
+    
+    def _bytes_per_row(self, engine, table):
+        """Memory still held per row once a whole table has been read"""
+        tracemalloc.start()
+        try:
+            _, rows = engine.storage.read_table(table)
+            retained, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return retained / len(rows) if rows else 0.0
+    
+    def _recovery(self, size, data_dir):
+        """Time opening a database whose logged table is rebuilt from its checkpoint and size inserts.
+        
+        Before each timed open a transaction is left open in the log, as a
+        crash mid-statement leaves it, so the table has to be rebuilt. Also
+        records an open with nothing to rebuild, and a rebuild right after a
+        checkpoint, when none of the inserts are replayed.
+        """
+        log_dir = os.path.join(data_dir, 'recovery')
+        engine = DatabaseEngine(log_dir, checkpoint_every=None)
+        engine.execute(f"CREATE TABLE logged ({', '.join(COLUMNS)})")
+        engine.execute("ALTER TABLE logged SET CHANGE LOG ON")
+        with engine.batch():
+            for row in generate_rows(size, self.seed):
+                engine.execute(f"INSERT INTO logged VALUES ({', '.join(row)})")
+        
+        def crash_and_open(_):
+            changelog.begin(engine.storage, 'logged', [changelog.insert(['0'] * len(COLUMNS))])
+            DatabaseEngine(log_dir).close()
+        
+        opens = [None] * max(3, min(self.iterations, 5))
+        result = summarize('recovery', size, *self._measure(opens, crash_and_open))
+        result['log_bytes'] = changelog.log_length(engine.storage, 'logged')
+        # Nothing left to rebuild: the open only checks the log against the table
+        clean, _ = self._measure(opens, lambda _: DatabaseEngine(log_dir).close())
+        result['clean_open_ms'] = percentile(sorted(clean), 50) * 1000
+        engine.checkpoint('logged')
+        checkpointed, _ = self._measure(opens, crash_and_open)
+        result['checkpointed_recovery_ms'] = percentile(sorted(checkpointed), 50) * 1000
+        return result
+    
+    def run_size(self, size, operations):
+        """Run the selected operations against a table of size rows"""
+        data_dir = tempfile.mkdtemp(prefix='dbbench-')
+        try:
+            engine = DatabaseEngine(data_dir)
+            engine.execute(f"CREATE TABLE bench ({', '.join(COLUMNS)})")
+            rows = generate_rows(size, self.seed)
+            rng = random.Random(self.seed + 1)
+            results = []
+            
+            def keys(count):
+                return [rng.randrange(size) for _ in range(count)]
+            
+            if 'bulk_load' in operations:
+                latencies, peak = self._measure(
+                    [rows] * max(3, min(self.iterations, 5)),
+                    lambda r: engine.storage.write_table('bench', COLUMNS, r))
+                results.append(summarize('bulk_load', size, latencies, peak))
+            else:
+                engine.storage.write_table('bench', COLUMNS, rows)
+            del rows
+            
+            if 'read_table' in operations:
+                stmts = ['bench'] * max(3, min(self.iterations, 5))
+                result = summarize('read_table', size, *self._measure(stmts, engine.storage.read_table))
+                result['bytes_per_row'] = self._bytes_per_row(engine, 'bench')
+                results.append(result)
+            
+            # Reads run before the writes that change the table
+            if 'point_select' in operations:
+                stmts = [f"SELECT * FROM bench WHERE id = {k}" for k in keys(self.iterations)]
+                results.append(summarize('point_select', size, *self._measure(stmts, engine.execute)))
+            
+            if 'range_select' in operations:
+                # WHERE takes a single comparison: the last 1-10% of ids
+                stmts = [f"SELECT id, name FROM bench WHERE id >= {size - rng.randint(1, max(1, size // 10))}"
+                         for _ in range(self.iterations)]
+                results.append(summarize('range_select', size, *self._measure(stmts, engine.execute)))
+            
+            if 'describe' in operations:
+                stmts = ["DESCRIBE bench"] * self.iterations
+                results.append(summarize('describe', size, *self._measure(stmts, engine.execute)))
+            
+            if 'parse' in operations:
+                parser = SQLParser()
+                samples = [
+                    "SELECT * FROM bench WHERE id = 42",
+                    "SELECT id, name, dept FROM bench",
+                    "INSERT INTO bench VALUES (1, 'a', 'd1', 30, 'a@example.com')",
+                    "UPDATE bench SET age = 31 WHERE id = 1",
+                    "DELETE FROM bench WHERE id = 1",
+                ]
+                stmts = [samples[i % len(samples)] for i in range(self.iterations * 100)]
+                results.append(summarize('parse', size, *self._measure(stmts, parser.parse)))
+            
+            if 'insert' in operations:
+                stmts = [f"INSERT INTO bench VALUES ({size + i}, new{i}, d0, 30, new{i}@example.com)"
+                         for i in range(self.iterations)]
+                results.append(summarize('insert', size, *self._measure(stmts, engine.execute)))
+            
+            if 'update' in operations:
+                stmts = [f"UPDATE bench SET age = 99 WHERE id = {k}" for k in keys(self.iterations)]
+                results.append(summarize('update', size, *self._measure(stmts, engine.execute)))
+            
+            if 'delete' in operations:
+                ids = rng.sample(range(size), min(size, self.iterations + 1))
+                stmts = [f"DELETE FROM bench WHERE id = {k}" for k in ids]
+                results.append(summarize('delete', size, *self._measure(stmts, engine.execute)))
+            
+            if 'recovery' in operations:
+                results.append(self._recovery(size, data_dir))
+            
+            return results
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def environment():
+    """Describe the machine and commit the results were produced on"""
+    commit = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def compare(baseline, current, threshold):
+    """Print p50 latency changes; return the number of regressions"""
+    base = {(r['rows'], r['op']): r for r in baseline['results']}
+    regressions = 0
+    print(f"{'rows':>10} {'op':<14} {'base p50':>10} {'new p50':>10} {'change':>8}")
+    for result in current['results']:
+        old = base.get((result['rows'], result['op']))
+        if old is None or not old['p50_ms']:
+            continue
+        change = result['p50_ms'] / old['p50_ms'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{result['rows']:>10} {result['op']:<14} {old['p50_ms']:>9.3f}ms "
+              f"{result['p50_ms']:>9.3f}ms {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Benchmark the Mini Database Engine")
+    arg_parser.add_argument('--rows', type=float, nargs='+', default=[1e3, 1e4, 1e5],
+                            help="table sizes to generate (1e3 to 1e7)")
+    arg_parser.add_argument('--ops', nargs='+', choices=OPERATIONS, default=OPERATIONS)
+    arg_parser.add_argument('--iterations', type=int, default=50,
+                            help="statements per operation and size")
+    arg_parser.add_argument('--max-seconds', type=float, default=10.0,
+                            help="time budget per operation and size")
+    arg_parser.add_argument('--seed', type=int, default=42)
+    arg_parser.add_argument('--output', default='benchmark.json')
+    arg_parser.add_argument('--compare', help="baseline JSON to compare against")
+    arg_parser.add_argument('--threshold', type=float, default=0.10,
+                            help="p50 slowdown reported as a regression")
+    args = arg_parser.parse_args(argv)
+    
+    runner = BenchmarkRunner(args.iterations, args.max_seconds, args.seed)
+    report = {'environment': environment(), 'config': vars(args), 'results': []}
+    for size in args.rows:
+        size = int(size)
+        print(f"Benchmarking {size} rows...")
+        for result in runner.run_size(size, args.ops):
+            print(f"  {result['op']:<14} {result['ops_per_s']:>12.1f} ops/s  "
+                  f"p50 {result['p50_ms']:.3f}ms  p99 {result['p99_ms']:.3f}ms  "
+                  f"peak {result['peak_memory_bytes'] / 1024:.0f} KiB"
+                  + (f"  {result['bytes_per_row']:.0f} B/row" if 'bytes_per_row' in result else ''))
+            report['results'].append(result)
+    
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Query result cache.
+
+SELECT results are kept in an LRU bounded by an estimate of their memory
+footprint. Each entry remembers the signature its table had before the query
+read it and is only served while the table still has that signature, which
+also catches writes from other processes. Writes made through this process's
+Storage drop a table's entries straight away, freeing their memory.
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+# Per-row and per-value overheads of a tuple of str, on top of the characters
+_ROW_OVERHEAD = sys.getsizeof(())
+_VALUE_OVERHEAD = sys.getsizeof('') + 8
+
+
+def estimate_size(columns, rows):
+    """Approximate memory used by a result, in bytes"""
+    size = sum(_VALUE_OVERHEAD + len(col) for col in columns)
+    for row in rows:
+        size += _ROW_OVERHEAD + sum(_VALUE_OVERHEAD + len(value) for value in row)
+    return size
+
+
+class ResultCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._by_table = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key, signature):
+        """Return (columns, rows) for key if cached against this table signature, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['signature'] != signature:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry['columns'], entry['rows']
+    
+    def put(self, key, table, signature, columns, rows):
+        """Cache a result; results larger than the whole cache are not kept"""
+        size = estimate_size(columns, rows)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {'table': table, 'signature': signature, 'columns': columns,
+                                  'rows': rows, 'size': size}
+            self._by_table.setdefault(table, set()).add(key)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return True
+    
+    def invalidate(self, table):
+        """Drop every entry that read a table"""
+        with self._lock:
+            for key in list(self._by_table.get(table, ())):
+                self._remove(key)
+    
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+            self.size = 0
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _remove(self, key):
+        """Remove one entry; the lock must be held"""
+        entry = self._entries.pop(key)
+        self.size -= entry['size']
+        keys = self._by_table[entry['table']]
+        keys.discard(key)
+        if not keys:
+            del self._by_table[entry['table']]
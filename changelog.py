@@ -0,0 +1,303 @@
+"""
+Change data capture.
+
+A table with its change log on (ALTER TABLE t SET CHANGE LOG ON) records
+every row it gains, loses or changes in <table>.cdc, one JSON object per line:
+
+    {"seq": 7, "tx": 7, "op": "insert", "after": ["3", "Carol"]}
+    {"seq": 8, "tx": 7, "op": "commit", "ts": 1760000000.0}
+    {"seq": 9, "tx": 9, "op": "update", "before": ["3", "Carol"], "after": ["3", "Caro"]}
+    {"seq": 10, "tx": 9, "op": "delete", "before": ["1", "Alice"]}
+    {"seq": 11, "tx": 9, "op": "commit", "ts": 1760000001.5}
+
+Each statement is a transaction: its changes are appended with one write,
+and are on disk before the table itself is written; a commit entry (or an
+abort entry, if the write fails) follows. Sequence numbers increase by one per entry and
+tx is the sequence number of the transaction's first change; the next one
+is read off the end of the log, so logging a statement writes nothing but
+the log. A TRUNCATE is a single "truncate" entry. Readers deliver a
+transaction's changes only once its commit is in the log, and skip a line
+left incomplete by a crash.
+
+The log doubles as a redo log. Outcome entries carry the table's signature
+after the write, and a commit with no changes (a mark) records it after
+writes that change no rows, such as a rewrite into another encoding. A
+checkpoint, <table>.ckpt, holds the table's rows as of a sequence number and
+the log's length then; it is synced before it replaces the last one, so a
+crash leaves one or the other. After a crash the table either matches the signature
+of the last outcome and has no transaction left open, or it is rebuilt from
+the checkpoint and the transactions committed after it, and open ones are
+aborted. Only the log past the checkpoint is ever read.
+
+The log is never truncated: offsets into it are byte positions that
+checkpoints, subscribers and replicas resume from, and cutting its front
+would move them. It only grows with statements that change rows or rewrite
+the table's files; one that does neither logs nothing.
+"""
+import json
+import time
+
+LOG_SUFFIX = 'cdc'
+CHECKPOINT_SUFFIX = 'ckpt'
+# Entries that end a transaction
+OUTCOMES = ('commit', 'abort')
+# Bytes read from the end of the log to find the last sequence number
+TAIL_BYTES = 4096
+
+
+def insert(row):
+    """Change entry for an inserted row"""
+    return {'op': 'insert', 'after': list(row)}
+
+
+def delete(row):
+    """Change entry for a deleted row"""
+    return {'op': 'delete', 'before': list(row)}
+
+
+def update(before, after):
+    """Change entry for an updated row"""
+    return {'op': 'update', 'before': list(before), 'after': list(after)}
+
+
+def truncate():
+    """Change entry for the removal of every row"""
+    return {'op': 'truncate'}
+
+
+def last_seq(storage, table):
+    """Sequence number of the last complete entry in a table's log; 0 if there is none"""
+    return _log_end(storage, table)[0]
+
+
+def _log_end(storage, table):
+    """(last sequence number, whether the log ends partway through a line)"""
+    size = TAIL_BYTES
+    while True:
+        data = storage.read_aux(table, LOG_SUFFIX, -size) or b''
+        cut = not data.endswith(b'\n') and data != b''
+        lines = data.split(b'\n')[:-1]
+        if len(data) == size:
+            # The first line may have been cut
+            lines = lines[1:]
+        for line in reversed(lines):
+            try:
+                return json.loads(line)['seq'], cut
+            except ValueError:
+                continue
+        if len(data) < size:
+            return 0, cut
+        size *= 4
+
+
+def begin(storage, table, changes):
+    """Log a statement's changes before they are written; the table must be locked.
+
+    Returns the transaction to pass to end, or None if there were no changes.
+    """
+    seq, cut = _log_end(storage, table)
+    tx = seq = seq + 1
+    lines = []
+    for change in changes:
+        lines.append(json.dumps(dict({'seq': seq, 'tx': tx}, **change)) + '\n')
+        seq += 1
+    if not lines:
+        return None
+    _append(storage, table, lines, cut)
+    return tx, seq
+
+
+def end(storage, table, transaction, outcome='commit', signature=None):
+    """Log whether a transaction begun with begin took effect, and the table's signature after it"""
+    tx, seq = transaction
+    entry = {'seq': seq, 'tx': tx, 'op': outcome, 'ts': time.time(), 'signature': signature}
+    storage.append_aux(table, LOG_SUFFIX, (json.dumps(entry) + '\n').encode('utf-8'))
+
+
+def mark(storage, table, signature, tx=None, outcome='commit'):
+    """Log the table's signature after a write that changed no rows, or end an open transaction tx"""
+    seq, cut = _log_end(storage, table)
+    seq += 1
+    entry = {'seq': seq, 'tx': seq if tx is None else tx, 'op': outcome, 'ts': time.time(), 'signature': signature}
+    _append(storage, table, [json.dumps(entry) + '\n'], cut)
+    return seq
+
+
+def _append(storage, table, lines, cut):
+    """Append lines to a table's log"""
+    if cut:
+        # A crash cut the last line short: end it, so it cannot run into these
+        lines = ['\n'] + lines
+    storage.append_aux(table, LOG_SUFFIX, ''.join(lines).encode('utf-8'))
+
+
+def scan(storage, table, offset=0):
+    """Read a table's log from offset.
+
+    Returns (committed [(commit entry, changes), ...], ids of transactions
+    with no outcome, the last outcome entry or None).
+    """
+    data = storage.read_aux(table, LOG_SUFFIX, offset) or b''
+    committed = []
+    open_transactions = {}
+    last_outcome = None
+    for line in data.splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if entry['op'] not in OUTCOMES:
+            open_transactions.setdefault(entry['tx'], []).append(entry)
+            continue
+        changes = open_transactions.pop(entry['tx'], [])
+        if entry['op'] == 'commit' and changes:
+            committed.append((entry, changes))
+        last_outcome = entry
+    return committed, list(open_transactions), last_outcome
+
+
+def log_length(storage, table, known_offset=0):
+    """Bytes in a table's log, reading only what lies past known_offset"""
+    return known_offset + len(storage.read_aux(table, LOG_SUFFIX, known_offset) or b'')
+
+
+def write_checkpoint(storage, table, columns, rows, offset):
+    """Replace a table's checkpoint; the table must be locked. Returns its sequence number."""
+    seq = last_seq(storage, table)
+    rows = list(rows)
+    header = json.dumps({'seq': seq, 'offset': offset, 'columns': list(columns), 'count': len(rows)})
+    data = header + '\n' + ''.join(','.join(row) + '\n' for row in rows)
+    storage.write_aux(table, CHECKPOINT_SUFFIX, data.encode('utf-8'))
+    return seq
+
+
+def read_checkpoint(storage, table):
+    """A table's checkpoint as {'seq', 'offset', 'columns', 'rows'}; None if it has none.
+    
+    Raises ValueError if the checkpoint is empty, cut short or unreadable.
+    """
+    data = storage.read_aux(table, CHECKPOINT_SUFFIX)
+    if data is None:
+        return None
+    try:
+        lines = data.decode('utf-8').split('\n')
+        checkpoint = json.loads(lines[0])
+        checkpoint['rows'] = [tuple(line.split(',')) for line in lines[1:-1]]
+    except ValueError:
+        checkpoint = None
+    # Checkpoints written before the row count was recorded only end in a newline
+    if (checkpoint is None or lines[-1] != ''
+            or checkpoint.get('count', len(checkpoint['rows'])) != len(checkpoint['rows'])):
+        raise ValueError(f"Checkpoint of table '{table}' is empty or corrupt")
+    return checkpoint
+
+
+class ChangeLogReader:
+    """Follows a change log and hands out committed changes in order.
+    
+    read(offset) returns the log's bytes from offset on (None if there is no
+    log yet). Changes numbered below from_seq are skipped; offset, where
+    reading starts, must fall between transactions.
+    """
+    
+    def __init__(self, read, from_seq=1, offset=0):
+        self._read = read
+        self.next_seq = from_seq
+        self.offset = offset
+        # Commit entry of the last transaction delivered
+        self.last_commit = None
+        self._open = {}
+    
+    def poll(self):
+        """Return the changes committed since the last poll"""
+        return [change for _, changes in self.poll_transactions() for change in changes]
+    
+    def poll_transactions(self):
+        """Return [(commit entry, changes), ...] for the transactions committed since the last poll"""
+        data = self._read(self.offset)
+        if not data:
+            return []
+        # A line still being written is read again next time
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        
+        transactions = []
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Cut short by a crash; its transaction never commits
+                continue
+            pending = self._open.setdefault(entry['tx'], [])
+            if entry['op'] not in OUTCOMES:
+                pending.append(entry)
+                continue
+            del self._open[entry['tx']]
+            changes = [change for change in pending if change['seq'] >= self.next_seq]
+            if entry['op'] == 'commit' and changes:
+                transactions.append((entry, changes))
+                self.next_seq = changes[-1]['seq'] + 1
+                self.last_commit = entry
+        return transactions
+    
+    def follow(self, poll_interval=0.2, timeout=None):
+        """Yield committed changes as they arrive; stop after timeout seconds without any"""
+        idle_since = time.monotonic()
+        while True:
+            changes = self.poll()
+            if changes:
+                yield from changes
+                idle_since = time.monotonic()
+            elif timeout is not None and time.monotonic() - idle_since >= timeout:
+                return
+            else:
+                time.sleep(poll_interval)
+
+
+def apply_changes(rows, changes):
+    """Apply logged changes, in order, to a table's rows; returns the new rows.
+
+    Deletes and updates take out a row equal to their before image. Rows
+    equal in every column are interchangeable, so which one goes does not
+    change the table's contents.
+    """
+    rows = list(rows)
+    # row -> positions in rows, built at the first change that needs it
+    positions = None
+    for change in changes:
+        if change['op'] == 'truncate':
+            rows = []
+            positions = None
+        elif change['op'] == 'insert':
+            rows.append(tuple(change['after']))
+            if positions is not None:
+                positions.setdefault(rows[-1], []).append(len(rows) - 1)
+        else:
+            if positions is None:
+                positions = {}
+                for i, row in enumerate(rows):
+                    if row is not None:
+                        positions.setdefault(row, []).append(i)
+            matches = positions.get(tuple(change['before']))
+            if not matches:
+                raise ValueError(f"Change {change['seq']} does not match any row")
+            i = matches.pop()
+            if change['op'] == 'delete':
+                rows[i] = None
+            else:
+                rows[i] = tuple(change['after'])
+                positions.setdefault(rows[i], []).append(i)
+    return [row for row in rows if row is not None]
+
+
+def tail_file(path, from_seq=1):
+    """Reader for a change log file, e.g. data/<table>.cdc, for use without an engine"""
+    def read(offset):
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    return ChangeLogReader(read, from_seq)
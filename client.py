@@ -0,0 +1,439 @@
+"""
+Client library for server.py.
+
+Connection is a blocking client, AsyncConnection an asyncio one. Both tag each
+statement with a request id, so several statements can be in flight on one
+connection, and both hand back results whose rows are fetched from the socket
+as the caller asks for them rather than buffered up front. ConnectionPool and
+AsyncConnectionPool keep persistent connections open for reuse.
+"""
+import asyncio
+import itertools
+import queue
+import socket
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+import protocol
+
+
+def _to_event(kind, value):
+    """Map a server frame to a (name, value) result event"""
+    if kind == protocol.COLUMNS:
+        return 'columns', value
+    if kind == protocol.ROWS:
+        return 'rows', value
+    if kind == protocol.COMPLETE:
+        return 'complete', value
+    if kind == protocol.ERROR:
+        return 'error', value
+    raise ValueError(f"Unexpected message type from server: {kind}")
+
+
+class Result:
+    """Rows of one statement, read from the connection on demand"""
+    
+    def __init__(self, connection, request_id):
+        self._connection = connection
+        self._request_id = request_id
+        self._started = False
+        self._done = False
+        self._columns = None
+        self._message = None
+        self._buffer = deque()
+    
+    def _handle(self, event, value):
+        """Apply one result event"""
+        if event == 'columns':
+            self._columns = value
+        elif event == 'rows':
+            self._buffer.extend(value)
+        elif event == 'complete':
+            self._message = value
+            self._done = True
+            self._connection._finish(self._request_id)
+        else:
+            self._done = True
+            self._connection._finish(self._request_id)
+            raise ValueError(value)
+    
+    def _start(self):
+        """Wait for the first event so columns or message are known"""
+        if not self._started:
+            self._started = True
+            self._handle(*self._connection._next_event(self._request_id))
+    
+    def _fill(self):
+        """Read events until a row is buffered or the result ends"""
+        self._start()
+        while not self._buffer and not self._done:
+            self._handle(*self._connection._next_event(self._request_id))
+    
+    @property
+    def columns(self):
+        """Column names, or None for statements that return no rows"""
+        self._start()
+        return self._columns
+    
+    @property
+    def message(self):
+        """Server status message; available once the result is consumed"""
+        self.fetchall()
+        return self._message
+    
+    def fetchone(self):
+        """Return the next row, or None when exhausted"""
+        self._fill()
+        return self._buffer.popleft() if self._buffer else None
+    
+    def fetchmany(self, size=100):
+        """Return up to size rows"""
+        rows = []
+        while len(rows) < size:
+            self._fill()
+            if not self._buffer:
+                break
+            while self._buffer and len(rows) < size:
+                rows.append(self._buffer.popleft())
+        return rows
+    
+    def fetchall(self):
+        """Return all remaining rows"""
+        rows = []
+        while True:
+            self._fill()
+            if not self._buffer:
+                return rows
+            rows.extend(self._buffer)
+            self._buffer.clear()
+    
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+
+class Connection:
+    """Blocking connection to a database server"""
+    
+    def __init__(self, host='127.0.0.1', port=5433, timeout=None):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._ids = itertools.count(1)
+        # Events read off the socket for requests other than the one waited on
+        self._pending = {}
+        self.closed = False
+    
+    def execute(self, sql):
+        """Send a statement and return its Result without waiting for it"""
+        return self.pipeline([sql])[0]
+    
+    def pipeline(self, statements):
+        """Send several statements in one write and return their Results"""
+        results = []
+        frames = []
+        for sql in statements:
+            request_id = next(self._ids)
+            self._pending[request_id] = deque()
+            frames.append(protocol.encode_text(protocol.QUERY, request_id, sql))
+            results.append(Result(self, request_id))
+        self._sock.sendall(b''.join(frames))
+        return results
+    
+    def _next_event(self, request_id):
+        """Return the next event for a request, buffering others"""
+        pending = self._pending.get(request_id)
+        if pending is None:
+            raise ValueError("Result is no longer available on this connection")
+        while not pending:
+            kind, payload = protocol.recv_frame(self._sock)
+            frame_id, value = protocol.decode_payload(kind, payload)
+            if frame_id in self._pending:
+                self._pending[frame_id].append(_to_event(kind, value))
+        return pending.popleft()
+    
+    def _finish(self, request_id):
+        """Forget a request once its final event has been read"""
+        self._pending.pop(request_id, None)
+    
+    def drain(self):
+        """Read and discard whatever is left of outstanding results"""
+        for request_id in list(self._pending):
+            while request_id in self._pending:
+                event, _ = self._next_event(request_id)
+                if event in ('complete', 'error'):
+                    self._finish(request_id)
+    
+    def close(self):
+        """Close the connection"""
+        if not self.closed:
+            self.closed = True
+            try:
+                self._sock.sendall(protocol.encode_frame(protocol.TERMINATE, 0))
+            except OSError:
+                pass
+            self._sock.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectionPool:
+    """Fixed-size pool of persistent blocking connections"""
+    
+    def __init__(self, host='127.0.0.1', port=5433, size=8, timeout=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = queue.Queue()
+        for _ in range(size):
+            self._slots.put(None)
+    
+    @contextmanager
+    def connection(self):
+        """Check out a connection, opening one if none is idle"""
+        self._slots.get()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = Connection(self.host, self.port, self.timeout)
+            except BaseException:
+                self._slots.put(None)
+                raise
+        try:
+            yield conn
+        except OSError:
+            conn.close()
+            raise
+        finally:
+            if not conn.closed:
+                try:
+                    conn.drain()
+                    self._idle.put(conn)
+                except OSError:
+                    conn.close()
+            self._slots.put(None)
+    
+    def execute(self, sql):
+        """Run one statement on a pooled connection and return (columns, rows, message)"""
+        with self.connection() as conn:
+            result = conn.execute(sql)
+            rows = result.fetchall()
+            return result.columns, rows, result.message
+    
+    def close(self):
+        """Close idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class AsyncResult:
+    """Rows of one statement on an AsyncConnection, fetched on demand"""
+    
+    def __init__(self, events):
+        self._events = events
+        self._started = False
+        self._done = False
+        self._columns = None
+        self._message = None
+        self._buffer = deque()
+    
+    async def _step(self):
+        """Apply the next event for this request"""
+        event, value = await self._events.get()
+        if event == 'columns':
+            self._columns = value
+        elif event == 'rows':
+            self._buffer.extend(value)
+        elif event == 'complete':
+            self._message = value
+            self._done = True
+        else:
+            self._done = True
+            raise ValueError(value)
+    
+    async def _start(self):
+        """Wait for the first event so columns or message are known"""
+        if not self._started:
+            self._started = True
+            await self._step()
+    
+    async def _fill(self):
+        """Read events until a row is buffered or the result ends"""
+        await self._start()
+        while not self._buffer and not self._done:
+            await self._step()
+    
+    @property
+    def columns(self):
+        """Column names; valid once the first row or message was awaited"""
+        return self._columns
+    
+    @property
+    def message(self):
+        """Server status message; valid once the result is consumed"""
+        return self._message
+    
+    async def fetchone(self):
+        """Return the next row, or None when exhausted"""
+        await self._fill()
+        return self._buffer.popleft() if self._buffer else None
+    
+    async def fetchmany(self, size=100):
+        """Return up to size rows"""
+        rows = []
+        while len(rows) < size:
+            await self._fill()
+            if not self._buffer:
+                break
+            while self._buffer and len(rows) < size:
+                rows.append(self._buffer.popleft())
+        return rows
+    
+    async def fetchall(self):
+        """Return all remaining rows"""
+        rows = []
+        while True:
+            await self._fill()
+            if not self._buffer:
+                return rows
+            rows.extend(self._buffer)
+            self._buffer.clear()
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        row = await self.fetchone()
+        if row is None:
+            raise StopAsyncIteration
+        return row
+
+
+class AsyncConnection:
+    """Asyncio connection; many coroutines may share it concurrently.
+    
+    Each request buffers its own events, like Connection does, so a result
+    left unread never holds up the others on the connection.
+    """
+    
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count(1)
+        self._requests = {}
+        self._reader_task = asyncio.ensure_future(self._read_loop())
+        self.closed = False
+    
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=5433):
+        """Open a connection"""
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+    
+    async def execute(self, sql):
+        """Send a statement and return its AsyncResult"""
+        if self.closed:
+            raise ConnectionError("Connection is closed")
+        request_id = next(self._ids)
+        events = asyncio.Queue()
+        self._requests[request_id] = events
+        self._writer.write(protocol.encode_text(protocol.QUERY, request_id, sql))
+        await self._writer.drain()
+        result = AsyncResult(events)
+        await result._start()
+        return result
+    
+    async def _read_loop(self):
+        """Route frames from the server to the request they belong to"""
+        error = ConnectionError("Connection closed by server")
+        try:
+            while True:
+                frame = await protocol.read_frame(self._reader)
+                if frame is None:
+                    break
+                request_id, value = protocol.decode_payload(*frame)
+                event = _to_event(frame[0], value)
+                events = self._requests.get(request_id)
+                if events is None:
+                    continue
+                if event[0] in ('complete', 'error'):
+                    del self._requests[request_id]
+                events.put_nowait(event)
+        except (ConnectionError, ValueError) as e:
+            error = e
+        finally:
+            self.closed = True
+            for events in self._requests.values():
+                events.put_nowait(('error', str(error)))
+            self._requests.clear()
+    
+    async def close(self):
+        """Close the connection"""
+        if not self._writer.is_closing():
+            self._writer.write(protocol.encode_frame(protocol.TERMINATE, 0))
+            self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self._reader_task
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AsyncConnectionPool:
+    """Persistent asyncio connections; requests are spread round-robin"""
+    
+    def __init__(self, host='127.0.0.1', port=5433, size=4):
+        self.host = host
+        self.port = port
+        self.size = size
+        self._connections = []
+        self._next = itertools.count()
+        self._lock = asyncio.Lock()
+    
+    async def _get(self):
+        """Pick a live connection, replacing closed ones"""
+        async with self._lock:
+            if len(self._connections) < self.size:
+                conn = await AsyncConnection.connect(self.host, self.port)
+                self._connections.append(conn)
+                return conn
+            index = next(self._next) % self.size
+            conn = self._connections[index]
+            if conn.closed:
+                conn = self._connections[index] = await AsyncConnection.connect(self.host, self.port)
+            return conn
+    
+    @asynccontextmanager
+    async def connection(self):
+        """Yield a pooled connection; it stays open for other users"""
+        yield await self._get()
+    
+    async def execute(self, sql):
+        """Run one statement and return (columns, rows, message)"""
+        conn = await self._get()
+        result = await conn.execute(sql)
+        rows = await result.fetchall()
+        return result.columns, rows, result.message
+    
+    async def close(self):
+        """Close all connections"""
+        for conn in self._connections:
+            await conn.close()
+        self._connections.clear()
@@ -0,0 +1,306 @@
+"""
+Crash-injection harness for checkpoints and recovery.
+
+Each run starts a child process that writes to two tables with their change
+logs on - one plain, one partitioned - single statements and batches, and
+reports each group of statements before it runs and again once it returns.
+The child dies partway through: killed with SIGKILL after a random delay, or
+made to exit at an injected point - right after a change log append, halfway
+through one, right after a table write, halfway through a row append, or
+right after a checkpoint is written. The parent then opens the database,
+which recovers it, and checks that every table holds what the acknowledged
+statements left plus some prefix of the group in flight. A second open must
+find nothing left to recover.
+
+    python crash_harness.py --runs 60 --seed 7
+
+It prints a line per run and a summary, and exits with status 1 if any run
+failed.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import changelog
+from engine import DatabaseEngine
+from storage import FileStorage
+
+TABLES = {
+    'plain': "CREATE TABLE plain (id, val)",
+    'parts': ("CREATE TABLE parts (id, val) PARTITION BY RANGE (id) "
+              "(PARTITION low VALUES LESS THAN (50), PARTITION high VALUES LESS THAN (MAXVALUE))"),
+}
+CRASH_POINTS = ['kill', 'after_log', 'torn_log', 'after_write', 'torn_append', 'after_checkpoint']
+# Exit status of a child that reached its injected crash
+CRASH_STATUS = 99
+# Small, so a run crosses several checkpoints
+CHECKPOINT_EVERY = 25
+
+
+def statement_sql(statement):
+    """SQL for a generated statement [op, table, id, val]"""
+    op, table, key, val = statement
+    if op == 'insert':
+        return f"INSERT INTO {table} VALUES ({key}, {val})"
+    if op == 'update':
+        return f"UPDATE {table} SET val = {val} WHERE id = {key}"
+    return f"DELETE FROM {table} WHERE id = {key}"
+
+
+def apply_statement(model, statement):
+    """Apply a generated statement to the model: table -> list of rows"""
+    op, table, key, val = statement
+    rows = model[table]
+    if op == 'insert':
+        rows.append((str(key), val))
+    elif op == 'update':
+        model[table] = [(row[0], val) if row[0] == str(key) else row for row in rows]
+    else:
+        model[table] = [row for row in rows if row[0] != str(key)]
+
+
+def random_statement(rng):
+    """A random INSERT, UPDATE or DELETE on one of the tables"""
+    op = rng.choices(['insert', 'update', 'delete'], weights=[6, 3, 1])[0]
+    return [op, rng.choice(list(TABLES)), rng.randrange(100), f"v{rng.randrange(1000)}"]
+
+
+def _crash_at(name, countdown, applies, tear=None):
+    """Make FileStorage.name exit the process on its countdown-th call that applies.
+
+    The call completes first, or tear(original, storage, *args) writes part of it.
+    """
+    original = getattr(FileStorage, name)
+    calls = [0]
+
+    def wrapper(self, *args):
+        if not applies(*args):
+            return original(self, *args)
+        calls[0] += 1
+        if calls[0] < countdown:
+            return original(self, *args)
+        if tear is None:
+            original(self, *args)
+        else:
+            tear(original, self, *args)
+        os._exit(CRASH_STATUS)
+
+    setattr(FileStorage, name, wrapper)
+
+
+def _tear_rows(storage, table_name, rows):
+    """Write half of the rows' bytes to the end of a table file"""
+    data = ''.join(','.join(row) + '\n' for row in rows).encode('utf-8')
+    with open(storage._get_table_path(table_name), 'ab') as f:
+        f.write(data[:len(data) // 2])
+
+
+def install_crash(point, countdown):
+    """Arrange for the child to exit at the countdown-th write of the kind point names"""
+    is_log = lambda table_name, suffix, data: suffix == changelog.LOG_SUFFIX
+    if point == 'after_log':
+        _crash_at('append_aux', countdown, is_log)
+    elif point == 'torn_log':
+        _crash_at('append_aux', countdown, is_log,
+                  lambda original, storage, table_name, suffix, data:
+                  original(storage, table_name, suffix, data[:len(data) // 2]))
+    elif point == 'after_write':
+        for name in ('write_table', 'append_row', 'append_rows'):
+            _crash_at(name, countdown, lambda *args: True)
+    elif point == 'torn_append':
+        _crash_at('append_row', countdown, lambda *args: True,
+                  lambda original, storage, table_name, row: _tear_rows(storage, table_name, [row]))
+        _crash_at('append_rows', countdown, lambda *args: True,
+                  lambda original, storage, table_name, rows: _tear_rows(storage, table_name, rows))
+    elif point == 'after_checkpoint':
+        _crash_at('write_aux', countdown, lambda table_name, suffix, data: suffix == changelog.CHECKPOINT_SUFFIX)
+
+
+def report(message):
+    """Child: tell the parent how far it got"""
+    print(json.dumps(message), flush=True)
+
+
+def child(data_dir, seed, statements, point, countdown):
+    """Run the workload until it is done or the crash comes"""
+    rng = random.Random(seed)
+    engine = DatabaseEngine(data_dir, checkpoint_every=CHECKPOINT_EVERY)
+    for table, create in TABLES.items():
+        engine.execute(create)
+        engine.execute(f"ALTER TABLE {table} SET CHANGE LOG ON")
+    install_crash(point, countdown)
+    report({'ready': True})
+
+    done = 0
+    while done < statements:
+        group = [random_statement(rng) for _ in range(rng.choice([1, 1, 1, 4]))]
+        report({'begin': group})
+        if len(group) == 1:
+            engine.execute(statement_sql(group[0]))
+        else:
+            with engine.batch():
+                for statement in group:
+                    engine.execute(statement_sql(statement))
+        report({'ack': True})
+        done += len(group)
+
+
+def read_report(path):
+    """Parent: (acknowledged groups, the group in flight or None) from a child's output"""
+    acknowledged = []
+    in_flight = None
+    with open(path) as f:
+        for line in f:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                # Cut short by the kill; its group had not started
+                continue
+            if 'begin' in message:
+                in_flight = message['begin']
+            elif 'ack' in message:
+                acknowledged.append(in_flight)
+                in_flight = None
+    return acknowledged, in_flight
+
+
+def _wait_ready(path, timeout=30.0):
+    """Wait until the child has created its tables"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with open(path) as f:
+            if '"ready"' in f.read():
+                return
+        time.sleep(0.01)
+
+
+def _contents(engine):
+    """table -> sorted rows"""
+    return {table: sorted(engine.query(f"SELECT * FROM {table}")[1]) for table in TABLES}
+
+
+def _replayed(engine, table):
+    """A table's rows as its checkpoint and the transactions committed after it give them"""
+    checkpoint = changelog.read_checkpoint(engine.storage, table)
+    committed, _, _ = changelog.scan(engine.storage, table, checkpoint['offset'])
+    changes = [change for commit, changes in committed if commit['seq'] > checkpoint['seq'] for change in changes]
+    return sorted(changelog.apply_changes(checkpoint['rows'], changes))
+
+
+def verify(data_dir, candidates):
+    """Open a crashed database and check it; returns (problems, tables rebuilt)"""
+    problems = []
+    engine = DatabaseEngine(data_dir)
+    recovered = engine.metrics.snapshot()['counters'].get('tables_recovered', 0)
+    contents = _contents(engine)
+    for table in TABLES:
+        if contents[table] not in candidates[table]:
+            problems.append(f"{table} matches neither the acknowledged statements nor any prefix "
+                            f"of the ones in flight")
+        # Subscribers and replicas see the table through its log
+        if _replayed(engine, table) != contents[table]:
+            problems.append(f"{table} differs from what its checkpoint and log replay to")
+        # A write after recovery must not run into anything the crash left behind
+        engine.execute(f"INSERT INTO {table} VALUES (100, after)")
+        contents[table] = sorted(contents[table] + [('100', 'after')])
+    engine.close()
+
+    reopened = DatabaseEngine(data_dir)
+    if reopened.metrics.snapshot()['counters'].get('tables_recovered', 0):
+        problems.append("second open recovered again")
+    if _contents(reopened) != contents:
+        problems.append("second open sees different rows")
+    reopened.close()
+    return problems, recovered
+
+
+def run_once(seed, statements, point):
+    """One crash and recovery; returns (problems, description)"""
+    rng = random.Random(seed)
+    # Early enough that the child gets there; checkpoints come every CHECKPOINT_EVERY log entries
+    countdown = rng.randint(1, 3 if point == 'after_checkpoint' else max(1, statements // 4))
+    work_dir = tempfile.mkdtemp(prefix='dbcrash-')
+    try:
+        data_dir = os.path.join(work_dir, 'data')
+        out_path = os.path.join(work_dir, 'child.out')
+        err_path = os.path.join(work_dir, 'child.err')
+        with open(out_path, 'w') as out, open(err_path, 'w') as err:
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), '--child', data_dir, '--seed', str(seed),
+                 '--statements', str(statements), '--crash-point', point,
+                 '--countdown', str(countdown)],
+                stdout=out, stderr=err)
+        if point == 'kill':
+            _wait_ready(out_path)
+            time.sleep(rng.uniform(0.0, 0.5))
+            process.kill()
+        status = process.wait()
+
+        if status not in (0, CRASH_STATUS, -9):
+            with open(err_path) as f:
+                return [f"child failed with status {status}: {f.read().strip()[-300:]}"], ''
+        acknowledged, in_flight = read_report(out_path)
+
+        model = {table: [] for table in TABLES}
+        for group in acknowledged:
+            for statement in group:
+                apply_statement(model, statement)
+        # Each statement commits on its own: a crash in a batch's flush can
+        # leave any prefix of the batch's statements on each table committed
+        candidates = {table: [sorted(rows)] for table, rows in model.items()}
+        for statement in in_flight or []:
+            apply_statement(model, statement)
+            table = statement[1]
+            candidates[table].append(sorted(model[table]))
+
+        try:
+            problems, recovered = verify(data_dir, candidates)
+        except Exception as error:
+            return [f"reopening failed: {error!r}"], ''
+
+        flight = len(in_flight) if in_flight else 0
+        description = (f"exit {status}, {sum(len(group) for group in acknowledged)} acknowledged, "
+                       f"{flight} in flight, {recovered} table(s) rebuilt")
+        return problems, description
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Crash the engine mid-write and check that it recovers")
+    arg_parser.add_argument('--runs', type=int, default=30)
+    arg_parser.add_argument('--seed', type=int, default=1)
+    arg_parser.add_argument('--statements', type=int, default=80,
+                            help="statements each child runs if it is not crashed first")
+    arg_parser.add_argument('--points', nargs='+', choices=CRASH_POINTS, default=CRASH_POINTS)
+    # Set by the parent for its child process
+    arg_parser.add_argument('--child', help=argparse.SUPPRESS)
+    arg_parser.add_argument('--crash-point', choices=CRASH_POINTS, help=argparse.SUPPRESS)
+    arg_parser.add_argument('--countdown', type=int, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args(argv)
+
+    if args.child:
+        child(args.child, args.seed, args.statements, args.crash_point, args.countdown)
+        return 0
+
+    failures = 0
+    for run in range(args.runs):
+        point = args.points[run % len(args.points)]
+        problems, description = run_once(args.seed + run, args.statements, point)
+        if problems:
+            failures += 1
+            print(f"run {run:>3}  {point:<16} FAILED: {'; '.join(problems)}")
+        else:
+            print(f"run {run:>3}  {point:<16} ok ({description})")
+    print(f"\n{args.runs - failures}/{args.runs} runs recovered correctly")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""
+PEP 249 (DB-API 2.0) interface to the database engine.
+
+Cursors are server-side: rows are pulled from the engine's lazy result
+iterator as fetchone/fetchmany/fetchall ask for them, so a large SELECT is
+never materialized or formatted as text. Values are returned as strings
+because tables are untyped; each row is a tuple.
+
+    import dbapi
+    conn = dbapi.connect('data')
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM students WHERE age = ?", (20,))
+    for (name,) in cur:
+        print(name)
+"""
+import datetime
+import re
+import time
+
+from engine import DatabaseEngine
+
+apilevel = '2.0'
+threadsafety = 1
+paramstyle = 'qmark'
+
+
+class Warning(Exception):
+    pass
+
+
+class Error(Exception):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class DataError(DatabaseError):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class IntegrityError(DatabaseError):
+    pass
+
+
+class InternalError(DatabaseError):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+class NotSupportedError(DatabaseError):
+    pass
+
+
+class _TypeObject:
+    """Compares equal to any of the type codes it groups"""
+    
+    def __init__(self, *values):
+        self.values = values
+    
+    def __eq__(self, other):
+        return other in self.values
+    
+    def __hash__(self):
+        return hash(self.values)
+
+
+STRING = _TypeObject('STRING')
+BINARY = _TypeObject('BINARY')
+NUMBER = _TypeObject('NUMBER')
+DATETIME = _TypeObject('DATETIME')
+ROWID = _TypeObject('ROWID')
+
+Date = datetime.date
+Time = datetime.time
+Timestamp = datetime.datetime
+Binary = bytes
+
+
+def DateFromTicks(ticks):
+    return Date(*time.localtime(ticks)[:3])
+
+
+def TimeFromTicks(ticks):
+    return Time(*time.localtime(ticks)[3:6])
+
+
+def TimestampFromTicks(ticks):
+    return Timestamp(*time.localtime(ticks)[:6])
+
+
+_ROWCOUNT_PATTERN = re.compile(r'^(\d+) row')
+
+
+def _quote(value):
+    """Render a Python value as a SQL literal"""
+    if value is None:
+        text = ''
+    elif isinstance(value, bytes):
+        text = value.decode('utf-8')
+    else:
+        text = str(value)
+    # Table files are comma separated with one row per line
+    if ',' in text or '\n' in text or "'" in text:
+        raise DataError(f"Value cannot contain commas, quotes or newlines: {text!r}")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return text
+    return f"'{text}'"
+
+
+def _bind(operation, parameters):
+    """Substitute qmark parameters outside of quoted strings"""
+    if parameters is None:
+        parameters = ()
+    parameters = list(parameters)
+    parts = []
+    index = 0
+    quote_char = None
+    for char in operation:
+        if quote_char:
+            if char == quote_char:
+                quote_char = None
+        elif char in ('"', "'"):
+            quote_char = char
+        elif char == '?':
+            if index >= len(parameters):
+                raise ProgrammingError("Not enough parameters for the statement")
+            parts.append(_quote(parameters[index]))
+            index += 1
+            continue
+        parts.append(char)
+    if index != len(parameters):
+        raise ProgrammingError(f"Statement takes {index} parameter(s), {len(parameters)} given")
+    return ''.join(parts)
+
+
+class Connection:
+    
+    def __init__(self, engine):
+        self._engine = engine
+        self._closed = False
+    
+    def _check(self):
+        if self._closed:
+            raise InterfaceError("Connection is closed")
+    
+    def cursor(self):
+        """Return a new cursor"""
+        self._check()
+        return Cursor(self)
+    
+    def commit(self):
+        """Statements are applied immediately; nothing to commit"""
+        self._check()
+    
+    def rollback(self):
+        """Transactions are not supported"""
+        self._check()
+        raise NotSupportedError("Transactions are not supported")
+    
+    def close(self):
+        """Close the connection"""
+        self._closed = True
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Cursor:
+    
+    def __init__(self, connection):
+        self.connection = connection
+        self.arraysize = 1
+        self.description = None
+        self.rowcount = -1
+        self._rows = None
+        self._fetched = 0
+        self._closed = False
+    
+    def _check(self):
+        if self._closed:
+            raise InterfaceError("Cursor is closed")
+        self.connection._check()
+    
+    def execute(self, operation, parameters=None):
+        """Execute a statement; SELECT rows are fetched lazily"""
+        self._check()
+        sql = _bind(operation, parameters)
+        try:
+            columns, rows, message = self.connection._engine.query(sql)
+        except ValueError as e:
+            raise ProgrammingError(str(e)) from e
+        except OSError as e:
+            raise OperationalError(str(e)) from e
+        
+        self._fetched = 0
+        if columns is None:
+            self.description = None
+            self._rows = None
+            match = _ROWCOUNT_PATTERN.match(message or '')
+            self.rowcount = int(match.group(1)) if match else -1
+        else:
+            self.description = [(name, STRING, None, None, None, None, None) for name in columns]
+            self._rows = rows
+            # Unknown until the result has been read to the end
+            self.rowcount = -1
+        return self
+    
+    def executemany(self, operation, seq_of_parameters):
+        """Execute a statement once per parameter sequence, parsed once and run as one batch"""
+        self._check()
+        rows = []
+        for parameters in seq_of_parameters:
+            parameters = tuple(parameters)
+            for value in parameters:
+                _quote(value)
+            rows.append(parameters)
+        try:
+            results = self.connection._engine.executemany(operation, rows)
+        except ValueError as e:
+            raise ProgrammingError(str(e)) from e
+        except OSError as e:
+            raise OperationalError(str(e)) from e
+        
+        total = 0
+        for message in results:
+            match = _ROWCOUNT_PATTERN.match(message or '')
+            if match:
+                total += int(match.group(1))
+        self._fetched = 0
+        self.description = None
+        self._rows = None
+        self.rowcount = total
+        return self
+    
+    def _result(self):
+        self._check()
+        if self._rows is None:
+            raise ProgrammingError("No result set; execute a SELECT first")
+        return self._rows
+    
+    def fetchone(self):
+        """Return the next row as a tuple, or None"""
+        rows = self._result()
+        try:
+            row = next(rows)
+        except StopIteration:
+            self.rowcount = self._fetched
+            return None
+        except ValueError as e:
+            raise ProgrammingError(str(e)) from e
+        self._fetched += 1
+        return tuple(row)
+    
+    def fetchmany(self, size=None):
+        """Return up to size rows (default arraysize)"""
+        if size is None:
+            size = self.arraysize
+        result = []
+        while len(result) < size:
+            row = self.fetchone()
+            if row is None:
+                break
+            result.append(row)
+        return result
+    
+    def fetchall(self):
+        """Return all remaining rows"""
+        result = []
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return result
+            result.append(row)
+    
+    def setinputsizes(self, sizes):
+        pass
+    
+    def setoutputsize(self, size, column=None):
+        pass
+    
+    def close(self):
+        """Close the cursor and release its result"""
+        self._closed = True
+        self._rows = None
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def connect(data_dir='data', engine=None):
+    """Open a connection on a data directory, or wrap an existing engine"""
+    if engine is None:
+        engine = DatabaseEngine(data_dir)
+    return Connection(engine)
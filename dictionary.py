@@ -0,0 +1,89 @@
+"""
+Dictionary encoding for low-cardinality columns.
+
+An encoded column stores a small integer code in each row instead of the
+value; the code is a position in the column's dictionary, a list of values
+kept in the table's catalog entry under 'dictionary'. Dictionaries only
+grow: new values are added before any row using them is written, and a
+column set back to plain storage keeps its dictionary, so every version of
+the table file - including one a reader or snapshot still has open - can be
+decoded with the current catalog. Each file's header line marks the columns
+that hold codes in that version with ENCODED_SUFFIX.
+
+Decoding hands out the dictionary's own str objects, so a value repeated over
+many rows is held in memory once. A predicate on an encoded column is
+evaluated once per dictionary value, and rows are then matched on their code.
+"""
+ENCODED_SUFFIX = ':dict'
+# Beyond this many distinct values a column is no longer low-cardinality
+MAX_DICTIONARY_SIZE = 65536
+
+
+def parse_header(header):
+    """Split a header line into (column names, indices of encoded columns)"""
+    columns = header.strip().split(',')
+    encoded = []
+    for i, column in enumerate(columns):
+        if column.endswith(ENCODED_SUFFIX):
+            columns[i] = column[:-len(ENCODED_SUFFIX)]
+            encoded.append(i)
+    return columns, encoded
+
+
+def format_header(columns, encoded_columns):
+    """Header fields for a file whose encoded_columns hold codes"""
+    return [column + ENCODED_SUFFIX if column in encoded_columns else column for column in columns]
+
+
+class RowCodec:
+    """Decodes the rows of one table file version"""
+    
+    def __init__(self, columns, encoded, dictionaries):
+        self.slots = [(i, dictionaries[columns[i]]) for i in encoded]
+        self.values = {i: values for i, values in self.slots}
+    
+    def decode(self, row):
+        """Replace the codes in a raw row (a list) with their values; returns the row as a tuple"""
+        for i, values in self.slots:
+            row[i] = values[int(row[i])]
+        return tuple(row)
+    
+    def matcher(self, col_idx, predicate):
+        """Test raw rows on an encoded column's code; None if the column is not encoded.
+        
+        predicate is called once per dictionary value.
+        """
+        values = self.values.get(col_idx)
+        if values is None:
+            return None
+        codes = {str(code) for code, value in enumerate(values) if predicate(value)}
+        return lambda row: row[col_idx] in codes
+
+
+def encode_rows(columns, rows, encoded_columns, dictionaries):
+    """Encode rows for a file whose encoded_columns hold codes.
+
+    New values are appended to dictionaries, which must then be saved before
+    the rows are written. Returns (encoded rows, whether dictionaries changed).
+    """
+    slots = []
+    for column in encoded_columns:
+        values = dictionaries.setdefault(column, [])
+        slots.append((columns.index(column), column, values, {value: code for code, value in enumerate(values)}))
+
+    changed = False
+    encoded = []
+    for row in rows:
+        row = list(row)
+        for i, column, values, codes in slots:
+            code = codes.get(row[i])
+            if code is None:
+                if len(values) >= MAX_DICTIONARY_SIZE:
+                    raise ValueError(f"Column '{column}' has more than {MAX_DICTIONARY_SIZE} distinct values; "
+                                     f"set its encoding to PLAIN")
+                code = codes[row[i]] = len(values)
+                values.append(row[i])
+                changed = True
+            row[i] = str(code)
+        encoded.append(row)
+    return encoded, changed
@@ -1,18 +1,384 @@
 
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import aggregates
+import changelog
+import memory
+import partitions
+import planner
+from cache import ResultCache
+from indexes import INDEX_TYPES, create_index
+from metrics import Metrics
 from parser import SQLParser
-from storage import Storage
+from storage import BatchStorage, FileStorage, MemoryStorage
+
+# data_dir that selects the in-memory backend
+MEMORY = ':memory:'
 
 
 class DatabaseEngine:
-    
-    def __init__(self):
-        self.storage = Storage()
+
+    def __init__(self, data_dir='data', metrics_path=None, metrics_interval=10.0, slow_query_log=None,
+                 parallel_workers=None, result_cache_bytes=0, storage=None,
+                 memory_limit=memory.DEFAULT_MEMORY_LIMIT, query_memory_limit=memory.DEFAULT_QUERY_MEMORY_LIMIT,
+                 spill_dir=None, checkpoint_every=10000, lock_timeout=10.0):
+        """Open a database in data_dir, in memory for ':memory:', or on a given StorageBackend.
+        
+        memory_limit bounds what all running queries may hold for sorting and
+        grouping, query_memory_limit what each one may; past them, rows spill
+        to temp files in spill_dir. None means unlimited. A table with its
+        change log on is checkpointed every checkpoint_every log entries (None:
+        only on CHECKPOINT), and rebuilt from its checkpoint and log here if a
+        crash left it behind. A batch waits at most lock_timeout seconds for
+        a table it did not lock up front (None: for ever).
+        """
+        self.metrics = Metrics(metrics_path, metrics_interval)
+        if storage is None:
+            storage = MemoryStorage() if data_dir == MEMORY else FileStorage(data_dir)
+        if storage.metrics is None:
+            storage.metrics = self.metrics
+        self._storage = storage
         self.parser = SQLParser()
+        self.slow_query_log = slow_query_log
+        self.parallel_workers = parallel_workers or min(4, os.cpu_count() or 1)
+        self._local = threading.local()
+        self.memory = memory.MemoryGovernor(memory_limit, query_memory_limit, spill_dir, self.metrics)
+        self._indexes = {}
+        self._index_lock = threading.Lock()
+        self._pool = None
+        self.checkpoint_every = checkpoint_every
+        self.lock_timeout = lock_timeout
+        
+        # Opt-in SELECT result cache; 0 disables it
+        self.result_cache = None
+        if result_cache_bytes:
+            self.result_cache = ResultCache(result_cache_bytes)
+            self.storage.add_write_listener(self._invalidate_cached)
+        
+        self._recover()
+    
+    @property
+    def storage(self):
+        """The backend statements run against: the current thread's batch, if any"""
+        batch = getattr(self._local, 'batch', None)
+        return batch if batch is not None else self._storage
+    
+    def snapshot(self):
+        """Context manager: statements in the block read the tables and their catalog as they are now.
+        
+        Opening it waits for statements writing a table to finish; after that
+        writers are never blocked and never seen. Writes inside the block
+        raise ValueError.
+        """
+        return self.storage.snapshot()
+    
+    def subscribe(self, table, from_seq=1):
+        """Follow a table's change log: a ChangeLogReader of the changes committed from from_seq on"""
+        if not self._storage.table_exists(table):
+            raise ValueError(f"Table '{table}' does not exist")
+        log = self._storage.read_meta(table).get('change_log')
+        if log is None:
+            raise ValueError(f"Table '{table}' has no change log; use ALTER TABLE {table} SET CHANGE LOG ON")
+        # Changes past the last checkpoint lie past its offset: no need to read the log before it
+        checkpoint = log.get('checkpoint')
+        offset = checkpoint['offset'] if checkpoint and from_seq > checkpoint['seq'] else 0
+        return changelog.ChangeLogReader(
+            lambda offset: self._storage.read_aux(table, changelog.LOG_SUFFIX, offset), from_seq, offset)
+    
+    def checkpoint(self, table=None):
+        """Checkpoint a table, or every table with its change log on; returns the tables checkpointed"""
+        if table is not None:
+            if not self._storage.table_exists(table):
+                raise ValueError(f"Table '{table}' does not exist")
+            if not self._storage.read_meta(table).get('change_log', {}).get('enabled'):
+                raise ValueError(f"Table '{table}' has no change log; use ALTER TABLE {table} SET CHANGE LOG ON")
+            tables = [table]
+        else:
+            tables = [name for name in self.list_tables()
+                      if self.storage.read_meta(name).get('change_log', {}).get('enabled')]
+        for name in tables:
+            self._checkpoint(name)
+        return tables
+    
+    def _checkpoint(self, table):
+        """Save a logged table's rows and the length of its log, so recovery replays only what follows"""
+        with self.storage.lock_table(table):
+            meta = self.storage.read_meta(table)
+            log = meta['change_log']
+            offset = changelog.log_length(self.storage, table, log.get('checkpoint', {}).get('offset', 0))
+            columns, rows = self._read_rows(table)
+            seq = changelog.write_checkpoint(self.storage, table, columns, rows, offset)
+            changelog.mark(self.storage, table, self._table_signature(table))
+            log['checkpoint'] = {'seq': seq, 'offset': offset}
+            self.storage.write_meta(table, meta)
+        self.metrics.inc('checkpoints')
+    
+    def _recover(self):
+        """Crash recovery: bring every table with its change log on back in line with its log"""
+        for table in self.list_tables():
+            log = self._storage.read_meta(table).get('change_log')
+            if not (log and log['enabled']):
+                continue
+            if 'checkpoint' not in log:
+                # Turned on before checkpoints were taken: start from the table as it is
+                self._checkpoint(table)
+                continue
+            self._recover_table(table, log)
+    
+    def _recover_table(self, table, log):
+        """Rebuild a table from its checkpoint and log if a crash left them apart; returns whether it did"""
+        with self.storage.lock_table(table):
+            committed, open_transactions, last_outcome = changelog.scan(
+                self.storage, table, log['checkpoint']['offset'])
+            try:
+                intact = last_outcome is not None and last_outcome.get('signature') == self._table_signature(table)
+            except ValueError:
+                # One of its files is missing
+                intact = False
+            if intact and not open_transactions:
+                return False
+            
+            try:
+                checkpoint = changelog.read_checkpoint(self.storage, table)
+            except ValueError as e:
+                raise ValueError(f"Cannot recover table '{table}': {e}") from None
+            if checkpoint is None:
+                raise ValueError(f"Cannot recover table '{table}': its checkpoint is missing")
+            changes = [change for commit, tx_changes in committed if commit['seq'] > checkpoint['seq']
+                       for change in tx_changes]
+            self._write_all_rows(table, checkpoint['columns'], changelog.apply_changes(checkpoint['rows'], changes))
+            signature = self._table_signature(table)
+            # Whatever a crashed statement wrote is gone again
+            for tx in open_transactions:
+                changelog.mark(self.storage, table, signature, tx=tx, outcome='abort')
+            changelog.mark(self.storage, table, signature)
+        self.metrics.inc('tables_recovered')
+        self.metrics.inc('log_entries_replayed', len(changes))
+        return True
+    
+    def _mark_log(self, table):
+        """Record a table's signature in its log, if it is on, after writes outside a logged statement"""
+        with self.storage.lock_table(table):
+            if self.storage.table_exists(table) and \
+                    self.storage.read_meta(table).get('change_log', {}).get('enabled'):
+                changelog.mark(self.storage, table, self._table_signature(table))
+    
+    def list_tables(self):
+        """Return the names of the user-visible tables, sorted"""
+        # Partitions are listed under their table by DESCRIBE
+        return [table for table in self.storage.list_tables() if not partitions.is_partition(table)]
+    
+    def close(self):
+        """Stop the parallel scan worker processes"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+    
+    def _invalidate_cached(self, table):
+        """Write listener: drop cached results of a table, or of a partition's parent"""
+        self.result_cache.invalidate(table.split(partitions.PARTITION_SEPARATOR)[0])
+    
+    @contextmanager
+    def batch(self, tables=()):
+        """Context manager: run the block's statements as one batch.
+        
+        Each table the batch touches is read once, kept in memory and written
+        back once when the block ends - also if it raises, so the statements
+        that ran take effect just as they would one at a time. If writing
+        back fails after the block raised, the block's error is still the one
+        raised, with a note on the failed write. Tables stay locked against
+        other writers until then. Batches are per thread; nesting reuses the
+        outer one.
+        
+        tables are locked on entry, in name order, so batches naming the
+        tables they use cannot deadlock each other. Any other table is locked
+        when first used, waiting at most lock_timeout seconds if the batch
+        already holds a lock; a statement that times out raises ValueError.
+        """
+        batch = getattr(self._local, 'batch', None)
+        if batch is not None:
+            batch.lock_tables(tables)
+            yield
+            return
+        
+        batch = BatchStorage(self._storage, self.lock_timeout)
+        self._local.batch = batch
+        try:
+            batch.lock_tables(tables)
+            yield
+        except BaseException as error:
+            self._local.batch = None
+            try:
+                self._finish_batch(batch)
+            except Exception as flush_error:
+                error.add_note(f"Writing back the batch also failed: {flush_error!r}")
+            raise
+        else:
+            self._local.batch = None
+            self._finish_batch(batch)
+    
+    def _finish_batch(self, batch):
+        """Write a batch back and mark the change logs of the tables it wrote"""
+        batch.flush()
+        # Commits logged in the batch carry its in-memory signatures, not the files'
+        for table in sorted({name.split(partitions.PARTITION_SEPARATOR)[0] for name in batch.written}):
+            self._mark_log(table)
     
     def execute(self, command):
         """Execute a SQL command"""
-        parsed = self.parser.parse(command)
+        return self._run(command)
+    
+    def execute_script(self, script):
+        """Execute semicolon-separated statements as one batch.
+        
+        Returns [(statement, result, seconds), ...]. On an error the
+        statements before it still take effect and the error is raised.
+        """
+        return list(self.iter_script(script))
+    
+    def iter_script(self, script):
+        """Like execute_script, but yield each (statement, result, seconds) as it finishes"""
+        # Parse up to the first error, so the tables used can be locked up front
+        statements = []
+        for command in self.parser.split_statements(script):
+            try:
+                statements.append((command, self.parser.parse(command)))
+            except ValueError:
+                statements.append((command, None))
+                break
+        with self.batch(self._statement_tables(parsed for _, parsed in statements)):
+            for command, parsed in statements:
+                start = time.perf_counter()
+                result = self._run(command, parsed)
+                yield command, result, time.perf_counter() - start
+    
+    def executemany(self, command, param_rows):
+        """Execute a statement with ? placeholders once per parameter row.
+        
+        The statement is parsed once and the rows run as one batch; returns
+        the result of each execution.
+        """
+        template = self.parser.parse_template(command)
+        results = []
+        with self.batch(self._statement_tables([template[0]])):
+            for parameters in param_rows:
+                results.append(self._run(command, self.parser.bind(template, parameters)))
+        return results
+    
+    def _statement_tables(self, statements):
+        """The tables parsed statements lock: their tables and views, views' sources and partitions"""
+        tables = set()
+        for parsed in statements:
+            if parsed is None:
+                continue
+            if parsed['type'] == 'EXPLAIN':
+                parsed = parsed['statement']
+            for name in (parsed.get('table'), parsed.get('view')):
+                if name is not None:
+                    tables.add(name)
+            if 'select' in parsed:
+                tables.add(parsed['select']['table'])
+        # Read unlocked from the backing store: a batch would lock what it reads
+        for name in list(tables):
+            source = self._view_source(self._storage.read_meta(name).get('view'))
+            if source is not None:
+                tables.add(source)
+        for name in list(tables):
+            scheme = self._storage.read_meta(name).get('partitioning')
+            for partition in scheme['partitions'] if scheme else []:
+                tables.add(partitions.physical_name(name, partition['name']))
+        return tables
+    
+    def _run(self, command, parsed=None):
+        """Execute one statement, parsing it unless already parsed"""
+        stats = self._begin_statement(command)
+        try:
+            if parsed is None:
+                parsed = self.parser.parse(command)
+            stats['parsed'] = parsed
+            result = self._execute_parsed(parsed)
+        except Exception as e:
+            self._end_statement(stats, e)
+            raise
+        self._end_statement(stats)
+        return result
+    
+    def query(self, command):
+        """Execute a SQL command and return (columns, rows, message).
+        
+        SELECT returns its column names and a lazy iterator over the result
+        rows; other statements return no columns and their status message.
+        """
+        stats = self._begin_statement(command)
+        try:
+            parsed = stats['parsed'] = self.parser.parse(command)
+            if parsed['type'] == 'SELECT':
+                columns, rows = self._select_rows(parsed)
+                return columns, self._track_rows(rows, stats), None
+            result = self._execute_parsed(parsed)
+        except Exception as e:
+            self._end_statement(stats, e)
+            raise
+        self._end_statement(stats)
+        return None, iter(()), result
+    
+    def _track_rows(self, rows, stats):
+        """Yield SELECT rows, finishing the statement once the caller is done with them"""
+        count = 0
+        error = None
+        try:
+            for row in rows:
+                count += 1
+                yield row
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._count_returned(count, stats)
+            self._end_statement(stats, error)
+    
+    def _begin_statement(self, command):
+        """Start per-statement bookkeeping for metrics and the slow query log"""
+        stats = {'sql': command, 'parsed': None, 'rows_scanned': 0, 'rows_returned': 0,
+                 'start': time.perf_counter()}
+        self._local.stats = stats
+        return stats
+    
+    def _end_statement(self, stats, error=None):
+        """Record a finished statement"""
+        duration = time.perf_counter() - stats['start']
+        parsed = stats['parsed']
+        statement_type = parsed['type'] if parsed else 'UNKNOWN'
+        self.metrics.observe_statement(statement_type, duration, failed=error is not None)
         
+        if self.slow_query_log is not None and self.slow_query_log.should_log(duration):
+            self.slow_query_log.record(stats['sql'], duration, stats['rows_scanned'], stats['rows_returned'],
+                                       self._describe_plan(parsed), statement_type,
+                                       error=str(error) if error is not None else None)
+    
+    def _count_scanned(self, count):
+        """Count rows read from storage by the current statement"""
+        self.metrics.inc('rows_scanned', count)
+        stats = getattr(self._local, 'stats', None)
+        if stats is not None:
+            stats['rows_scanned'] += count
+    
+    def _count_returned(self, count, stats=None):
+        """Count rows handed back to the caller"""
+        self.metrics.inc('rows_returned', count)
+        stats = stats or getattr(self._local, 'stats', None)
+        if stats is not None:
+            stats['rows_returned'] += count
+    
+    def _execute_parsed(self, parsed):
+        """Dispatch a parsed command to its executor"""
         if parsed['type'] == 'CREATE':
             return self._execute_create(parsed)
         elif parsed['type'] == 'DROP':
@@ -31,30 +397,179 @@ class DatabaseEngine:
             return self._execute_update(parsed)
         elif parsed['type'] == 'TRUNCATE':
             return self._execute_truncate(parsed)
+        elif parsed['type'] == 'EXPLAIN':
+            return self._execute_explain(parsed)
+        elif parsed['type'] == 'SHOW_STATS':
+            return self.metrics.format_text()
+        elif parsed['type'] == 'ANALYZE':
+            return self._execute_analyze(parsed)
+        elif parsed['type'] == 'CHECKPOINT':
+            tables = self.checkpoint(parsed['table'])
+            return f"Checkpointed {len(tables)} table(s)."
+        elif parsed['type'] == 'CREATE_INDEX':
+            return self._execute_create_index(parsed)
+        elif parsed['type'] == 'DROP_INDEX':
+            return self._execute_drop_index(parsed)
+        elif parsed['type'] == 'CREATE_VIEW':
+            return self._execute_create_view(parsed)
+        elif parsed['type'] == 'REFRESH_VIEW':
+            return self._execute_refresh_view(parsed)
+        elif parsed['type'] == 'DROP_VIEW':
+            return self._execute_drop_view(parsed)
+        elif parsed['type'] == 'ALTER_PARTITION':
+            return self._execute_alter_partition(parsed)
+        elif parsed['type'] == 'ALTER_ENCODING':
+            return self._execute_alter_encoding(parsed)
+        elif parsed['type'] == 'ALTER_CHANGE_LOG':
+            return self._execute_alter_change_log(parsed)
     
     def _execute_create(self, parsed):
         """Execute CREATE TABLE"""
-        self.storage.create_table(parsed['table'], parsed['columns'])
-        return f"Table '{parsed['table']}' created successfully."
+        scheme = parsed.get('partitioning')
+        if scheme is None:
+            self.storage.create_table(parsed['table'], parsed['columns'])
+            return f"Table '{parsed['table']}' created successfully."
+        
+        if scheme['column'] not in parsed['columns']:
+            raise ValueError(f"Column '{scheme['column']}' does not exist")
+        partitions.validate(scheme)
+        with self.storage.lock_table(parsed['table']):
+            # The parent keeps the header and the scheme; partitions hold the rows
+            self.storage.create_table(parsed['table'], parsed['columns'])
+            for partition in scheme['partitions']:
+                self.storage.create_table(partitions.physical_name(parsed['table'], partition['name']),
+                                          parsed['columns'])
+            meta = self.storage.read_meta(parsed['table'])
+            meta['partitioning'] = scheme
+            self.storage.write_meta(parsed['table'], meta)
+        return (f"Table '{parsed['table']}' created successfully "
+                f"with {len(scheme['partitions'])} {scheme['kind']} partition(s).")
     
     def _execute_drop(self, parsed):
         """Execute DROP TABLE"""
-        import os
-        if not self.storage.table_exists(parsed['table']):
-            raise ValueError(f"Table '{parsed['table']}' does not exist")
-        
-        path = self.storage._get_table_path(parsed['table'])
-        os.remove(path)
+        self._drop_table(parsed['table'])
         return f"Table '{parsed['table']}' dropped successfully."
     
+    def _drop_table(self, table):
+        """Drop a table and its partitions, and forget its loaded indexes.
+        
+        Dropping a materialized view stops its source tracking rewrites once
+        no other view reads from it.
+        """
+        with self.storage.lock_table(table):
+            meta = self.storage.read_meta(table)
+            scheme = meta.get('partitioning')
+            if scheme is not None:
+                for partition in scheme['partitions']:
+                    self.storage.drop_table(partitions.physical_name(table, partition['name']))
+            self.storage.drop_table(table)
+        with self._index_lock:
+            for key in [key for key in self._indexes if key[0] == table]:
+                del self._indexes[key]
+        
+        source = self._view_source(meta.get('view'))
+        if source is not None and self.storage.table_exists(source) and not any(
+                self._view_source(self.storage.read_meta(other).get('view')) == source
+                for other in self.list_tables()):
+            self.storage.untrack_rewrites(source)
+    
+    def _partitioning(self, table):
+        """Return a table's partitioning scheme, or None if it is not partitioned"""
+        return self.storage.read_meta(table).get('partitioning')
+    
+    @contextmanager
+    def _partitions_snapshot(self, table):
+        """Read a partitioned table's scheme and partitions in the block as one version.
+        
+        Its partitions are separate files that a statement may change one
+        after the other, e.g. when an UPDATE moves a row between them; a
+        snapshot of the table sees either all of the statement's writes or
+        none. Inside a snapshot or a batch the reads are consistent already.
+        """
+        if (self.storage.in_snapshot() or getattr(self._local, 'batch', None) is not None
+                or self._partitioning(table) is None):
+            yield
+            return
+        with self.storage.snapshot([table]):
+            yield
+    
+    def _read_rows(self, table, names=None):
+        """Read a table's rows, from the named partitions (default all) if it is partitioned"""
+        with self._partitions_snapshot(table):
+            scheme = self._partitioning(table)
+            if scheme is None:
+                return self.storage.read_table(table)
+        
+            columns = self.storage.read_columns(table)
+            if names is None:
+                names = [partition['name'] for partition in scheme['partitions']]
+            rows = []
+            for name in names:
+                rows.extend(self.storage.read_table(partitions.physical_name(table, name))[1])
+            return columns, rows
+    
+    def _write_all_rows(self, table, columns, rows):
+        """Replace a table's rows, routing them to its partitions if it is partitioned"""
+        scheme = self._partitioning(table)
+        if scheme is None:
+            self.storage.write_table(table, columns, rows)
+            return
+        key_idx = columns.index(scheme['column'])
+        contents = {partition['name']: [] for partition in scheme['partitions']}
+        for row in rows:
+            contents[partitions.route(scheme, row[key_idx])].append(row)
+        for name, partition_rows in contents.items():
+            self.storage.write_table(partitions.physical_name(table, name), columns, partition_rows)
+    
+    def _table_signature(self, table):
+        """Signature of a table's data: a partitioned table's covers every partition"""
+        scheme = self._partitioning(table)
+        signature = self.storage.table_signature(table)
+        if scheme is None:
+            return signature
+        return [signature] + [self.storage.table_signature(partitions.physical_name(table, partition['name']))
+                              for partition in scheme['partitions']]
+    
+    @contextmanager
+    def _changes_logged(self, table, changes):
+        """Log a statement's row changes before the block writes them, if the table has its change log on.
+        
+        changes is an iterable of changelog entries, only consumed when they are
+        logged. A block that changes no rows is followed by a mark if it
+        rewrote the table's files, and logs nothing if it did not.
+        """
+        log = self.storage.read_meta(table).get('change_log')
+        if not (log and log['enabled']):
+            yield
+            return
+        transaction = changelog.begin(self.storage, table, changes)
+        before = self._table_signature(table) if transaction is None else None
+        try:
+            yield
+        except BaseException:
+            if transaction is not None:
+                changelog.end(self.storage, table, transaction, 'abort', self._table_signature(table))
+            elif self._table_signature(table) != before:
+                changelog.mark(self.storage, table, self._table_signature(table))
+            raise
+        if transaction is None:
+            signature = self._table_signature(table)
+            if signature != before:
+                changelog.mark(self.storage, table, signature)
+            return
+        changelog.end(self.storage, table, transaction, signature=self._table_signature(table))
+        if self.checkpoint_every is not None and \
+                transaction[1] - log.get('checkpoint', {}).get('seq', 0) >= self.checkpoint_every:
+            self._checkpoint(table)
+    
+    def _check_writable(self, table):
+        """Reject direct writes to a materialized view"""
+        if 'view' in self.storage.read_meta(table):
+            raise ValueError(f"'{table}' is a materialized view; use REFRESH MATERIALIZED VIEW")
+    
     def _execute_show_tables(self):
         """Execute SHOW TABLES"""
-        import os
-        tables = []
-        if os.path.exists(self.storage.data_dir):
-            for file in sorted(os.listdir(self.storage.data_dir)):
-                if file.endswith('.db'):
-                    tables.append(file[:-3])
+        tables = self.list_tables()
         
         if not tables:
             return "No tables found."
@@ -68,98 +583,1045 @@ class DatabaseEngine:
     
     def _execute_describe(self, parsed):
         """Execute DESCRIBE"""
-        columns, rows = self.storage.read_table(parsed['table'])
+        with self._partitions_snapshot(parsed['table']):
+            return self._describe(parsed)
+    
+    def _describe(self, parsed):
+        """Describe a table, its catalog entry and its partitions"""
+        columns, rows = self._read_rows(parsed['table'])
         
         lines = [f"Table: {parsed['table']}", "=" * 40]
         lines.append(f"Columns: {len(columns)}")
         lines.append(f"Rows: {len(rows)}")
+        meta = self.storage.read_meta(parsed['table'])
         lines.append("\nColumn Names:")
         lines.append("-" * 40)
         for i, col in enumerate(columns, 1):
-            lines.append(f"  {i}. {col}")
+            if col in meta.get('encoding', {}):
+                values = len(meta.get('dictionary', {}).get(col, []))
+                lines.append(f"  {i}. {col} (DICTIONARY, {values} value(s))")
+            else:
+                lines.append(f"  {i}. {col}")
+        
+        if 'view' in meta:
+            refreshed = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(meta['view']['refreshed_at']))
+            lines.append(f"\nMaterialized view: {meta['view']['sql']}")
+            lines.append(f"Last refreshed: {refreshed}")
+        
+        log = meta.get('change_log')
+        if log:
+            checkpoint = f", checkpoint at seq {log['checkpoint']['seq']}" if 'checkpoint' in log else ''
+            lines.append(f"\nChange log: {'ON' if log['enabled'] else 'OFF'} "
+                         f"(last seq {changelog.last_seq(self.storage, parsed['table'])}{checkpoint})")
+        
+        indexes = meta.get('indexes', {})
+        if indexes:
+            lines.append("\nIndexes:")
+            lines.append("-" * 40)
+            for name, info in sorted(indexes.items()):
+                options = ', '.join(f"{key} = {value}" for key, value in sorted(info.get('options', {}).items()))
+                lines.append(f"  {name} USING {info['using']} ({info['column']})"
+                             + (f" WITH ({options})" if options else ""))
+        
+        scheme = meta.get('partitioning')
+        if scheme:
+            lines.append(f"\nPartitioned by {scheme['kind']} ({scheme['column']}):")
+            lines.append("-" * 40)
+            for partition in scheme['partitions']:
+                _, partition_rows = self.storage.read_table(partitions.physical_name(parsed['table'],
+                                                                                     partition['name']))
+                bound = ""
+                if scheme['kind'] == 'RANGE':
+                    bound = f" VALUES LESS THAN ({partition['less_than'] or 'MAXVALUE'})"
+                lines.append(f"  {partition['name']}{bound}: {len(partition_rows)} row(s)")
         
         return '\n'.join(lines)
     
     def _execute_truncate(self, parsed):
         """Execute TRUNCATE TABLE"""
-        columns, _ = self.storage.read_table(parsed['table'])
-        self.storage.write_table(parsed['table'], columns, [])
+        with self.storage.lock_table(parsed['table']):
+            self._check_writable(parsed['table'])
+            columns, _ = self.storage.read_table(parsed['table'])
+            scheme = self._partitioning(parsed['table'])
+            with self._changes_logged(parsed['table'], [changelog.truncate()]):
+                if scheme is None:
+                    self.storage.write_table(parsed['table'], columns, [])
+                else:
+                    for partition in scheme['partitions']:
+                        self.storage.write_table(partitions.physical_name(parsed['table'], partition['name']),
+                                                 columns, [])
         return f"Table '{parsed['table']}' truncated successfully."
     
+    def _execute_alter_partition(self, parsed):
+        """Execute ALTER TABLE ... ADD | DROP | TRUNCATE PARTITION"""
+        table = parsed['table']
+        name = parsed['partition']['name']
+        with self.storage.lock_table(table):
+            meta = self.storage.read_meta(table)
+            scheme = meta.get('partitioning')
+            if scheme is None:
+                raise ValueError(f"Table '{table}' is not partitioned")
+            names = [partition['name'] for partition in scheme['partitions']]
+            columns = self.storage.read_columns(table)
+            
+            if parsed['action'] == 'ADD':
+                if scheme['kind'] != 'RANGE':
+                    raise ValueError("ADD PARTITION requires RANGE partitioning")
+                if scheme['partitions'][-1]['less_than'] is None:
+                    raise ValueError(f"Partition '{names[-1]}' already holds every higher value")
+                new_scheme = dict(scheme, partitions=scheme['partitions'] + [parsed['partition']])
+                partitions.validate(new_scheme)
+                with self._changes_logged(table, ()):
+                    self.storage.create_table(partitions.physical_name(table, name), columns)
+                    meta['partitioning'] = new_scheme
+                    self.storage.write_meta(table, meta)
+                return f"Partition '{name}' added to {table}."
+            
+            if name not in names:
+                raise ValueError(f"Partition '{name}' does not exist on table '{table}'")
+            # Rows leave the table with the partition: logged as deletes
+            removed_changes = self._removed_rows_changes(partitions.physical_name(table, name))
+            if parsed['action'] == 'TRUNCATE':
+                with self._changes_logged(table, removed_changes):
+                    self.storage.write_table(partitions.physical_name(table, name), columns, [])
+                return f"Partition '{name}' of {table} truncated."
+            
+            if scheme['kind'] != 'RANGE':
+                # Removing a HASH partition would re-route every other row
+                raise ValueError("DROP PARTITION requires RANGE partitioning")
+            if len(names) == 1:
+                raise ValueError(f"Cannot drop the only partition of '{table}'")
+            with self._changes_logged(table, removed_changes):
+                # Catalog first: a crash then leaves an orphaned file, never a missing one
+                meta = self.storage.read_meta(table)
+                meta['partitioning'] = dict(scheme, partitions=[partition for partition in scheme['partitions']
+                                                                if partition['name'] != name])
+                self.storage.write_meta(table, meta)
+                self.storage.drop_table(partitions.physical_name(table, name))
+        return f"Partition '{name}' dropped from {table}."
+    
+    def _removed_rows_changes(self, table):
+        """Change log entries deleting every row of a table; it is read only if they are logged"""
+        _, rows = self.storage.read_table(table)
+        for row in rows:
+            yield changelog.delete(row)
+    
+    def _execute_alter_encoding(self, parsed):
+        """Execute ALTER TABLE ... ALTER COLUMN ... SET ENCODING DICTIONARY | PLAIN"""
+        table = parsed['table']
+        column = parsed['column']
+        with self.storage.lock_table(table):
+            if not self.storage.table_exists(table):
+                raise ValueError(f"Table '{table}' does not exist")
+            meta = self.storage.read_meta(table)
+            if 'partitioning' in meta:
+                raise ValueError("Partitioned tables cannot be dictionary-encoded")
+            columns, rows = self.storage.read_table(table)
+            if column not in columns:
+                raise ValueError(f"Column '{column}' does not exist")
+            
+            encoding = meta.setdefault('encoding', {})
+            if (encoding.get(column) == 'DICTIONARY') == (parsed['encoding'] == 'DICTIONARY'):
+                # Already stored that way: nothing to rewrite
+                return f"Column '{column}' of {table} is now stored as {parsed['encoding']}."
+            if parsed['encoding'] == 'DICTIONARY':
+                encoding[column] = 'DICTIONARY'
+            else:
+                encoding.pop(column, None)
+            self.storage.write_meta(table, meta)
+            # Rewriting stores the column in its new form
+            with self._changes_logged(table, ()):
+                self.storage.write_table(table, columns, rows)
+        return f"Column '{column}' of {table} is now stored as {parsed['encoding']}."
+    
+    def _execute_alter_change_log(self, parsed):
+        """Execute ALTER TABLE ... SET CHANGE LOG ON | OFF"""
+        table = parsed['table']
+        with self.storage.lock_table(table):
+            if not self.storage.table_exists(table):
+                raise ValueError(f"Table '{table}' does not exist")
+            meta = self.storage.read_meta(table)
+            if 'view' in meta:
+                raise ValueError("A materialized view cannot have a change log")
+            # Turned back on, the log carries on from the last sequence number
+            meta.setdefault('change_log', {})['enabled'] = parsed['enabled']
+            self.storage.write_meta(table, meta)
+            if parsed['enabled']:
+                # Recovery starts from here
+                self._checkpoint(table)
+        return f"Change log of {table} is now {'ON' if parsed['enabled'] else 'OFF'}."
+    
+    def _dictionary_filter(self, table, where):
+        """Whether a scan can match the WHERE clause on dictionary codes"""
+        return where is not None and where['column'] in self.storage.read_meta(table).get('encoding', {})
+    
     def _execute_insert(self, parsed):
         """Execute INSERT INTO"""
-        columns, rows = self.storage.read_table(parsed['table'])
+        with self.storage.lock_table(parsed['table']):
+            self._check_writable(parsed['table'])
+            columns = self.storage.read_columns(parsed['table'])
+            
+            if len(parsed['values']) != len(columns):
+                raise ValueError(f"Column count mismatch. Expected {len(columns)}, got {len(parsed['values'])}")
+            
+            scheme = self._partitioning(parsed['table'])
+            with self._changes_logged(parsed['table'], [changelog.insert(parsed['values'])]):
+                if scheme is not None:
+                    partition = partitions.route(scheme, parsed['values'][columns.index(scheme['column'])])
+                    self.storage.append_row(partitions.physical_name(parsed['table'], partition), parsed['values'])
+                    return "1 row inserted."
+            
+                before = self.storage.table_signature(parsed['table'])
+                offset = self.storage.append_row(parsed['table'], parsed['values'])
+            self._index_appended_row(parsed['table'], before, offset, parsed['values'])
+        return "1 row inserted."
+    
+    def _execute_create_view(self, parsed):
+        """Execute CREATE MATERIALIZED VIEW"""
+        view = parsed['view']
+        if parsed['select']['table'] == view:
+            raise ValueError("A materialized view cannot select from itself")
+        if parsed['select']['order_by']:
+            # Refreshes append new rows, so the order could not be kept
+            raise ValueError("A materialized view cannot use ORDER BY")
+        if parsed['select']['sample']:
+            raise ValueError("A materialized view cannot use TABLESAMPLE")
         
-        if len(parsed['values']) != len(columns):
-            raise ValueError(f"Column count mismatch. Expected {len(columns)}, got {len(parsed['values'])}")
+        with self.storage.lock_table(view):
+            if self.storage.table_exists(view):
+                raise ValueError(f"Table '{view}' already exists")
+            _, _, view_rows = self._refresh_view(view, {'sql': parsed['sql']}, full=True)
+        return f"Materialized view '{view}' created with {view_rows} row(s)."
+    
+    def _execute_refresh_view(self, parsed):
+        """Execute REFRESH MATERIALIZED VIEW"""
+        view = parsed['view']
+        with self.storage.lock_table(view):
+            if not self.storage.table_exists(view):
+                raise ValueError(f"Table '{view}' does not exist")
+            definition = self.storage.read_meta(view).get('view')
+            if definition is None:
+                raise ValueError(f"'{view}' is not a materialized view")
+            mode, processed, view_rows = self._refresh_view(view, definition, full=parsed['full'])
+        return (f"Materialized view '{view}' refreshed ({mode}): "
+                f"{processed} source row(s) processed, {view_rows} row(s) in view.")
+    
+    def _execute_drop_view(self, parsed):
+        """Execute DROP MATERIALIZED VIEW"""
+        view = parsed['view']
+        if not self.storage.table_exists(view):
+            raise ValueError(f"Table '{view}' does not exist")
+        definition = self.storage.read_meta(view).get('view')
+        if definition is None:
+            raise ValueError(f"'{view}' is not a materialized view")
+        self._drop_table(view)
+        return f"Materialized view '{view}' dropped."
+    
+    def _view_source(self, definition):
+        """The table a materialized view definition selects from; None for no definition"""
+        return None if definition is None else self.parser.parse(definition['sql'])['table']
+    
+    def _refresh_view(self, view, definition, full=False):
+        """Bring a view up to date with its source table; the view must be locked.
         
-        self.storage.append_row(parsed['table'], parsed['values'])
-        return "1 row inserted."
+        The view remembers how far into the source file it has read and the
+        source's rewrite_id. While the source has only been appended to since,
+        just the new rows are processed: filtered and projected rows are
+        appended to the view, aggregate states kept in the catalog are
+        extended and the (small) aggregate result rewritten. Any rewrite of
+        the source, or a view file that does not look as the last refresh left
+        it, falls back to a full recomputation.
+        
+        Returns (mode, source rows processed, rows in the view).
+        """
+        select = self.parser.parse(definition['sql'])
+        source = select['table']
+        if 'rewrite_id' not in self.storage.read_meta(source):
+            self.storage.track_rewrites(source)
+        
+        incremental = (not full and 'offset' in definition and self.storage.table_exists(view)
+                       and self.storage.table_signature(view)[1] == definition.get('view_size'))
+        with self.storage.lock_table(source, exclusive=False):
+            meta = self.storage.read_meta(source)
+            rewrite_id = meta.get('rewrite_id')
+            if 'partitioning' in meta:
+                # Offsets are per file, so a partitioned source is always recomputed
+                incremental = False
+                columns, rows = self._read_rows(source)
+                end = None
+            else:
+                incremental = (incremental and definition['offset'] is not None
+                               and definition.get('rewrite_id') == rewrite_id)
+                read = self.storage.read_rows_from(source, definition['offset'] if incremental else None)
+                if read is None:
+                    incremental = False
+                    read = self.storage.read_rows_from(source)
+                columns, _, rows, end = read
+        self._count_scanned(len(rows))
+        processed = len(rows)
+        
+        display_columns, col_indices = self._select_columns(select, columns)
+        if select['where']:
+            if select['where']['column'] not in columns:
+                raise ValueError(f"Column '{select['where']['column']}' does not exist")
+            rows = [row for row in rows if self._matches_where(columns, row, select['where'])]
+        
+        if select['items'] is not None:
+            groups = {}
+            if incremental:
+                for key, states in definition['groups']:
+                    groups[tuple(key)] = [aggregates.load_state(item['func'], state)
+                                          for item, state in zip(select['items'], states)]
+            aggregates.aggregate_rows(columns, rows, select['items'], select['group_by'], groups)
+            view_rows = aggregates.finalize(select['items'], select['group_by'], groups)
+            self.storage.write_table(view, display_columns, view_rows)
+            definition['groups'] = [[list(key), [aggregates.dump_state(item['func'], state)
+                                                 for item, state in zip(select['items'], states)]]
+                                    for key, states in groups.items()]
+            view_count = len(view_rows)
+        else:
+            projected = [[row[i] for i in col_indices] for row in rows]
+            if incremental:
+                self.storage.append_rows(view, projected)
+                view_count = definition['view_rows'] + len(projected)
+            else:
+                self.storage.write_table(view, display_columns, projected)
+                view_count = len(projected)
+        
+        definition.update(rewrite_id=rewrite_id, offset=end, view_rows=view_count,
+                          view_size=self.storage.table_signature(view)[1], refreshed_at=time.time())
+        meta = self.storage.read_meta(view)
+        meta['view'] = definition
+        self.storage.write_meta(view, meta)
+        return 'incremental' if incremental else 'full', processed, view_count
+    
+    def _execute_analyze(self, parsed):
+        """Execute ANALYZE: collect column statistics for the planner"""
+        with self._partitions_snapshot(parsed['table']):
+            scheme = self._partitioning(parsed['table'])
+            names = [parsed['table']]
+            if scheme is not None:
+                names = [partitions.physical_name(parsed['table'], partition['name'])
+                         for partition in scheme['partitions']]
+            size = sum(self.storage.table_signature(name)[1] for name in names)
+            columns, rows = self._read_rows(parsed['table'])
+        self._count_scanned(len(rows))
+        stats = planner.collect_stats(columns, rows)
+        stats['table_bytes'] = size
+        
+        with self.storage.lock_table(parsed['table']):
+            meta = self.storage.read_meta(parsed['table'])
+            meta['stats'] = stats
+            self.storage.write_meta(parsed['table'], meta)
+        return f"Table '{parsed['table']}' analyzed: {len(rows)} row(s), {len(columns)} column(s)."
+    
+    def _execute_create_index(self, parsed):
+        """Execute CREATE INDEX"""
+        table = parsed['table']
+        with self.storage.lock_table(table):
+            columns = self.storage.read_columns(table)
+            if parsed['column'] not in columns:
+                raise ValueError(f"Column '{parsed['column']}' does not exist")
+            
+            meta = self.storage.read_meta(table)
+            if 'partitioning' in meta:
+                raise ValueError("Indexes on partitioned tables are not supported")
+            if parsed['name'] in meta.get('indexes', {}):
+                raise ValueError(f"Index '{parsed['name']}' already exists on table '{table}'")
+            
+            index = create_index(parsed['name'], parsed['using'], parsed['column'], columns.index(parsed['column']),
+                                 parsed['options'])
+            _, signature, located_rows = self.storage.read_table_with_locators(table)
+            self._count_scanned(len(located_rows))
+            index.build(signature, located_rows)
+            self.storage.write_aux(table, f"{parsed['name']}.idx", index.dumps())
+            
+            meta.setdefault('indexes', {})[parsed['name']] = {'column': parsed['column'], 'using': index.kind,
+                                                              'options': index.options}
+            self.storage.write_meta(table, meta)
+        
+        with self._index_lock:
+            self._indexes[(table, parsed['name'])] = index
+        return f"Index '{parsed['name']}' created on {table} ({parsed['column']})."
+    
+    def _execute_drop_index(self, parsed):
+        """Execute DROP INDEX"""
+        table = parsed['table']
+        with self.storage.lock_table(table):
+            meta = self.storage.read_meta(table)
+            if parsed['name'] not in meta.get('indexes', {}):
+                raise ValueError(f"Index '{parsed['name']}' does not exist on table '{table}'")
+            
+            del meta['indexes'][parsed['name']]
+            self.storage.write_meta(table, meta)
+            self.storage.delete_aux(table, f"{parsed['name']}.idx")
+        
+        with self._index_lock:
+            self._indexes.pop((table, parsed['name']), None)
+        return f"Index '{parsed['name']}' dropped."
+    
+    def _get_index(self, table, name, info):
+        """Return an index that matches the current table file.
+        
+        The in-memory copy is used while its signature still matches; otherwise
+        the persisted copy is loaded, and rebuilt from the table if that is
+        stale too.
+        """
+        key = (table, name)
+        with self._index_lock:
+            signature = self.storage.table_signature(table)
+            index = self._indexes.get(key)
+            if index is not None and index.signature == signature:
+                self.metrics.record_cache('index', True)
+                return index
+            self.metrics.record_cache('index', False)
+            
+            columns = self.storage.read_columns(table)
+            index = create_index(name, info['using'], info['column'], columns.index(info['column']),
+                                 info.get('options'))
+            data = self.storage.read_aux(table, f"{name}.idx")
+            if data:
+                index.loads(data)
+            if index.signature != signature:
+                _, signature, located_rows = self.storage.read_table_with_locators(table)
+                index.build(signature, located_rows)
+                self.storage.write_aux(table, f"{name}.idx", index.dumps())
+            self._indexes[key] = index
+            return index
+    
+    def _index_appended_row(self, table, before, offset, row):
+        """Add an appended row to the loaded indexes that were current before the append"""
+        with self._index_lock:
+            loaded = [index for key, index in self._indexes.items() if key[0] == table]
+            if not loaded:
+                return
+            after = self.storage.table_signature(table)
+            for index in loaded:
+                if index.signature == before:
+                    # Entries first, then the signature, so a reader never pairs
+                    # the new signature with a missing row
+                    index.add(offset, row)
+                    index.signature = after
     
     def _execute_select(self, parsed):
         """Execute SELECT"""
-        columns, rows = self.storage.read_table(parsed['table'])
+        display_columns, rows = self._select_rows(parsed)
+        rows = list(rows)
         
-        # Determine which columns to display
-        if parsed['columns'] == ['*']:
-            display_columns = columns
-            col_indices = list(range(len(columns)))
+        # Format output
+        with self._stage('Format', len(rows)) as stage:
+            result = self._format_table(display_columns, rows, list(range(len(display_columns))))
+            stage['rows_out'] = len(rows)
+        self._count_returned(len(rows))
+        return result
+    
+    def _select_rows(self, parsed):
+        """Run a SELECT and return the display columns and a lazy row iterator"""
+        cache_key = None
+        sample = parsed.get('sample')
+        # EXPLAIN ANALYZE always executes for real, a batch's tables are private to it
+        # and a sample without REPEATABLE should differ from run to run
+        if (self.result_cache is not None and getattr(self._local, 'trace', None) is None
+                and getattr(self._local, 'batch', None) is None
+                and (sample is None or sample['seed'] is not None)):
+            cache_key = json.dumps(parsed, sort_keys=True)
+            # Taken before reading, so a concurrent write can only make the entry look stale
+            signature = self._table_signature(parsed['table'])
+            cached = self.result_cache.get(cache_key, signature)
+            self.metrics.record_cache('result', cached is not None)
+            if cached is not None:
+                return cached[0], iter(cached[1])
+        
+        # The plan and the partitions it reads come from the same version; the
+        # files stay open for the rows read after the block
+        with self._partitions_snapshot(parsed['table']):
+            columns = self.storage.read_columns(parsed['table'])
+            if parsed['where'] and parsed['where']['column'] not in columns:
+                raise ValueError(f"Column '{parsed['where']['column']}' does not exist")
+            display_columns, col_indices = self._select_columns(parsed, columns)
+            
+            path = self._choose_access_path(parsed['table'], parsed['where'], sample)
+            filtered_rows = self._scan(parsed['table'], columns, parsed['where'], path)
+        
+        query_memory = self.memory.query()
+        order_by = parsed.get('order_by') or []
+        descending = [term['descending'] for term in order_by]
+        if parsed['items'] is not None:
+            projected_rows = self._run_stage('Aggregate', memory.aggregate_rows(
+                columns, filtered_rows, parsed['items'], parsed['group_by'], query_memory))
+            if order_by:
+                sort_indices = [display_columns.index(term['column']) for term in order_by]
+                projected_rows = self._run_stage('Sort', memory.sort_rows(projected_rows, sort_indices, descending,
+                                                                          query_memory))
         else:
-            display_columns = parsed['columns']
-            col_indices = []
-            for col in display_columns:
+            if order_by:
+                # Sort before projecting, so any column of the table can be the key
+                sort_indices = [columns.index(term['column']) for term in order_by]
+                filtered_rows = self._run_stage('Sort', memory.sort_rows(filtered_rows, sort_indices, descending,
+                                                                         query_memory))
+            if col_indices == list(range(len(columns))):
+                # SELECT *: rows are immutable, so they are passed on as they are
+                projected_rows = filtered_rows
+            else:
+                projected_rows = (tuple([row[i] for i in col_indices]) for row in filtered_rows)
+            projected_rows = self._run_stage('Project', projected_rows)
+        if cache_key is not None:
+            projected_rows = list(projected_rows)
+            self.result_cache.put(cache_key, parsed['table'], signature, display_columns, projected_rows)
+            projected_rows = iter(projected_rows)
+        return display_columns, projected_rows
+    
+    def _select_columns(self, parsed, columns):
+        """Validate a SELECT's columns; returns (display columns, source indices)"""
+        if parsed['items'] is not None:
+            for col in parsed['group_by']:
                 if col not in columns:
                     raise ValueError(f"Column '{col}' does not exist")
-                col_indices.append(columns.index(col))
+            for item in parsed['items']:
+                if item['column'] != '*' and item['column'] not in columns:
+                    raise ValueError(f"Column '{item['column']}' does not exist")
+            names = [item['name'] for item in parsed['items']]
+            for term in parsed.get('order_by') or []:
+                if term['column'] not in names:
+                    raise ValueError(f"ORDER BY column '{term['column']}' must be in the select list")
+            return names, None
         
-        # Filter rows based on WHERE clause
-        filtered_rows = rows
-        if parsed['where']:
-            filtered_rows = self._filter_rows(columns, rows, parsed['where'])
+        for term in parsed.get('order_by') or []:
+            if term['column'] not in columns:
+                raise ValueError(f"Column '{term['column']}' does not exist")
         
-        # Format output
-        return self._format_table(display_columns, filtered_rows, col_indices)
+        # Determine which columns to display
+        if parsed['columns'] == ['*']:
+            return columns, list(range(len(columns)))
+        col_indices = []
+        for col in parsed['columns']:
+            if col not in columns:
+                raise ValueError(f"Column '{col}' does not exist")
+            col_indices.append(columns.index(col))
+        return parsed['columns'], col_indices
     
-    def _execute_delete(self, parsed):
-        """Execute DELETE FROM"""
-        columns, rows = self.storage.read_table(parsed['table'])
+    def _choose_access_path(self, table, where, sample=None):
+        """Estimate a predicate's row counts and let the planner pick a scan"""
+        if sample is not None:
+            return self._choose_sample(table, where, sample)
+        meta = self.storage.read_meta(table)
+        stats = meta.get('stats')
+        if 'partitioning' in meta:
+            return self._choose_partitions(table, meta['partitioning'], stats, where)
+        if stats and stats['row_count'] and stats.get('table_bytes'):
+            # Scale the analyzed row count by how much the file has grown or shrunk
+            size = self.storage.table_signature(table)[1]
+            table_rows = int(round(stats['row_count'] * size / stats['table_bytes']))
+        else:
+            table_rows = self.storage.estimate_row_count(table)
+        if not where:
+            path = planner.choose_access_path(table_rows, table_rows)
+            path.update(table_rows=table_rows, matched_rows=table_rows)
+            return path
+        
+        col_stats = (stats or {}).get('columns', {}).get(where['column'])
+        selectivity = planner.estimate_selectivity(col_stats, where['operator'], where['value'])
+        matched_rows = int(round(table_rows * selectivity))
+        
+        # Of the indexes that can answer the predicate, offer the cheapest
+        index_name = None
+        index_info = None
+        index_cost = None
+        for name, info in sorted(meta.get('indexes', {}).items()):
+            index_type = INDEX_TYPES.get(info['using'])
+            if info['column'] != where['column'] or index_type is None or not index_type.supports(where['operator'], where['value']):
+                continue
+            cost = index_type.estimate_cost(table_rows, matched_rows, info.get('options'))
+            if index_cost is None or cost < index_cost:
+                index_name, index_info, index_cost = name, info, cost
+        
+        if self.storage.in_snapshot():
+            # Indexes and worker processes follow the live table, not the snapshot
+            index_name = index_cost = None
+            workers = 1
+        else:
+            # Worker processes can only read tables the backend can pin
+            workers = self.parallel_workers if self.storage.supports_pinning else 1
+        path = planner.choose_access_path(table_rows, matched_rows, index_name, index_cost, workers)
+        path.update(table_rows=table_rows, matched_rows=matched_rows, index_info=index_info)
+        return path
+    
+    def _choose_sample(self, table, where, sample):
+        """TABLESAMPLE: scan a fraction of the blocks of the table, or of its kept partitions.
+        
+        Sampling decides which rows are read, so no other access path applies.
+        """
+        path = self._choose_access_path(table, where)
+        fraction = sample['percent'] / 100
+        scanned_rows = path.get('scanned_rows', path['table_rows'])
+        cost = fraction * scanned_rows * (planner.SEQ_ROW_COST + planner.FILTER_ROW_COST)
+        return dict(path, scan='Sample Scan', index=None, workers=1, cost=cost, costs={'Sample Scan': cost},
+                    sample=sample, scanned_rows=int(round(scanned_rows * fraction)),
+                    matched_rows=int(round(path['matched_rows'] * fraction)))
+    
+    def _choose_partitions(self, table, scheme, stats, where):
+        """Prune a partitioned table's partitions for a predicate and cost scanning the rest"""
+        kept = partitions.prune(scheme, where)
+        kept_rows = sum(self.storage.estimate_row_count(partitions.physical_name(table, name)) for name in kept)
+        table_rows = kept_rows
+        for partition in scheme['partitions']:
+            if partition['name'] not in kept:
+                table_rows += self.storage.estimate_row_count(partitions.physical_name(table, partition['name']))
+        
+        matched_rows = kept_rows
+        if where:
+            col_stats = (stats or {}).get('columns', {}).get(where['column'])
+            selectivity = planner.estimate_selectivity(col_stats, where['operator'], where['value'])
+            matched_rows = min(kept_rows, int(round(table_rows * selectivity)))
+        cost = kept_rows * (planner.SEQ_ROW_COST + planner.FILTER_ROW_COST)
+        return {
+            'scan': 'Partitioned Scan',
+            'index': None,
+            'workers': 1,
+            'cost': cost,
+            'costs': {'Partitioned Scan': cost},
+            'partitions': kept,
+            'partition_count': len(scheme['partitions']),
+            'table_rows': table_rows,
+            'scanned_rows': kept_rows,
+            'matched_rows': matched_rows,
+        }
+    
+    def _scan(self, table, columns, where, path):
+        """Read the rows matching a WHERE clause through the chosen access path"""
+        if path['scan'] == 'Index Scan':
+            rows = self._index_scan(table, where, path['index'], path['index_info'])
+            # The index re-checks nothing itself, so verify each candidate
+            matched = (row for row in rows if self._matches_where(columns, row, where))
+            return self._run_stage('Filter', matched)
+        
+        if path['scan'] == 'Parallel Scan':
+            return self._parallel_scan(table, columns, where, path['workers'])
         
-        if parsed['where']:
-            remaining_rows = [row for row in rows if not self._matches_where(columns, row, parsed['where'])]
-            deleted_count = len(rows) - len(remaining_rows)
+        # On an encoded column the Read filters on codes, before decoding
+        pushed = where if self._dictionary_filter(table, where) else None
+        with self._stage('Read') as stage:
+            rows = self._stream_rows(table, path.get('partitions'), path.get('sample'), pushed)
+            if getattr(self._local, 'trace', None) is not None:
+                rows = list(rows)
+                stage['rows_out'] = len(rows)
+        if not where or pushed:
+            return rows
+        matched = (row for row in rows if self._matches_where(columns, row, where))
+        return self._run_stage('Filter', matched)
+    
+    def _stream_rows(self, table, names=None, sample=None, where=None):
+        """Open a table, or the named partitions, and return a lazy iterator over its rows.
+        
+        With a TABLESAMPLE clause only the sampled blocks are read, and with a
+        WHERE clause only matching rows are returned.
+        """
+        scheme = self._partitioning(table)
+        if scheme is None:
+            tables = [table]
         else:
-            remaining_rows = []
-            deleted_count = len(rows)
+            if names is None:
+                names = [partition['name'] for partition in scheme['partitions']]
+            tables = [partitions.physical_name(table, name) for name in names]
+        
+        streams = []
+        for name in tables:
+            if sample is None:
+                stream = self.storage.iter_rows(name, where=where)
+            else:
+                stream = self.storage.iter_sample(name, sample['percent'], sample['seed'], where=where)
+            # Taking the column names opens the current version (or the snapshot's)
+            next(stream)
+            streams.append(stream)
+        return self._count_rows(itertools.chain.from_iterable(streams))
+    
+    def _count_rows(self, rows):
+        """Count rows read from storage as they are consumed"""
+        count = 0
+        try:
+            for row in rows:
+                count += 1
+                yield row
+        finally:
+            self._count_scanned(count)
+    
+    def _index_scan(self, table, where, name, info):
+        """Fetch candidate rows through an index"""
+        with self._stage('Index') as stage:
+            rows = None
+            while rows is None:
+                index = self._get_index(table, name, info)
+                # Read the signature before the entries: a concurrent append
+                # then makes fetch_rows fail and the lookup is retried
+                signature = index.signature
+                located = index.lookup(where['operator'], where['value'])
+                if index.locates == 'ranges':
+                    rows = self.storage.fetch_ranges(table, located, signature)
+                else:
+                    rows = self.storage.fetch_rows(table, sorted(located), signature)
+            stage['rows_out'] = len(rows)
+        self._count_scanned(len(rows))
+        return rows
+    
+    def _parallel_scan(self, table, columns, where, workers):
+        """Filter byte ranges of the table file in worker processes"""
+        col_idx = columns.index(where['column'])
+        with self._stage('Parallel') as stage:
+            # Workers read a pinned version, so writers are never blocked
+            with self.storage.pin_version(table) as (path, size):
+                dictionaries = self.storage.read_meta(table).get('dictionary')
+                pool = self._get_pool()
+                futures = [pool.submit(planner.scan_range, path, start, end, col_idx,
+                                       where['operator'], where['value'], dictionaries)
+                           for start, end in planner.split_ranges(path, workers, size)]
+                scanned = 0
+                rows = []
+                for future in futures:
+                    range_scanned, range_rows = future.result()
+                    scanned += range_scanned
+                    rows.extend(range_rows)
+            stage['rows_out'] = len(rows)
+        self._count_scanned(scanned)
+        return rows
+    
+    def _get_pool(self):
+        """Start the parallel scan worker processes on first use"""
+        with self._index_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.parallel_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+    
+    def _execute_delete(self, parsed):
+        """Execute DELETE FROM"""
+        with self.storage.lock_table(parsed['table']):
+            self._check_writable(parsed['table'])
+            scheme = self._partitioning(parsed['table'])
+            if scheme is not None:
+                return self._delete_partitioned(parsed, scheme)
+            with self._stage('Read') as stage:
+                columns, rows = self.storage.read_table(parsed['table'])
+                stage['rows_out'] = len(rows)
+            self._count_scanned(len(rows))
+            
+            with self._stage('Filter', len(rows)) as stage:
+                remaining_rows, deleted_rows = self._split_deleted(columns, rows, parsed['where'])
+                deleted_count = len(deleted_rows)
+                stage['rows_out'] = deleted_count
+            
+            if deleted_rows:
+                with self._stage('Write', len(remaining_rows)) as stage:
+                    with self._changes_logged(parsed['table'], (changelog.delete(row) for row in deleted_rows)):
+                        self.storage.write_table(parsed['table'], columns, remaining_rows)
+                    stage['rows_out'] = len(remaining_rows)
+        return f"{deleted_count} row(s) deleted."
+    
+    def _delete_partitioned(self, parsed, scheme):
+        """DELETE from the partitions that can hold matching rows, rewriting only changed ones"""
+        table = parsed['table']
+        columns = self.storage.read_columns(table)
+        if parsed['where'] and parsed['where']['column'] not in columns:
+            raise ValueError(f"Column '{parsed['where']['column']}' does not exist")
         
-        self.storage.write_table(parsed['table'], columns, remaining_rows)
+        deleted_count = 0
+        for name in partitions.prune(scheme, parsed['where']):
+            physical = partitions.physical_name(table, name)
+            with self._stage('Read') as stage:
+                _, rows = self.storage.read_table(physical)
+                stage['rows_out'] = len(rows)
+            self._count_scanned(len(rows))
+            
+            with self._stage('Filter', len(rows)) as stage:
+                remaining_rows, deleted_rows = self._split_deleted(columns, rows, parsed['where'])
+                stage['rows_out'] = len(deleted_rows)
+            
+            if deleted_rows:
+                deleted_count += len(deleted_rows)
+                with self._stage('Write', len(remaining_rows)) as stage:
+                    # One transaction per partition rewritten
+                    with self._changes_logged(table, (changelog.delete(row) for row in deleted_rows)):
+                        self.storage.write_table(physical, columns, remaining_rows)
+                    stage['rows_out'] = len(remaining_rows)
         return f"{deleted_count} row(s) deleted."
     
+    def _split_deleted(self, columns, rows, where_clause):
+        """Split rows into (remaining rows, rows a DELETE removes)"""
+        if not where_clause:
+            return [], rows
+        remaining_rows = []
+        deleted_rows = []
+        for row in rows:
+            if self._matches_where(columns, row, where_clause):
+                deleted_rows.append(row)
+            else:
+                remaining_rows.append(row)
+        return remaining_rows, deleted_rows
+    
     def _execute_update(self, parsed):
         """Execute UPDATE"""
-        columns, rows = self.storage.read_table(parsed['table'])
-        
-        # Validate columns in SET clause
-        for col in parsed['updates'].keys():
+        with self.storage.lock_table(parsed['table']):
+            self._check_writable(parsed['table'])
+            scheme = self._partitioning(parsed['table'])
+            if scheme is not None:
+                return self._update_partitioned(parsed, scheme)
+            with self._stage('Read') as stage:
+                columns, rows = self.storage.read_table(parsed['table'])
+                stage['rows_out'] = len(rows)
+            self._count_scanned(len(rows))
+            
+            # Validate columns in SET clause
+            for col in parsed['updates'].keys():
+                if col not in columns:
+                    raise ValueError(f"Column '{col}' does not exist")
+            
+            updated_count = 0
+            updated_rows = []
+            changes = []
+            assignments = [(columns.index(col), val) for col, val in parsed['updates'].items()]
+            
+            with self._stage('Filter', len(rows)) as stage:
+                for row in rows:
+                    if parsed['where'] is None or self._matches_where(columns, row, parsed['where']):
+                        updated_rows.append(self._updated_row(row, assignments))
+                        changes.append((row, updated_rows[-1]))
+                        updated_count += 1
+                    else:
+                        updated_rows.append(row)
+                stage['rows_out'] = updated_count
+            
+            if changes:
+                with self._stage('Write', len(updated_rows)) as stage:
+                    with self._changes_logged(parsed['table'], (changelog.update(*change) for change in changes)):
+                        self.storage.write_table(parsed['table'], columns, updated_rows)
+                    stage['rows_out'] = len(updated_rows)
+        return f"{updated_count} row(s) updated."
+    
+    def _update_partitioned(self, parsed, scheme):
+        """UPDATE the partitions that can hold matching rows, moving rows whose partition changes"""
+        table = parsed['table']
+        columns = self.storage.read_columns(table)
+        for col in list(parsed['updates'].keys()) + ([parsed['where']['column']] if parsed['where'] else []):
             if col not in columns:
                 raise ValueError(f"Column '{col}' does not exist")
+        key_idx = columns.index(scheme['column'])
+        assignments = [(columns.index(col), val) for col, val in parsed['updates'].items()]
         
+        # Route every changed row before writing anything, so a value with no
+        # partition fails the statement without a partial update
+        pruned = partitions.prune(scheme, parsed['where'])
         updated_count = 0
-        updated_rows = []
+        contents = {}
+        changed = set()
+        changes = []
+        for name in pruned:
+            with self._stage('Read') as stage:
+                _, rows = self.storage.read_table(partitions.physical_name(table, name))
+                stage['rows_out'] = len(rows)
+            self._count_scanned(len(rows))
+            
+            with self._stage('Filter', len(rows)) as stage:
+                kept = contents.setdefault(name, [])
+                for row in rows:
+                    if parsed['where'] is None or self._matches_where(columns, row, parsed['where']):
+                        new_row = self._updated_row(row, assignments)
+                        target = name
+                        if new_row[key_idx] != row[key_idx]:
+                            target = partitions.route(scheme, new_row[key_idx])
+                        contents.setdefault(target, [])
+                        changed.update((name, target))
+                        changes.append((row, new_row))
+                        updated_count += 1
+                    else:
+                        new_row, target = row, name
+                    if target == name:
+                        kept.append(new_row)
+                    else:
+                        contents[target].append(new_row)
+                stage['rows_out'] = updated_count
         
-        for row in rows:
-            if parsed['where'] is None or self._matches_where(columns, row, parsed['where']):
-                # Update this row
-                new_row = row.copy()
-                for col, val in parsed['updates'].items():
-                    col_idx = columns.index(col)
-                    new_row[col_idx] = val
-                updated_rows.append(new_row)
-                updated_count += 1
+        with self._stage('Write') as stage, \
+                self._changes_logged(table, (changelog.update(*change) for change in changes)):
+            written = 0
+            for name in sorted(changed):
+                physical = partitions.physical_name(table, name)
+                if name in pruned:
+                    self.storage.write_table(physical, columns, contents[name])
+                else:
+                    # Not read above: rows moving in are appended
+                    self.storage.append_rows(physical, contents[name])
+                written += len(contents[name])
+            stage['rows_out'] = written
+        return f"{updated_count} row(s) updated."
+    
+    def _updated_row(self, row, assignments):
+        """Copy-on-write: a new row with (column index, value) assignments applied"""
+        new_row = list(row)
+        for col_idx, value in assignments:
+            new_row[col_idx] = value
+        return tuple(new_row)
+    
+    def _execute_explain(self, parsed):
+        """Execute EXPLAIN [ANALYZE]"""
+        statement = parsed['statement']
+        plan = self._plan(statement)
+        
+        lines = ["QUERY PLAN", "-" * 40]
+        for depth, node in enumerate(plan):
+            prefix = "  " * depth + ("-> " if depth else "")
+            detail = f" ({node['detail']})" if node['detail'] else ""
+            estimate = f"  [est. rows: {node['estimated_rows']}]" if node['estimated_rows'] is not None else ""
+            lines.append(f"{prefix}{node['op']}{detail}{estimate}")
+        
+        if not parsed['analyze']:
+            return '\n'.join(lines)
+        
+        # EXPLAIN ANALYZE: run the statement again with every stage traced
+        self._local.trace = trace = []
+        start = time.perf_counter()
+        try:
+            with self._stage('Parse') as stage:
+                statement = self.parser.parse(parsed['sql'])
+                stage['rows_out'] = 1
+            if statement['type'] in ('SELECT', 'UPDATE', 'DELETE'):
+                result = self._execute_parsed(statement)
             else:
-                updated_rows.append(row)
+                with self._stage('Execute'):
+                    result = self._execute_parsed(statement)
+        finally:
+            self._local.trace = None
+        total = time.perf_counter() - start
         
-        self.storage.write_table(parsed['table'], columns, updated_rows)
-        return f"{updated_count} row(s) updated."
+        lines.append("")
+        lines.append(f"{'Stage':<10} {'Rows In':>10} {'Rows Out':>10} {'Time (ms)':>11} {'Bytes Read':>12}")
+        lines.append("-" * 57)
+        for stage in trace:
+            rows_in = '-' if stage['rows_in'] is None else stage['rows_in']
+            rows_out = '-' if stage['rows_out'] is None else stage['rows_out']
+            lines.append(f"{stage['stage']:<10} {rows_in:>10} {rows_out:>10} "
+                         f"{stage['time'] * 1000:>11.3f} {stage['bytes_read']:>12}")
+        lines.append(f"\nTotal execution time: {total * 1000:.3f} ms")
+        if statement['type'] != 'SELECT':
+            lines.append(f"Result: {result}")
+        return '\n'.join(lines)
+    
+    def _plan(self, parsed):
+        """Describe how a statement will execute, outermost step first"""
+        kind = parsed['type']
+        if kind not in ('SELECT', 'UPDATE', 'DELETE'):
+            if kind == 'INSERT':
+                return [{'op': f"Insert on {parsed['table']}", 'detail': None, 'estimated_rows': 1}]
+            detail = parsed.get('table')
+            return [{'op': kind.replace('_', ' ').title(), 'detail': detail, 'estimated_rows': None}]
+        
+        table = parsed['table']
+        columns = self.storage.read_columns(table)
+        where = parsed['where']
+        if where and where['column'] not in columns:
+            raise ValueError(f"Column '{where['column']}' does not exist")
+        
+        path = self._choose_access_path(table, where, parsed.get('sample'))
+        if kind != 'SELECT' and path['scan'] != 'Partitioned Scan':
+            # UPDATE and DELETE rewrite the whole table, so they always scan it
+            path = dict(path, scan='Full Scan', index=None, workers=1, cost=path['costs']['Full Scan'])
+        table_rows = path['table_rows']
+        matched_rows = path['matched_rows']
+        
+        plan = []
+        if kind == 'SELECT' and parsed['items'] is not None:
+            detail = f"group by {', '.join(parsed['group_by'])}" if parsed['group_by'] else None
+            plan.append({'op': 'Aggregate', 'detail': detail,
+                         'estimated_rows': None if parsed['group_by'] else 1})
+        elif kind == 'SELECT':
+            shown = ', '.join(columns if parsed['columns'] == ['*'] else parsed['columns'])
+            plan.append({'op': 'Project', 'detail': shown, 'estimated_rows': matched_rows})
+        elif kind == 'UPDATE':
+            plan.append({'op': f"Update on {table}", 'detail': None, 'estimated_rows': matched_rows})
+        else:
+            plan.append({'op': f"Delete on {table}", 'detail': None, 'estimated_rows': matched_rows})
+        if kind == 'SELECT' and parsed.get('order_by'):
+            keys = ', '.join(term['column'] + (' DESC' if term['descending'] else '') for term in parsed['order_by'])
+            # Aggregates are sorted after grouping, other rows before projecting
+            position = 0 if parsed['items'] is not None else 1
+            plan.insert(position, {'op': 'Sort', 'detail': keys, 'estimated_rows': plan[-1]['estimated_rows']})
+        
+        predicate = f"{where['column']} {where['operator']} {where['value']}" if where else None
+        filter_detail = predicate
+        if kind == 'SELECT' and self._dictionary_filter(table, where):
+            filter_detail += "; on dictionary codes"
+        alternatives = ', '.join(f"{scan}: {cost:.0f}" for scan, cost in sorted(path['costs'].items())
+                                 if scan != path['scan'])
+        cost = f"cost: {path['cost']:.0f}" + (f"; rejected {alternatives}" if alternatives else "")
+        if path['scan'] == 'Index Scan':
+            plan.append({'op': 'Filter', 'detail': f"recheck {predicate}", 'estimated_rows': matched_rows})
+            plan.append({'op': f"Index Scan on {table} using {path['index']}",
+                         'detail': f"{predicate}; {cost}", 'estimated_rows': matched_rows})
+        elif path['scan'] == 'Parallel Scan':
+            plan.append({'op': f"Parallel Scan on {table}",
+                         'detail': f"{predicate}; workers: {path['workers']}; {cost}", 'estimated_rows': matched_rows})
+        elif path['scan'] == 'Sample Scan':
+            if where:
+                plan.append({'op': 'Filter', 'detail': filter_detail, 'estimated_rows': matched_rows})
+            method = f"SYSTEM {path['sample']['percent']:g}%"
+            if path['sample']['seed'] is not None:
+                method += f" REPEATABLE {path['sample']['seed']}"
+            if 'partitions' in path:
+                method += f"; partitions: {', '.join(path['partitions']) or 'none'} of {path['partition_count']}"
+            plan.append({'op': f"Sample Scan on {table}", 'detail': f"{method}; {cost}",
+                         'estimated_rows': path['scanned_rows']})
+        elif path['scan'] == 'Partitioned Scan':
+            if where:
+                plan.append({'op': 'Filter', 'detail': predicate, 'estimated_rows': matched_rows})
+            kept = ', '.join(path['partitions']) or 'none'
+            plan.append({'op': f"Partitioned Scan on {table}",
+                         'detail': f"partitions: {kept} of {path['partition_count']}; {cost}",
+                         'estimated_rows': path['scanned_rows']})
+        else:
+            if where:
+                plan.append({'op': 'Filter', 'detail': filter_detail, 'estimated_rows': matched_rows})
+            plan.append({'op': f"Full Scan on {table}", 'detail': cost, 'estimated_rows': table_rows})
+        return plan
+    
+    def _describe_plan(self, parsed):
+        """Render a statement's plan on one line, scan first"""
+        if parsed is None:
+            return None
+        try:
+            plan = self._plan(parsed)
+        except ValueError:
+            return None
+        steps = []
+        for node in reversed(plan):
+            steps.append(f"{node['op']} ({node['detail']})" if node['detail'] else node['op'])
+        return ' -> '.join(steps)
+    
+    @contextmanager
+    def _stage(self, name, rows_in=None):
+        """Time one execution stage while EXPLAIN ANALYZE is tracing"""
+        stage = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            yield stage
+            return
+        
+        bytes_before = self.storage.io_counters()[0]
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage['time'] = time.perf_counter() - start
+            stage['bytes_read'] = self.storage.io_counters()[0] - bytes_before
+            trace.append(stage)
+    
+    def _run_stage(self, name, rows):
+        """Pass a lazy stage through; under EXPLAIN ANALYZE run it eagerly so it can be timed"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return rows
+        
+        with self._stage(name, trace[-1]['rows_out'] if trace else None) as stage:
+            rows = list(rows)
+            stage['rows_out'] = len(rows)
+        return rows
     
     def _filter_rows(self, columns, rows, where_clause):
         """Filter rows based on WHERE clause"""
@@ -172,12 +1634,7 @@ class DatabaseEngine:
             raise ValueError(f"Column '{col}' does not exist")
         
         col_idx = columns.index(col)
-        row_value = row[col_idx]
-        
-        if where_clause['operator'] == '=':
-            return row_value == where_clause['value']
-        
-        return False
+        return planner.compare_values(row[col_idx], where_clause['operator'], where_clause['value'])
     
     def _format_table(self, columns, rows, col_indices):
         """Format query results as a table"""
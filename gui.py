@@ -2,7 +2,15 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
 from engine import DatabaseEngine
-import os
+import queue
+import threading
+
+# Rows the query thread reads and hands to the grid each time the view scrolls near its end
+PAGE_SIZE = 200
+# Rows the grid keeps; past them, the oldest are dropped as new pages arrive
+GRID_ROWS = 5 * PAGE_SIZE
+# How often the Tk thread picks up progress from the query thread
+POLL_MS = 50
 
 
 class DatabaseGUI:
@@ -17,6 +25,17 @@ class DatabaseGUI:
         self.command_history = []
         self.history_index = -1
         
+        # Query state: the worker thread reads a page of rows each time the
+        # grid asks for one, and the Tk thread inserts the pages it sends
+        self.query_thread = None
+        self.query_events = None
+        self.query_cancel = threading.Event()
+        self.query_more = threading.Event()
+        self.query_waiting = threading.Event()
+        self.result_columns = None
+        self.loaded_rows = 0
+        self.dropped_rows = 0
+        
         self.setup_styles()
         self.setup_ui()
         self.refresh_tables()
@@ -154,6 +173,9 @@ class DatabaseGUI:
         grid_header = ttk.Frame(center_frame)
         grid_header.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=(0, 5))
         ttk.Label(grid_header, text="📊 Data View", style='Title.TLabel').pack(side=tk.LEFT)
+        self.cancel_button = ttk.Button(grid_header, text="⏹️ Cancel", command=self.cancel_query,
+                                        state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT, padx=(5, 0))
         self.result_count = ttk.Label(grid_header, text="", font=('Segoe UI', 9, 'bold'),
                                       foreground='#0066cc')
         self.result_count.pack(side=tk.RIGHT)
@@ -168,8 +190,9 @@ class DatabaseGUI:
         tree_scroll_y = ttk.Scrollbar(results_frame, orient=tk.VERTICAL)
         tree_scroll_x = ttk.Scrollbar(results_frame, orient=tk.HORIZONTAL)
         
+        self.tree_scroll_y = tree_scroll_y
         self.results_tree = ttk.Treeview(results_frame,
-                                         yscrollcommand=tree_scroll_y.set,
+                                         yscrollcommand=self.on_tree_scroll,
                                          xscrollcommand=tree_scroll_x.set,
                                          selectmode='browse')
         
@@ -269,13 +292,9 @@ class DatabaseGUI:
         search = self.table_search.get().lower()
         self.tables_listbox.delete(0, tk.END)
         
-        data_dir = self.engine.storage.data_dir
-        if os.path.exists(data_dir):
-            for file in sorted(os.listdir(data_dir)):
-                if file.endswith('.db'):
-                    table_name = file[:-3]
-                    if search in table_name.lower():
-                        self.tables_listbox.insert(tk.END, f"  📊 {table_name}")
+        for table_name in self.engine.list_tables():
+            if search in table_name.lower():
+                self.tables_listbox.insert(tk.END, f"  📊 {table_name}")
     
     def refresh_tables(self):
         """Refresh tables list"""
@@ -290,12 +309,9 @@ class DatabaseGUI:
             table_text = self.tables_listbox.get(selection[0])
             table_name = table_text.replace('📊', '').strip()
             self.current_table = table_name
-            try:
-                columns, rows = self.engine.storage.read_table(table_name)
-                info = f"{table_name}: {len(columns)} columns, {len(rows)} rows"
-                self.table_info.config(text=info)
-            except:
-                self.table_info.config(text=table_name)
+            self.table_info.config(text=table_name)
+            # Previewed on the query thread, a page at a time, like any SELECT
+            self.run_query(f"SELECT * FROM {table_name}", f"✓ Showing {table_name}\n", preview=table_name)
     
     def view_all_data(self, event=None):
         """View all data from selected table"""
@@ -314,68 +330,187 @@ class DatabaseGUI:
             messagebox.showwarning("Empty", "Enter a SQL command")
             return
         
-        self.log_console(f"\n▶️ Executing: {command}\n", 'info')
+        if self.run_query(command, "✓ Query executed\n", show_errors=True):
+            self.log_console(f"\n▶️ Executing: {command}\n", 'info')
+        
+    def run_query(self, command, select_message, show_errors=False, preview=None):
+        """Run a statement on the query thread; returns False if one is still executing.
+        
+        A SELECT that is only waiting for the grid to ask for more rows is
+        stopped to make way. preview names the table a table preview shows;
+        previews are skipped quietly while another statement executes.
+        """
+        if self.query_thread is not None and self.query_thread.is_alive():
+            if not self.query_waiting.is_set():
+                if preview is None:
+                    messagebox.showwarning("Busy", "A query is still running. Cancel it first.")
+                return False
+            # It stops at its next row; its events go to a queue nobody polls
+            self.cancel_query()
+        
+        # Fresh events per query, so a stopped worker cannot see the next one's
+        self.query_cancel = threading.Event()
+        self.query_more = threading.Event()
+        self.query_waiting = threading.Event()
+        events = self.query_events = queue.Queue()
+        self.query_thread = threading.Thread(
+            target=self.query_worker, args=(command, events, self.query_cancel, self.query_more, self.query_waiting),
+            daemon=True)
+        self.query_thread.start()
+        self.cancel_button.config(state=tk.NORMAL)
+        self.root.after(POLL_MS, self.poll_query, events, select_message, show_errors, preview)
+        return True
+    
+    def query_worker(self, command, events, cancel, more, waiting):
+        """Query thread: execute once and send the rows a page at a time; never touches Tk.
         
+        After each page it waits until the grid asks for more, so a result is
+        only read as far as the user scrolls.
+        """
         try:
-            result = self.engine.execute(command)
+            columns, rows, result = self.engine.query(command)
+            if columns is None:
+                events.put(('message', result))
+                return
             
-            if command.strip().upper().startswith('SELECT'):
-                self.display_select_results(command)
-                self.log_console(f"✓ Query executed\n", 'success')
-            else:
-                self.log_console(f"✓ {result}\n", 'success')
+            events.put(('columns', columns))
+            try:
+                page = []
+                for row in rows:
+                    if cancel.is_set():
+                        events.put(('cancelled', None))
+                        return
+                    page.append(row)
+                    if len(page) >= PAGE_SIZE:
+                        events.put(('rows', page))
+                        page = []
+                        waiting.set()
+                        more.wait()
+                        more.clear()
+                        waiting.clear()
+                if page:
+                    events.put(('rows', page))
+            finally:
+                rows.close()
+            events.put(('done', None))
+        except Exception as e:
+            events.put(('error', e))
+    
+    def poll_query(self, events, select_message, show_errors, preview):
+        """Tk thread: apply query progress, then check again until it finishes"""
+        if events is not self.query_events:
+            # A newer query took over the grid
+            return
+        finished = False
+        while True:
+            try:
+                kind, value = events.get_nowait()
+            except queue.Empty:
+                break
+            
+            if kind == 'columns':
+                self.display_select_results(value)
+                if preview is not None:
+                    self.table_info.config(text=f"{preview}: {len(value)} columns")
+            elif kind == 'rows':
+                self.insert_rows(value)
+            elif kind == 'message':
+                finished = True
+                self.log_console(f"✓ {value}\n", 'success')
                 self.clear_results_tree()
                 self.refresh_tables()
+            elif kind == 'error':
+                finished = True
+                self.log_console(f"✗ Error: {value}\n", 'error')
+                if show_errors:
+                    messagebox.showerror("Error", str(value))
+            elif kind == 'cancelled':
+                finished = True
+                self.log_console(f"⏹️ Query cancelled after {self.loaded_rows} rows\n", 'info')
+            elif kind == 'done':
+                finished = True
+                self.log_console(select_message, 'success')
+                if preview is not None and self.result_columns is not None:
+                    self.table_info.config(
+                        text=f"{preview}: {len(self.result_columns)} columns, {self.loaded_rows:,} rows")
             
-        except Exception as e:
-            self.log_console(f"✗ Error: {e}\n", 'error')
-            messagebox.showerror("Error", str(e))
+        if self.result_columns is not None:
+            self.update_result_count(running=not finished)
+        
+        if finished:
+            self.cancel_button.config(state=tk.DISABLED)
+        else:
+            self.root.after(POLL_MS, self.poll_query, events, select_message, show_errors, preview)
+    
+    def cancel_query(self):
+        """Ask the query thread to stop at the next row, waking it if it waits for the grid"""
+        self.query_cancel.set()
+        self.query_more.set()
     
-    def display_select_results(self, command):
-        """Display SELECT query results in treeview"""
+    def display_select_results(self, columns):
+        """Set up the treeview for a SELECT; its rows arrive in pages (insert_rows)"""
         try:
-            parsed = self.engine.parser.parse(command)
-            columns, rows = self.engine.storage.read_table(parsed['table'])
-            
-            # Determine which columns to display
-            if parsed['columns'] == ['*']:
-                display_columns = columns
-                col_indices = list(range(len(columns)))
-            else:
-                display_columns = parsed['columns']
-                col_indices = [columns.index(col) for col in display_columns]
-            
-            # Filter rows if WHERE clause exists
-            if parsed['where']:
-                rows = self.engine._filter_rows(columns, rows, parsed['where'])
-            
             # Clear existing tree
             self.clear_results_tree()
             
             # Setup columns
-            self.results_tree['columns'] = display_columns
+            self.results_tree['columns'] = columns
             self.results_tree['show'] = 'headings'
             
-            for col in display_columns:
+            for col in columns:
                 self.results_tree.heading(col, text=col)
                 self.results_tree.column(col, width=100, anchor=tk.W)
             
-            # Insert rows
-            for row in rows:
-                display_row = [row[i] for i in col_indices]
-                self.results_tree.insert('', tk.END, values=display_row)
-            
-            self.result_count.config(text=f"{len(rows)} rows")
+            self.result_columns = columns
             
         except Exception as e:
             self.log_console(f"Display error: {e}\n", 'error')
     
+    def insert_rows(self, rows):
+        """Insert a page of rows from the query thread into the tree, dropping the oldest past GRID_ROWS.
+        
+        The grid only scrolls forward through a large result: rows dropped
+        from the top come back by running the query again.
+        """
+        if self.result_columns is None:
+            return
+        for row in rows:
+            self.results_tree.insert('', tk.END, values=row)
+        self.loaded_rows += len(rows)
+        
+        items = self.results_tree.get_children()
+        excess = len(items) - GRID_ROWS
+        if excess > 0:
+            # Keep the rows in view where they are on screen
+            top = float(self.results_tree.yview()[0]) * len(items)
+            self.results_tree.delete(*items[:excess])
+            self.dropped_rows += excess
+            self.results_tree.yview_moveto(max(top - excess, 0) / GRID_ROWS)
+    
+    def on_tree_scroll(self, first, last):
+        """Treeview scroll callback: ask the query thread for another page near the bottom"""
+        self.tree_scroll_y.set(first, last)
+        if float(last) > 0.9 and self.result_columns is not None:
+            self.query_more.set()
+    
+    def update_result_count(self, running=False):
+        """Show the live row counter"""
+        text = f"{self.loaded_rows:,} rows"
+        if self.dropped_rows:
+            text += f" (showing {self.dropped_rows + 1:,}-{self.loaded_rows:,})"
+        if running:
+            text += " (scroll for more)" if self.query_waiting.is_set() else " so far..."
+        self.result_count.config(text=text)
+    
     def clear_results_tree(self):
         """Clear the results treeview"""
         for item in self.results_tree.get_children():
             self.results_tree.delete(item)
         self.results_tree['columns'] = []
         self.result_count.config(text="")
+        self.result_columns = None
+        self.loaded_rows = 0
+        self.dropped_rows = 0
     
     def clear_input(self):
         """Clear SQL editor"""
@@ -425,22 +560,11 @@ class DatabaseGUI:
         self.command_history.append(command)
         self.history_index = len(self.command_history)
         
+        if not self.run_query(command, "✓ See Data View\n"):
+            return
         self.log_console(f"\nSQL> ", 'prompt')
         self.log_console(f"{command}\n", 'info')
         
-        try:
-            result = self.engine.execute(command)
-            
-            if command.strip().upper().startswith('SELECT'):
-                self.display_select_results(command)
-                self.log_console(f"✓ See Data View\n", 'success')
-            else:
-                self.log_console(f"✓ {result}\n", 'success')
-                self.refresh_tables()
-            
-        except Exception as e:
-            self.log_console(f"✗ Error: {e}\n", 'error')
-        
         self.console_input.delete(0, tk.END)
     
     def quick_console(self, cmd_template):
@@ -823,7 +947,7 @@ class DatabaseGUI:
             col = col_combo.get()
             val = val_entry.get()
             if col:
-                command = f"SELECT * FROM {self.current_table} WHERE {col} = '{val}'"
+                command = f"SELECT * FROM {self.current_table} WHERE {col} LIKE '%{val}%'"
                 sql_preview.delete(1.0, tk.END)
                 sql_preview.insert(1.0, command)
         
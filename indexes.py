@@ -0,0 +1,283 @@
+"""
+Secondary indexes.
+
+An index locates candidate rows in one version of the table file, identified
+by Storage.table_signature: a hash or trigram index by row byte offset, a
+Bloom filter index by the byte ranges of segments that may hold the value. The engine
+keeps loaded indexes in memory, updates them on in-process appends, and
+rebuilds them from the table when the signature shows the file changed
+underneath (a rewrite, or a write from another process).
+"""
+import base64
+import hashlib
+import itertools
+import json
+import math
+import re
+
+from planner import FILTER_ROW_COST, INDEX_FETCH_COST, INDEX_LOOKUP_COST, SEQ_ROW_COST
+
+# Rows per Bloom filter segment
+BLOOM_SEGMENT_ROWS = 4096
+DEFAULT_BLOOM_FPR = 0.01
+# Trigram index markers for the start and end of a value
+TRIGRAM_START = '\x02'
+TRIGRAM_END = '\x03'
+
+
+class HashIndex:
+    """Equality index: value -> list of row offsets"""
+    
+    kind = 'HASH'
+    # lookup returns row offsets for Storage.fetch_rows
+    locates = 'rows'
+    
+    def __init__(self, name, column, col_idx, options=None):
+        if options:
+            raise ValueError(f"{self.kind} indexes take no options")
+        self.name = name
+        self.column = column
+        self.col_idx = col_idx
+        self.options = {}
+        self.signature = None
+        self.entries = {}
+    
+    @classmethod
+    def estimate_cost(cls, table_rows, matched_rows, options):
+        """Planner cost of answering a predicate through this index"""
+        return INDEX_LOOKUP_COST + matched_rows * INDEX_FETCH_COST
+    
+    def build(self, signature, located_rows):
+        """Index every (offset, row) of a table version"""
+        self.entries = {}
+        for offset, row in located_rows:
+            self.add(offset, row)
+        self.signature = signature
+    
+    def add(self, offset, row):
+        """Index one row"""
+        self.entries.setdefault(row[self.col_idx], []).append(offset)
+    
+    @classmethod
+    def supports(cls, operator, value):
+        """Whether lookup can answer a predicate"""
+        return operator == '='
+    
+    def lookup(self, operator, value):
+        """Return the offsets of candidate rows"""
+        return list(self.entries.get(value, ()))
+    
+    def dumps(self):
+        """Serialize for Storage.write_aux"""
+        return json.dumps({'kind': self.kind, 'column': self.column, 'signature': self.signature,
+                           'entries': self.entries}).encode('utf-8')
+    
+    def loads(self, data):
+        """Restore state written by dumps"""
+        state = json.loads(data)
+        self.signature = state['signature']
+        self.entries = state['entries']
+
+
+class BloomIndex:
+    """Per-segment Bloom filters: skip segments that certainly lack a value.
+    
+    The table's rows are cut into segments of BLOOM_SEGMENT_ROWS rows, each
+    with its own filter sized for the configured false-positive rate (option
+    fpr). A segment spans from its first row's offset to the next segment's.
+    """
+    
+    kind = 'BLOOM'
+    # lookup returns (start, end) byte ranges for Storage.fetch_ranges
+    locates = 'ranges'
+    
+    def __init__(self, name, column, col_idx, options=None):
+        options = dict(options or {})
+        fpr = float(options.pop('fpr', DEFAULT_BLOOM_FPR))
+        if options:
+            raise ValueError(f"Unknown BLOOM index option '{next(iter(options))}'")
+        if not 0.0 < fpr < 1.0:
+            raise ValueError("fpr must be between 0 and 1")
+        self.name = name
+        self.column = column
+        self.col_idx = col_idx
+        self.options = {'fpr': fpr}
+        # Standard sizing for n items at false-positive rate p
+        self.bits = max(8, int(math.ceil(-BLOOM_SEGMENT_ROWS * math.log(fpr) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits / BLOOM_SEGMENT_ROWS * math.log(2))))
+        self.signature = None
+        self.segments = []
+    
+    @classmethod
+    def estimate_cost(cls, table_rows, matched_rows, options):
+        """Planner cost: probe every filter, then scan the segments that may match"""
+        segments = max(1, math.ceil(table_rows / BLOOM_SEGMENT_ROWS))
+        fpr = float((options or {}).get('fpr', DEFAULT_BLOOM_FPR))
+        hit = min(segments, matched_rows + fpr * segments)
+        scanned = min(table_rows, hit * BLOOM_SEGMENT_ROWS)
+        return INDEX_LOOKUP_COST + segments + scanned * (SEQ_ROW_COST + FILTER_ROW_COST)
+    
+    def _positions(self, value):
+        """Bit positions for a value (double hashing)"""
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+    
+    def build(self, signature, located_rows):
+        """Index every (offset, row) of a table version"""
+        self.segments = []
+        for offset, row in located_rows:
+            self.add(offset, row)
+        self.signature = signature
+    
+    def add(self, offset, row):
+        """Index one row, starting a new segment when the last one is full"""
+        if not self.segments or self.segments[-1]['rows'] >= BLOOM_SEGMENT_ROWS:
+            self.segments.append({'start': offset, 'rows': 0, 'filter': bytearray((self.bits + 7) // 8)})
+        segment = self.segments[-1]
+        for position in self._positions(row[self.col_idx]):
+            segment['filter'][position >> 3] |= 1 << (position & 7)
+        segment['rows'] += 1
+    
+    @classmethod
+    def supports(cls, operator, value):
+        """Whether lookup can answer a predicate"""
+        return operator == '='
+    
+    def lookup(self, operator, value):
+        """Return the byte ranges of segments that may contain value; end None means end of file"""
+        positions = self._positions(value)
+        ranges = []
+        for i, segment in enumerate(self.segments):
+            bloom = segment['filter']
+            if all(bloom[position >> 3] & (1 << (position & 7)) for position in positions):
+                end = self.segments[i + 1]['start'] if i + 1 < len(self.segments) else None
+                ranges.append((segment['start'], end))
+        return ranges
+    
+    def dumps(self):
+        """Serialize for Storage.write_aux"""
+        segments = [{'start': segment['start'], 'rows': segment['rows'],
+                     'filter': base64.b64encode(bytes(segment['filter'])).decode('ascii')}
+                    for segment in self.segments]
+        return json.dumps({'kind': self.kind, 'column': self.column, 'signature': self.signature,
+                           'options': self.options, 'segments': segments}).encode('utf-8')
+    
+    def loads(self, data):
+        """Restore state written by dumps"""
+        state = json.loads(data)
+        if state.get('options') != self.options:
+            # Sized for a different rate; leave it stale so it is rebuilt
+            return
+        self.signature = state['signature']
+        self.segments = [{'start': segment['start'], 'rows': segment['rows'],
+                          'filter': bytearray(base64.b64decode(segment['filter']))}
+                         for segment in state['segments']]
+
+
+def _trigrams(text):
+    """The distinct three-character substrings of text"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _pattern_trigrams(operator, value):
+    """Trigrams every row matching a predicate must contain; empty if there are none"""
+    if operator == '=':
+        return _trigrams(TRIGRAM_START + value + TRIGRAM_END)
+    # The literal runs between wildcards; the first and last are anchored
+    # to the ends of the value unless the pattern starts or ends with one
+    runs = re.split(r'[%_]', value)
+    runs[0] = TRIGRAM_START + runs[0]
+    runs[-1] = runs[-1] + TRIGRAM_END
+    result = set()
+    for run in runs:
+        result |= _trigrams(run)
+    return result
+
+
+class TrigramIndex:
+    """Inverted index of the three-character substrings of each value.
+    
+    Each trigram maps to the offsets of the rows containing it, in file
+    order. Values are indexed with a marker at each end, so anchored
+    patterns (prefix 'ab%', suffix '%yz', equality) get trigrams from the
+    ends as well. A predicate's candidates are the rows holding all of its
+    trigrams; they include false positives and must be rechecked.
+    """
+    
+    kind = 'TRIGRAM'
+    # lookup returns row offsets for Storage.fetch_rows
+    locates = 'rows'
+    
+    def __init__(self, name, column, col_idx, options=None):
+        if options:
+            raise ValueError(f"{self.kind} indexes take no options")
+        self.name = name
+        self.column = column
+        self.col_idx = col_idx
+        self.options = {}
+        self.signature = None
+        self.postings = {}
+    
+    @classmethod
+    def estimate_cost(cls, table_rows, matched_rows, options):
+        """Planner cost: intersect posting lists, then fetch and recheck the candidates"""
+        return INDEX_LOOKUP_COST + matched_rows * (INDEX_FETCH_COST + FILTER_ROW_COST)
+    
+    def build(self, signature, located_rows):
+        """Index every (offset, row) of a table version"""
+        self.postings = {}
+        for offset, row in located_rows:
+            self.add(offset, row)
+        self.signature = signature
+    
+    def add(self, offset, row):
+        """Index one row"""
+        for trigram in _trigrams(TRIGRAM_START + row[self.col_idx] + TRIGRAM_END):
+            self.postings.setdefault(trigram, []).append(offset)
+    
+    @classmethod
+    def supports(cls, operator, value):
+        """Whether lookup can answer a predicate: LIKE or = with at least one trigram"""
+        return operator in ('=', 'LIKE') and bool(_pattern_trigrams(operator, value))
+    
+    def lookup(self, operator, value):
+        """Return the offsets of candidate rows"""
+        postings = sorted((self.postings.get(trigram, []) for trigram in _pattern_trigrams(operator, value)),
+                          key=len)
+        # Intersect starting from the shortest list
+        candidates = set(postings[0])
+        for offsets in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(offsets)
+        return candidates
+    
+    def dumps(self):
+        """Serialize for Storage.write_aux; offsets are stored as gaps, which are shorter"""
+        postings = {trigram: [offsets[0]] + [b - a for a, b in zip(offsets, offsets[1:])]
+                    for trigram, offsets in self.postings.items()}
+        return json.dumps({'kind': self.kind, 'column': self.column, 'signature': self.signature,
+                           'postings': postings}, separators=(',', ':')).encode('utf-8')
+    
+    def loads(self, data):
+        """Restore state written by dumps"""
+        state = json.loads(data)
+        self.signature = state['signature']
+        self.postings = {trigram: list(itertools.accumulate(gaps)) for trigram, gaps in state['postings'].items()}
+
+
+INDEX_TYPES = {
+    'HASH': HashIndex,
+    'BLOOM': BloomIndex,
+    'TRIGRAM': TrigramIndex,
+}
+
+
+def create_index(name, using, column, col_idx, options=None):
+    """Instantiate an index of the given type"""
+    index_type = INDEX_TYPES.get(using.upper())
+    if index_type is None:
+        raise ValueError(f"Unknown index type '{using}'")
+    return index_type(name, column, col_idx, options)
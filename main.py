@@ -1,3 +1,5 @@
+import argparse
+import sys
 
 from engine import DatabaseEngine
 
@@ -9,9 +11,41 @@ def print_banner():
     print("=" * 50)
 
 
+def run_script(engine, script):
+    """Run a script as one batch, printing each result with its timing"""
+    count = 0
+    total = 0.0
+    try:
+        for command, result, seconds in engine.iter_script(script):
+            count += 1
+            total += seconds
+            if result is not None:
+                print(result)
+            print(f"-- [{count}] {seconds * 1000:.3f} ms: {command.splitlines()[0]}")
+    except Exception as e:
+        print(f"Error in statement {count + 1}: {e}", file=sys.stderr)
+        return 1
+    print(f"-- {count} statement(s) in {total * 1000:.3f} ms")
+    return 0
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Mini Database Engine")
+    parser.add_argument('script', nargs='?',
+                        help="SQL file to run non-interactively ('-' for stdin; stdin is also used when piped)")
+    parser.add_argument('--data-dir', default='data', help="Data directory, or :memory:")
+    args = parser.parse_args()
+    engine = DatabaseEngine(args.data_dir)
+    
+    if args.script is not None or not sys.stdin.isatty():
+        if args.script in (None, '-'):
+            script = sys.stdin.read()
+        else:
+            with open(args.script) as f:
+                script = f.read()
+        sys.exit(run_script(engine, script))
+    
     print_banner()
-    engine = DatabaseEngine()
     
     while True:
         try:
@@ -0,0 +1,253 @@
+"""
+Memory budgets and spill-to-disk operators.
+
+The engine's MemoryGovernor holds a budget shared by all running queries,
+and each query gets a QueryMemory with a budget of its own. Operators that
+hold many rows reserve memory as they grow; when a reservation is refused
+they move what they hold to temp files and carry on. ORDER BY writes sorted
+runs and merges them at the end; GROUP BY keeps the groups it already has and
+sends rows of new groups to hash partitions, which are aggregated one at a
+time afterwards. Sizes are estimates (see cache.estimate_size).
+"""
+import heapq
+import tempfile
+import threading
+import zlib
+
+import aggregates
+from cache import estimate_size
+
+DEFAULT_MEMORY_LIMIT = 1024 * 1024 * 1024
+DEFAULT_QUERY_MEMORY_LIMIT = 256 * 1024 * 1024
+# Operators reserve memory in steps of this many bytes
+RESERVE_CHUNK = 64 * 1024
+# Sorted runs merged at once; more are first merged into one run
+MERGE_FAN_IN = 64
+# Hash partitions per spilled aggregation, and how often a partition may spill again
+SPILL_PARTITIONS = 16
+MAX_SPILL_DEPTH = 4
+# Estimated bytes per hash table entry, on top of its aggregate states
+_GROUP_OVERHEAD = 100
+
+
+class MemoryGovernor:
+    """Engine-wide memory budget shared by running queries; None means unlimited"""
+    
+    def __init__(self, limit=DEFAULT_MEMORY_LIMIT, query_limit=DEFAULT_QUERY_MEMORY_LIMIT, spill_dir=None,
+                 metrics=None):
+        self.limit = limit
+        self.query_limit = query_limit
+        self.spill_dir = spill_dir
+        self.metrics = metrics
+        self.reserved = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+    
+    def query(self):
+        """Start tracking one query's memory"""
+        return QueryMemory(self, self.query_limit)
+    
+    def _reserve(self, nbytes):
+        """Take nbytes from the engine budget if it has them"""
+        with self._lock:
+            if self.limit is not None and self.reserved + nbytes > self.limit:
+                return False
+            self.reserved += nbytes
+            self.peak = max(self.peak, self.reserved)
+            return True
+    
+    def _release(self, nbytes):
+        """Return nbytes to the engine budget"""
+        with self._lock:
+            self.reserved -= nbytes
+
+
+class QueryMemory:
+    """One query's reservations, limited by its own budget and the engine's"""
+    
+    def __init__(self, governor, limit):
+        self.governor = governor
+        self.limit = limit
+        self.used = 0
+    
+    def reserve(self, nbytes):
+        """Reserve memory; False means the caller must spill instead"""
+        if self.limit is not None and self.used + nbytes > self.limit:
+            return False
+        if not self.governor._reserve(nbytes):
+            return False
+        self.used += nbytes
+        return True
+    
+    def release(self, nbytes):
+        """Give back memory reserved earlier"""
+        self.used -= nbytes
+        self.governor._release(nbytes)
+    
+    def spill_file(self):
+        """Open a temp file for spilled rows; it is deleted when closed"""
+        if self.governor.metrics is not None:
+            self.governor.metrics.inc('spill_files')
+        return tempfile.TemporaryFile('w+', encoding='utf-8', dir=self.governor.spill_dir, prefix='dbspill-')
+    
+    def record_spill(self, nbytes):
+        """Count bytes written to spill files"""
+        if self.governor.metrics is not None:
+            self.governor.metrics.inc('bytes_spilled', nbytes)
+    
+    def write_run(self, rows):
+        """Write rows to a new spill file and rewind it for reading"""
+        run = self.spill_file()
+        written = 0
+        for row in rows:
+            written += run.write(','.join(row) + '\n')
+        run.seek(0)
+        self.record_spill(written)
+        return run
+
+
+def read_run(run):
+    """Yield the rows of a spill file"""
+    for line in run:
+        yield tuple(line[:-1].split(','))
+
+
+def _row_size(row):
+    """Estimated memory held by one row"""
+    return estimate_size((), (row,))
+
+
+class _SortKey:
+    """Orders rows by several columns, each ascending or descending.
+    
+    Numbers sort numerically and before other values; empty values (nulls)
+    sort last when ascending.
+    """
+    
+    __slots__ = ('values', 'descending')
+    
+    def __init__(self, values, descending):
+        self.values = values
+        self.descending = descending
+    
+    def __lt__(self, other):
+        for left, right, descending in zip(self.values, other.values, self.descending):
+            if left != right:
+                return left > right if descending else left < right
+        return False
+
+
+def _value_key(value):
+    """Sort key of one value"""
+    if value == '':
+        return (2, 0.0, '')
+    try:
+        number = float(value)
+    except ValueError:
+        return (1, 0.0, value)
+    # NaN compares unequal to everything, so it sorts as text
+    return (0, number, '') if number == number else (1, 0.0, value)
+
+
+def sort_rows(rows, col_indices, descending, memory):
+    """ORDER BY: yield rows sorted on the given columns.
+    
+    Rows are buffered while the query's budget allows; past it, the buffer is
+    sorted and written out as a run, and the runs are merged at the end.
+    """
+    def key(row):
+        return _SortKey([_value_key(row[i]) for i in col_indices], descending)
+    
+    runs = []
+    buffer = []
+    held = 0
+    pending = 0
+    try:
+        for row in rows:
+            buffer.append(row)
+            pending += _row_size(row)
+            if pending < RESERVE_CHUNK:
+                continue
+            if memory.reserve(pending):
+                held += pending
+            else:
+                buffer.sort(key=key)
+                runs.append(memory.write_run(buffer))
+                buffer = []
+                memory.release(held)
+                held = 0
+                if len(runs) >= MERGE_FAN_IN:
+                    merged = memory.write_run(heapq.merge(*[read_run(run) for run in runs], key=key))
+                    for run in runs:
+                        run.close()
+                    runs = [merged]
+            pending = 0
+        
+        buffer.sort(key=key)
+        if not runs:
+            yield from buffer
+            return
+        yield from heapq.merge(*[read_run(run) for run in runs], iter(buffer), key=key)
+    finally:
+        for run in runs:
+            run.close()
+        memory.release(held)
+
+
+def aggregate_rows(columns, rows, items, group_by, memory, depth=0):
+    """GROUP BY: yield the result rows of aggregating rows.
+    
+    Groups are kept in memory while the query's budget allows. Past it, rows
+    of groups already in memory are still folded in, and rows of new groups
+    are written to hash partitions; each partition is aggregated on its own
+    after the in-memory groups are returned.
+    """
+    key_indices = [columns.index(col) for col in group_by]
+    group_size = _GROUP_OVERHEAD + sum(aggregates.state_size(item['func']) for item in items if item['func'])
+    groups = {}
+    partitions = []
+    state = {'held': 0, 'pending': 0, 'spilled': 0}
+    
+    def admitted():
+        for row in rows:
+            key = tuple(row[k] for k in key_indices)
+            if key in groups:
+                yield row
+                continue
+            if not partitions:
+                state['pending'] += group_size + _row_size(key)
+                if state['pending'] < RESERVE_CHUNK or depth >= MAX_SPILL_DEPTH:
+                    yield row
+                    continue
+                if memory.reserve(state['pending']):
+                    state['held'] += state['pending']
+                    state['pending'] = 0
+                    yield row
+                    continue
+                partitions.extend([None] * SPILL_PARTITIONS)
+            # A different hash per level, so a partition that spills again splits further
+            bucket = zlib.crc32('\x1f'.join((str(depth),) + key).encode('utf-8')) % SPILL_PARTITIONS
+            if partitions[bucket] is None:
+                partitions[bucket] = memory.spill_file()
+            state['spilled'] += partitions[bucket].write(','.join(row) + '\n')
+    
+    try:
+        try:
+            aggregates.aggregate_rows(columns, admitted(), items, group_by, groups)
+            result = aggregates.finalize(items, group_by, groups)
+        finally:
+            memory.release(state['held'])
+            memory.record_spill(state['spilled'])
+        groups.clear()
+        yield from result
+        result = None
+        
+        for partition in partitions:
+            if partition is not None:
+                partition.seek(0)
+                yield from aggregate_rows(columns, read_run(partition), items, group_by, memory, depth + 1)
+                partition.close()
+    finally:
+        for partition in partitions:
+            if partition is not None:
+                partition.close()
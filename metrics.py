@@ -0,0 +1,184 @@
+"""
+Engine metrics: counters and latency histograms.
+
+Recording takes one uncontended lock and, for histograms, a bisect over a
+fixed list of bucket bounds, so metrics stay on permanently. They can be read
+as a dict (snapshot), as SHOW STATS text, or as a Prometheus text-format dump.
+"""
+import bisect
+import os
+import tempfile
+import threading
+import time
+
+# Latency bucket upper bounds in seconds: 50us doubling up to ~105s
+LATENCY_BOUNDS = [0.00005 * 2 ** i for i in range(22)]
+
+
+class Histogram:
+    
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def observe(self, value):
+        """Record one observation"""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+    
+    def percentile(self, pct):
+        """Estimate a percentile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(estimate, self.max)
+            seen += bucket_count
+        return self.max
+
+
+class Metrics:
+    
+    def __init__(self, dump_path=None, dump_interval=10.0):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.latency = {}
+        self.cache_hits = {}
+        self.cache_misses = {}
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self._next_dump = time.monotonic() + dump_interval
+        self.started = time.time()
+    
+    def inc(self, name, value=1):
+        """Add to a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def observe_statement(self, statement_type, seconds, failed=False):
+        """Record one statement's latency"""
+        with self._lock:
+            histogram = self.latency.get(statement_type)
+            if histogram is None:
+                histogram = self.latency[statement_type] = Histogram()
+            histogram.observe(seconds)
+            if failed:
+                self.counters['statement_errors'] = self.counters.get('statement_errors', 0) + 1
+        if self.dump_path is not None and time.monotonic() >= self._next_dump:
+            self.dump()
+    
+    def record_cache(self, cache, hit):
+        """Record a cache lookup"""
+        with self._lock:
+            target = self.cache_hits if hit else self.cache_misses
+            target[cache] = target.get(cache, 0) + 1
+    
+    def snapshot(self):
+        """Return all metrics as plain data"""
+        with self._lock:
+            statements = {}
+            for statement_type, histogram in sorted(self.latency.items()):
+                statements[statement_type] = {
+                    'count': histogram.count,
+                    'total_s': histogram.total,
+                    'p50_s': histogram.percentile(50),
+                    'p95_s': histogram.percentile(95),
+                    'p99_s': histogram.percentile(99),
+                    'max_s': histogram.max,
+                }
+            caches = {}
+            for cache in sorted(set(self.cache_hits) | set(self.cache_misses)):
+                hits = self.cache_hits.get(cache, 0)
+                misses = self.cache_misses.get(cache, 0)
+                caches[cache] = {'hits': hits, 'misses': misses,
+                                 'hit_ratio': hits / (hits + misses) if hits + misses else 0.0}
+            return {
+                'uptime_s': time.time() - self.started,
+                'statements': statements,
+                'counters': dict(self.counters),
+                'caches': caches,
+            }
+    
+    def format_text(self):
+        """Render a snapshot for SHOW STATS"""
+        snap = self.snapshot()
+        counters = snap['counters']
+        lines = ["Engine statistics", "=" * 72]
+        lines.append(f"Uptime: {snap['uptime_s']:.1f}s")
+        lines.append("\nStatements:")
+        lines.append(f"  {'Type':<12} {'Count':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+        for statement_type, stats in snap['statements'].items():
+            lines.append(f"  {statement_type:<12} {stats['count']:>8} {stats['p50_s'] * 1000:>10.3f} "
+                         f"{stats['p95_s'] * 1000:>10.3f} {stats['p99_s'] * 1000:>10.3f} "
+                         f"{stats['max_s'] * 1000:>10.3f}")
+        lines.append(f"  Errors: {counters.get('statement_errors', 0)}")
+        lines.append("\nRows:")
+        lines.append(f"  Scanned: {counters.get('rows_scanned', 0)}")
+        lines.append(f"  Returned: {counters.get('rows_returned', 0)}")
+        lines.append("\nStorage:")
+        lines.append(f"  Bytes read: {counters.get('bytes_read', 0)}")
+        lines.append(f"  Bytes written: {counters.get('bytes_written', 0)}")
+        lines.append(f"  fsyncs: {counters.get('fsyncs', 0)}")
+        lines.append(f"  Spill files: {counters.get('spill_files', 0)}")
+        lines.append(f"  Bytes spilled: {counters.get('bytes_spilled', 0)}")
+        lines.append("\nRecovery:")
+        lines.append(f"  Checkpoints: {counters.get('checkpoints', 0)}")
+        lines.append(f"  Tables recovered: {counters.get('tables_recovered', 0)}")
+        lines.append(f"  Log entries replayed: {counters.get('log_entries_replayed', 0)}")
+        lines.append("\nCaches:")
+        if not snap['caches']:
+            lines.append("  (none)")
+        for cache, stats in snap['caches'].items():
+            lines.append(f"  {cache}: {stats['hit_ratio']:.1%} hit ratio "
+                         f"({stats['hits']} hits, {stats['misses']} misses)")
+        return '\n'.join(lines)
+    
+    def format_prometheus(self):
+        """Render metrics in the Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                "# HELP db_statement_duration_seconds Statement latency by type.",
+                "# TYPE db_statement_duration_seconds histogram",
+            ]
+            for statement_type, histogram in sorted(self.latency.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.bounds, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'db_statement_duration_seconds_bucket{{type="{statement_type}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'db_statement_duration_seconds_bucket{{type="{statement_type}",le="+Inf"}} {histogram.count}')
+                lines.append(f'db_statement_duration_seconds_sum{{type="{statement_type}"}} {histogram.total}')
+                lines.append(f'db_statement_duration_seconds_count{{type="{statement_type}"}} {histogram.count}')
+            
+            for name, value in sorted(self.counters.items()):
+                metric = f"db_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            
+            for metric, source in (('db_cache_hits_total', self.cache_hits),
+                                   ('db_cache_misses_total', self.cache_misses)):
+                if source:
+                    lines.append(f"# TYPE {metric} counter")
+                    for cache, value in sorted(source.items()):
+                        lines.append(f'{metric}{{cache="{cache}"}} {value}')
+        return '\n'.join(lines) + '\n'
+    
+    def dump(self, path=None):
+        """Atomically write the Prometheus text dump"""
+        path = path or self.dump_path
+        self._next_dump = time.monotonic() + self.dump_interval
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.format_prometheus())
+        os.replace(tmp_path, path)
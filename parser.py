@@ -1,18 +1,45 @@
 
 import re
 
+# Stands in for the n-th ? of a statement parsed by parse_template
+PARAMETER_MARKER = '\x00{}\x00'
+
 
 class SQLParser:
-    
+
     @staticmethod
     def parse(command):
         """Parse SQL command and return operation type and parameters"""
         command = command.strip().rstrip(';')
         
+        # EXPLAIN [ANALYZE]
+        if command.upper().startswith('EXPLAIN'):
+            return SQLParser._parse_explain(command)
+        
+        # CREATE MATERIALIZED VIEW
+        elif command.upper().startswith('CREATE MATERIALIZED VIEW'):
+            return SQLParser._parse_create_view(command)
+        
+        # REFRESH MATERIALIZED VIEW
+        elif command.upper().startswith('REFRESH MATERIALIZED VIEW'):
+            return SQLParser._parse_refresh_view(command)
+        
+        # DROP MATERIALIZED VIEW
+        elif command.upper().startswith('DROP MATERIALIZED VIEW'):
+            return SQLParser._parse_drop_view(command)
+        
+        # CREATE INDEX
+        elif command.upper().startswith('CREATE INDEX'):
+            return SQLParser._parse_create_index(command)
+        
         # CREATE TABLE
-        if command.upper().startswith('CREATE TABLE'):
+        elif command.upper().startswith('CREATE TABLE'):
             return SQLParser._parse_create(command)
         
+        # DROP INDEX
+        elif command.upper().startswith('DROP INDEX'):
+            return SQLParser._parse_drop_index(command)
+        
         # DROP TABLE
         elif command.upper().startswith('DROP TABLE'):
             return SQLParser._parse_drop(command)
@@ -21,6 +48,10 @@ class SQLParser:
         elif command.upper().startswith('SHOW TABLES'):
             return {'type': 'SHOW_TABLES'}
         
+        # SHOW STATS
+        elif command.upper().startswith('SHOW STATS'):
+            return {'type': 'SHOW_STATS'}
+        
         # DESCRIBE TABLE
         elif command.upper().startswith('DESCRIBE'):
             return SQLParser._parse_describe(command)
@@ -41,18 +72,124 @@ class SQLParser:
         elif command.upper().startswith('UPDATE'):
             return SQLParser._parse_update(command)
         
+        # ALTER TABLE
+        elif command.upper().startswith('ALTER TABLE'):
+            return SQLParser._parse_alter(command)
+        
         # TRUNCATE
         elif command.upper().startswith('TRUNCATE TABLE'):
             return SQLParser._parse_truncate(command)
         
+        # ANALYZE
+        elif command.upper().startswith('ANALYZE'):
+            return SQLParser._parse_analyze(command)
+        
+        # CHECKPOINT
+        elif command.upper().startswith('CHECKPOINT'):
+            return SQLParser._parse_checkpoint(command)
+        
         else:
             raise ValueError(f"Unknown command: {command}")
     
+    @staticmethod
+    def split_statements(script):
+        """Split a script on semicolons outside quotes, dropping -- comments"""
+        statements = []
+        current = []
+        quote_char = None
+        i = 0
+        while i < len(script):
+            char = script[i]
+            if quote_char:
+                if char == quote_char:
+                    quote_char = None
+            elif char in ('"', "'"):
+                quote_char = char
+            elif script.startswith('--', i):
+                end = script.find('\n', i)
+                i = len(script) if end < 0 else end
+                continue
+            elif char == ';':
+                statements.append(''.join(current))
+                current = []
+                i += 1
+                continue
+            current.append(char)
+            i += 1
+        statements.append(''.join(current))
+        return [statement.strip() for statement in statements if statement.strip()]
+    
+    @staticmethod
+    def parse_template(command):
+        """Parse a statement with ? placeholders once; returns (parsed, placeholder count)"""
+        parts = []
+        count = 0
+        quote_char = None
+        for char in command:
+            if quote_char:
+                if char == quote_char:
+                    quote_char = None
+            elif char in ('"', "'"):
+                quote_char = char
+            elif char == '?':
+                parts.append(PARAMETER_MARKER.format(count))
+                count += 1
+                continue
+            parts.append(char)
+        parsed = SQLParser.parse(''.join(parts))
+        
+        found = []
+        pending = [parsed]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, dict):
+                pending.extend(node.keys())
+                pending.extend(node.values())
+            elif isinstance(node, list):
+                pending.extend(node)
+            elif isinstance(node, str) and '\x00' in node:
+                found.append(node)
+        if sorted(found) != sorted(PARAMETER_MARKER.format(i) for i in range(count)):
+            raise ValueError("Placeholders can only stand for whole values")
+        return parsed, count
+    
+    @staticmethod
+    def bind(template, parameters):
+        """Substitute parameter values into a parse_template result"""
+        parsed, count = template
+        parameters = list(parameters)
+        if len(parameters) != count:
+            raise ValueError(f"Statement takes {count} parameter(s), {len(parameters)} given")
+        
+        values = {}
+        for i, value in enumerate(parameters):
+            if value is None:
+                value = ''
+            elif isinstance(value, bytes):
+                value = value.decode('utf-8')
+            else:
+                value = str(value)
+            # Table files are comma separated with one row per line
+            if ',' in value or '\n' in value:
+                raise ValueError(f"Value cannot contain commas or newlines: {value!r}")
+            values[PARAMETER_MARKER.format(i)] = value
+        
+        def substitute(node):
+            if isinstance(node, dict):
+                return {substitute(key): substitute(value) for key, value in node.items()}
+            if isinstance(node, list):
+                return [substitute(value) for value in node]
+            if isinstance(node, str):
+                return values.get(node, node)
+            return node
+        
+        return substitute(parsed)
+    
     @staticmethod
     def _parse_create(command):
         """Parse CREATE TABLE command"""
-        pattern = r'CREATE TABLE\s+(\w+)\s*\(([^)]+)\)'
-        match = re.search(pattern, command, re.IGNORECASE)
+        pattern = r'CREATE TABLE\s+(\w+)\s*\(([^)]+)\)(?:\s+PARTITION\s+BY\s+(.+))?$'
+        match = re.search(pattern, command, re.IGNORECASE | re.DOTALL)
         
         if not match:
             raise ValueError("Invalid CREATE TABLE syntax")
@@ -61,10 +198,105 @@ class SQLParser:
         columns_str = match.group(2)
         columns = [col.strip() for col in columns_str.split(',')]
         
+        partitioning = None
+        if match.group(3):
+            partitioning = SQLParser._parse_partitioning(match.group(3))
+        
         return {
             'type': 'CREATE',
             'table': table_name,
-            'columns': columns
+            'columns': columns,
+            'partitioning': partitioning
+        }
+    
+    @staticmethod
+    def _parse_partitioning(partition_str):
+        """Parse the PARTITION BY clause of CREATE TABLE"""
+        hash_pattern = r'HASH\s*\(\s*(\w+)\s*\)\s*PARTITIONS\s+(\d+)\s*$'
+        match = re.match(hash_pattern, partition_str, re.IGNORECASE)
+        if match:
+            count = int(match.group(2))
+            if count < 1:
+                raise ValueError("PARTITIONS must be at least 1")
+            return {
+                'kind': 'HASH',
+                'column': match.group(1),
+                'partitions': [{'name': f"p{i}"} for i in range(count)]
+            }
+        
+        range_pattern = r'RANGE\s*\(\s*(\w+)\s*\)\s*\((.+)\)\s*$'
+        match = re.match(range_pattern, partition_str, re.IGNORECASE | re.DOTALL)
+        if not match:
+            raise ValueError("Invalid PARTITION BY clause")
+        
+        partitions = []
+        for definition in re.split(r',\s*(?=PARTITION\b)', match.group(2).strip(), flags=re.IGNORECASE):
+            partitions.append(SQLParser._parse_range_partition(definition))
+        return {
+            'kind': 'RANGE',
+            'column': match.group(1),
+            'partitions': partitions
+        }
+    
+    @staticmethod
+    def _parse_range_partition(definition):
+        """Parse PARTITION name VALUES LESS THAN (value | MAXVALUE)"""
+        pattern = r'PARTITION\s+(\w+)\s+VALUES\s+LESS\s+THAN\s*\(\s*([^)]*?)\s*\)$'
+        match = re.match(pattern, definition.strip(), re.IGNORECASE)
+        
+        if not match:
+            raise ValueError(f"Invalid partition definition: {definition.strip()}")
+        
+        bound = match.group(2).strip('"').strip("'")
+        return {
+            'name': match.group(1),
+            'less_than': None if bound.upper() == 'MAXVALUE' else bound
+        }
+    
+    @staticmethod
+    def _parse_alter(command):
+        """Parse ALTER TABLE ... ADD | DROP | TRUNCATE PARTITION, ALTER COLUMN ... SET ENCODING or SET CHANGE LOG"""
+        change_log_match = re.search(r'ALTER TABLE\s+(\w+)\s+SET\s+CHANGE\s+LOG\s+(ON|OFF)\s*$', command,
+                                     re.IGNORECASE)
+        if change_log_match:
+            return {
+                'type': 'ALTER_CHANGE_LOG',
+                'table': change_log_match.group(1),
+                'enabled': change_log_match.group(2).upper() == 'ON'
+            }
+        
+        encoding_pattern = r'ALTER TABLE\s+(\w+)\s+ALTER\s+COLUMN\s+(\w+)\s+SET\s+ENCODING\s+(\w+)\s*$'
+        encoding_match = re.search(encoding_pattern, command, re.IGNORECASE)
+        if encoding_match:
+            encoding = encoding_match.group(3).upper()
+            if encoding not in ('DICTIONARY', 'PLAIN'):
+                raise ValueError(f"Unknown encoding '{encoding_match.group(3)}'; use DICTIONARY or PLAIN")
+            return {
+                'type': 'ALTER_ENCODING',
+                'table': encoding_match.group(1),
+                'column': encoding_match.group(2),
+                'encoding': encoding
+            }
+        
+        pattern = r'ALTER TABLE\s+(\w+)\s+(ADD|DROP|TRUNCATE)\s+(PARTITION\s+(\w+).*)$'
+        match = re.search(pattern, command, re.IGNORECASE | re.DOTALL)
+        
+        if not match:
+            raise ValueError("Invalid ALTER TABLE syntax")
+        
+        action = match.group(2).upper()
+        if action == 'ADD':
+            partition = SQLParser._parse_range_partition(match.group(3))
+        elif not re.match(r'PARTITION\s+\w+\s*$', match.group(3), re.IGNORECASE):
+            raise ValueError("Invalid ALTER TABLE syntax")
+        else:
+            partition = {'name': match.group(4)}
+        
+        return {
+            'type': 'ALTER_PARTITION',
+            'action': action,
+            'table': match.group(1),
+            'partition': partition
         }
     
     @staticmethod
@@ -125,6 +357,41 @@ class SQLParser:
         else:
             columns = [col.strip() for col in columns_str.split(',')]
         
+        # Extract ORDER BY clause if present
+        order_by = []
+        order_pattern = r'\s+ORDER\s+BY\s+(.+)$'
+        order_match = re.search(order_pattern, command, re.IGNORECASE)
+        if order_match:
+            for term in order_match.group(1).split(','):
+                term_match = re.match(r'^(\w+)(?:\s+(ASC|DESC))?$', term.strip(), re.IGNORECASE)
+                if not term_match:
+                    raise ValueError(f"Invalid ORDER BY term: {term.strip()}")
+                order_by.append({'column': term_match.group(1),
+                                 'descending': (term_match.group(2) or '').upper() == 'DESC'})
+            command = command[:order_match.start()]
+        
+        # Extract GROUP BY clause if present
+        group_by = []
+        group_pattern = r'\s+GROUP\s+BY\s+(.+)$'
+        group_match = re.search(group_pattern, command, re.IGNORECASE)
+        if group_match:
+            group_by = [col.strip() for col in group_match.group(1).split(',')]
+            command = command[:group_match.start()]
+        
+        # Extract TABLESAMPLE SYSTEM (percent) [REPEATABLE (seed)] if present
+        sample = None
+        sample_pattern = (r'FROM\s+\w+\s+TABLESAMPLE\s+SYSTEM\s*\(\s*([\d.]+)\s*\)'
+                          r'(?:\s+REPEATABLE\s*\(\s*(\d+)\s*\))?')
+        sample_match = re.search(sample_pattern, command, re.IGNORECASE)
+        if sample_match:
+            percent = float(sample_match.group(1))
+            if not 0 < percent <= 100:
+                raise ValueError("TABLESAMPLE percentage must be between 0 and 100")
+            seed = sample_match.group(2)
+            sample = {'method': 'SYSTEM', 'percent': percent, 'seed': int(seed) if seed is not None else None}
+        elif re.search(r'\bTABLESAMPLE\b', command, re.IGNORECASE):
+            raise ValueError("Invalid TABLESAMPLE clause; use TABLESAMPLE SYSTEM (percent)")
+        
         # Extract WHERE clause if present
         where_clause = None
         where_pattern = r'WHERE\s+(.+)'
@@ -133,11 +400,37 @@ class SQLParser:
         if where_match:
             where_clause = SQLParser._parse_where(where_match.group(1))
         
+        # Aggregates: FUNC(column|*) [AS name]
+        items = None
+        aggregate_pattern = (r'^(COUNT|SUM|MIN|MAX|AVG|APPROX_COUNT_DISTINCT)\s*\(\s*(\*|\w+)\s*\)'
+                             r'(?:\s+AS\s+(\w+))?$')
+        parsed_items = [re.match(aggregate_pattern, col, re.IGNORECASE) for col in columns]
+        if group_by or any(parsed_items):
+            items = []
+            for col, aggregate in zip(columns, parsed_items):
+                if aggregate:
+                    func = aggregate.group(1).upper()
+                    column = aggregate.group(2)
+                    if column == '*' and func != 'COUNT':
+                        raise ValueError(f"{func}(*) is not supported")
+                    name = aggregate.group(3) or (func.lower() if column == '*' else f"{func.lower()}_{column}")
+                    items.append({'func': func, 'column': column, 'name': name})
+                elif col == '*':
+                    raise ValueError("SELECT * cannot be combined with GROUP BY or aggregates")
+                else:
+                    if col not in group_by:
+                        raise ValueError(f"Column '{col}' must appear in GROUP BY or be aggregated")
+                    items.append({'func': None, 'column': col, 'name': col})
+        
         return {
             'type': 'SELECT',
             'table': table_name,
             'columns': columns,
-            'where': where_clause
+            'where': where_clause,
+            'items': items,
+            'group_by': group_by,
+            'order_by': order_by,
+            'sample': sample
         }
     
     @staticmethod
@@ -241,21 +534,166 @@ class SQLParser:
             'table': match.group(1)
         }
     
+    @staticmethod
+    def _parse_create_view(command):
+        """Parse CREATE MATERIALIZED VIEW command"""
+        pattern = r'CREATE MATERIALIZED VIEW\s+(\w+)\s+AS\s+(SELECT\s.+)$'
+        match = re.search(pattern, command, re.IGNORECASE | re.DOTALL)
+        
+        if not match:
+            raise ValueError("Invalid CREATE MATERIALIZED VIEW syntax")
+        
+        return {
+            'type': 'CREATE_VIEW',
+            'view': match.group(1),
+            'select': SQLParser._parse_select(match.group(2)),
+            'sql': match.group(2)
+        }
+    
+    @staticmethod
+    def _parse_refresh_view(command):
+        """Parse REFRESH MATERIALIZED VIEW command"""
+        pattern = r'REFRESH MATERIALIZED VIEW\s+(\w+)(\s+FULL)?\s*$'
+        match = re.search(pattern, command, re.IGNORECASE)
+        
+        if not match:
+            raise ValueError("Invalid REFRESH MATERIALIZED VIEW syntax")
+        
+        return {
+            'type': 'REFRESH_VIEW',
+            'view': match.group(1),
+            'full': bool(match.group(2))
+        }
+    
+    @staticmethod
+    def _parse_drop_view(command):
+        """Parse DROP MATERIALIZED VIEW command"""
+        pattern = r'DROP MATERIALIZED VIEW\s+(\w+)'
+        match = re.search(pattern, command, re.IGNORECASE)
+        
+        if not match:
+            raise ValueError("Invalid DROP MATERIALIZED VIEW syntax")
+        
+        return {
+            'type': 'DROP_VIEW',
+            'view': match.group(1)
+        }
+    
+    @staticmethod
+    def _parse_analyze(command):
+        """Parse ANALYZE command"""
+        pattern = r'ANALYZE\s+(\w+)'
+        match = re.search(pattern, command, re.IGNORECASE)
+        
+        if not match:
+            raise ValueError("Invalid ANALYZE syntax")
+        
+        return {
+            'type': 'ANALYZE',
+            'table': match.group(1)
+        }
+    
+    @staticmethod
+    def _parse_checkpoint(command):
+        """Parse CHECKPOINT [table] command"""
+        match = re.match(r'CHECKPOINT(?:\s+(\w+))?\s*$', command, re.IGNORECASE)
+        
+        if not match:
+            raise ValueError("Invalid CHECKPOINT syntax")
+        
+        return {
+            'type': 'CHECKPOINT',
+            'table': match.group(1)
+        }
+    
+    @staticmethod
+    def _parse_create_index(command):
+        """Parse CREATE INDEX command"""
+        pattern = (r'CREATE INDEX\s+(\w+)\s+ON\s+(\w+)\s*(?:USING\s+(\w+)\s*)?\(\s*(\w+)\s*\)'
+                   r'(?:\s*WITH\s*\(([^)]*)\))?\s*$')
+        match = re.search(pattern, command, re.IGNORECASE)
+        
+        if not match:
+            raise ValueError("Invalid CREATE INDEX syntax")
+        
+        # WITH (option = value, ...)
+        options = {}
+        if match.group(5):
+            for assignment in match.group(5).split(','):
+                parts = assignment.split('=')
+                if len(parts) != 2:
+                    raise ValueError("Invalid WITH clause")
+                options[parts[0].strip().lower()] = parts[1].strip().strip('"').strip("'")
+        
+        return {
+            'type': 'CREATE_INDEX',
+            'name': match.group(1),
+            'table': match.group(2),
+            'using': (match.group(3) or 'HASH').upper(),
+            'column': match.group(4),
+            'options': options
+        }
+    
+    @staticmethod
+    def _parse_drop_index(command):
+        """Parse DROP INDEX command"""
+        pattern = r'DROP INDEX\s+(\w+)\s+ON\s+(\w+)'
+        match = re.search(pattern, command, re.IGNORECASE)
+        
+        if not match:
+            raise ValueError("Invalid DROP INDEX syntax")
+        
+        return {
+            'type': 'DROP_INDEX',
+            'name': match.group(1),
+            'table': match.group(2)
+        }
+    
+    @staticmethod
+    def _parse_explain(command):
+        """Parse EXPLAIN [ANALYZE] command"""
+        pattern = r'EXPLAIN\s+(ANALYZE\s+)?(.+)'
+        match = re.match(pattern, command, re.IGNORECASE | re.DOTALL)
+        
+        if not match:
+            raise ValueError("Invalid EXPLAIN syntax")
+        
+        statement = SQLParser.parse(match.group(2))
+        if statement['type'] == 'EXPLAIN':
+            raise ValueError("Cannot EXPLAIN an EXPLAIN statement")
+        
+        return {
+            'type': 'EXPLAIN',
+            'analyze': bool(match.group(1)),
+            'statement': statement,
+            'sql': match.group(2)
+        }
+    
     @staticmethod
     def _parse_where(where_str):
         """Parse WHERE clause"""
-        # Simple equality check: column = value
-        pattern = r'(\w+)\s*=\s*(.+)'
+        # Pattern match first: the pattern itself may contain comparison characters
+        like_match = re.match(r'^(\w+)\s+LIKE\s+(.+)$', where_str.strip(), re.IGNORECASE)
+        if like_match:
+            return {
+                'column': like_match.group(1),
+                'operator': 'LIKE',
+                'value': like_match.group(2).strip().strip('"').strip("'")
+            }
+        
+        # Single comparison: column op value
+        pattern = r'(\w+)\s*(<=|>=|!=|<>|=|<|>)\s*(.+)'
         match = re.search(pattern, where_str.strip())
         
         if not match:
             raise ValueError("Invalid WHERE clause")
         
         column = match.group(1)
-        value = match.group(2).strip().strip('"').strip("'")
+        operator = '!=' if match.group(2) == '<>' else match.group(2)
+        value = match.group(3).strip().strip('"').strip("'")
         
         return {
             'column': column,
-            'operator': '=',
+            'operator': operator,
             'value': value
         }
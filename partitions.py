@@ -0,0 +1,90 @@
+"""
+Table partitioning.
+
+A partitioned table keeps its header in <table>.db and its rows in hidden
+physical tables named <table>$<partition>, one per partition. The scheme is
+stored in the table's catalog entry:
+
+    {'kind': 'RANGE', 'column': 'ts', 'partitions': [{'name': 'p2024', 'less_than': '2025'}, ...]}
+    {'kind': 'HASH', 'column': 'id', 'partitions': [{'name': 'p0'}, ...]}
+
+A RANGE partition holds the values below its bound and at or above the
+previous partition's bound; a bound of None is MAXVALUE. A HASH partition
+holds the values whose CRC-32 modulo the partition count is its position.
+"""
+import zlib
+
+from planner import compare_values
+
+PARTITION_SEPARATOR = '$'
+
+
+def physical_name(table, partition):
+    """Name of the hidden table that stores a partition"""
+    return f"{table}{PARTITION_SEPARATOR}{partition}"
+
+
+def is_partition(table):
+    """Whether a stored table is a partition of another"""
+    return PARTITION_SEPARATOR in table
+
+
+def validate(scheme):
+    """Check a scheme's partitions; RANGE bounds must increase"""
+    names = [partition['name'] for partition in scheme['partitions']]
+    if not names:
+        raise ValueError("A partitioned table needs at least one partition")
+    if len(set(names)) != len(names):
+        raise ValueError("Partition names must be unique")
+    if scheme['kind'] == 'RANGE':
+        bounds = [partition['less_than'] for partition in scheme['partitions']]
+        if None in bounds[:-1]:
+            raise ValueError("Only the last partition can be VALUES LESS THAN (MAXVALUE)")
+        for low, high in zip(bounds, bounds[1:]):
+            if high is not None and not compare_values(low, '<', high):
+                raise ValueError("Partition bounds must be strictly increasing")
+
+
+def route(scheme, value):
+    """Return the name of the partition a value belongs to"""
+    partitions = scheme['partitions']
+    if scheme['kind'] == 'HASH':
+        return partitions[zlib.crc32(value.encode('utf-8')) % len(partitions)]['name']
+    for partition in partitions:
+        if partition['less_than'] is None or compare_values(value, '<', partition['less_than']):
+            return partition['name']
+    raise ValueError(f"No partition for value '{value}' of column '{scheme['column']}'")
+
+
+def prune(scheme, where):
+    """Return the names of the partitions that can hold rows matching where"""
+    partitions = scheme['partitions']
+    if (not where or where['column'] != scheme['column']
+            or where['operator'] not in ('=', '<', '<=', '>', '>=')):
+        return [partition['name'] for partition in partitions]
+
+    value = where['value']
+    if scheme['kind'] == 'HASH':
+        if where['operator'] == '=':
+            return [route(scheme, value)]
+        return [partition['name'] for partition in partitions]
+
+    kept = []
+    low = None
+    for partition in partitions:
+        high = partition['less_than']
+        # This partition holds [low, high); None is unbounded
+        if where['operator'] == '=':
+            keep = (low is None or not compare_values(value, '<', low)) and \
+                   (high is None or compare_values(value, '<', high))
+        elif where['operator'] == '<':
+            keep = low is None or compare_values(low, '<', value)
+        elif where['operator'] == '<=':
+            keep = low is None or compare_values(low, '<=', value)
+        else:
+            # > and >=: some value in the partition reaches past value
+            keep = high is None or compare_values(high, '>', value)
+        if keep:
+            kept.append(partition['name'])
+        low = high
+    return kept
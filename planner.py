@@ -0,0 +1,231 @@
+"""
+Column statistics and cost-based access path selection.
+
+ANALYZE stores per-column statistics in the table's catalog entry: distinct
+count, null fraction (empty values are nulls), most common values and an
+equi-depth histogram. The planner turns them into a selectivity estimate for
+the WHERE clause and picks the cheapest of a full scan, an index scan or a
+parallel scan. Costs are in units of one row read sequentially.
+"""
+import os
+import re
+import time
+from collections import Counter
+from functools import lru_cache
+
+import dictionary
+
+MCV_COUNT = 10
+HISTOGRAM_BUCKETS = 10
+
+# Selectivities used when a column has not been analyzed
+DEFAULT_SELECTIVITY = {'=': 0.1, '!=': 0.9, '<': 1 / 3, '<=': 1 / 3, '>': 1 / 3, '>=': 1 / 3, 'LIKE': 0.05}
+
+SEQ_ROW_COST = 1.0
+FILTER_ROW_COST = 0.5
+INDEX_LOOKUP_COST = 10.0
+# Seek plus readline for each row fetched through an index
+INDEX_FETCH_COST = 4.0
+# Starting worker processes and shipping the predicate
+PARALLEL_STARTUP_COST = 50000.0
+# Pickling a matching row back from a worker
+PARALLEL_TRANSFER_COST = 2.0
+
+
+def _as_number(value):
+    """Return value as a float, or None if it is not numeric"""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=256)
+def _like_regex(pattern):
+    """Compile a LIKE pattern: % matches any run of characters, _ any one character"""
+    parts = ['.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in pattern]
+    return re.compile(''.join(parts), re.DOTALL)
+
+
+def compare_values(row_value, operator, value):
+    """Evaluate a comparison; numeric when both sides are numbers"""
+    if operator == '=':
+        return row_value == value
+    if operator == '!=':
+        return row_value != value
+    if operator == 'LIKE':
+        return _like_regex(value).fullmatch(row_value) is not None
+    left, right = _as_number(row_value), _as_number(value)
+    if left is None or right is None:
+        left, right = row_value, value
+    if operator == '<':
+        return left < right
+    if operator == '<=':
+        return left <= right
+    if operator == '>':
+        return left > right
+    if operator == '>=':
+        return left >= right
+    return False
+
+
+def collect_stats(columns, rows):
+    """Compute the statistics ANALYZE stores for a table"""
+    row_count = len(rows)
+    result = {'row_count': row_count, 'analyzed_at': time.time(), 'columns': {}}
+    for i, column in enumerate(columns):
+        non_null = [row[i] for row in rows if row[i] != '']
+        counts = Counter(non_null)
+        numeric = bool(counts) and all(_as_number(v) is not None for v in counts)
+
+        # Only values more common than average are worth listing
+        mcv = []
+        if counts:
+            average = len(non_null) / len(counts)
+            for value, count in counts.most_common(MCV_COUNT):
+                if count > average:
+                    mcv.append([value, count / row_count])
+
+        histogram = []
+        if non_null:
+            ordered = sorted(non_null, key=float if numeric else None)
+            last = len(ordered) - 1
+            histogram = [ordered[(last * k) // HISTOGRAM_BUCKETS] for k in range(HISTOGRAM_BUCKETS + 1)]
+
+        result['columns'][column] = {
+            'distinct': len(counts),
+            'null_frac': (row_count - len(non_null)) / row_count if row_count else 0.0,
+            'mcv': mcv,
+            'histogram': histogram,
+            'numeric': numeric,
+        }
+    return result
+
+
+def _histogram_fraction(col_stats, value):
+    """Estimate the fraction of non-null values below value"""
+    bounds = col_stats['histogram']
+    if not bounds:
+        return 0.5
+    if col_stats['numeric'] and _as_number(value) is not None:
+        bounds = [float(b) for b in bounds]
+        value = float(value)
+    if value <= bounds[0]:
+        return 0.0
+    if value >= bounds[-1]:
+        return 1.0
+    buckets = len(bounds) - 1
+    for i in range(buckets):
+        low, high = bounds[i], bounds[i + 1]
+        if low <= value < high:
+            within = 0.5
+            if isinstance(value, float) and high > low:
+                within = (value - low) / (high - low)
+            return (i + within) / buckets
+    return 1.0
+
+
+def estimate_selectivity(col_stats, operator, value):
+    """Estimate the fraction of rows a single-column predicate matches"""
+    if not col_stats:
+        return DEFAULT_SELECTIVITY.get(operator, 1 / 3)
+
+    non_null = 1.0 - col_stats['null_frac']
+    if operator in ('=', '!='):
+        equal = None
+        for mcv_value, frequency in col_stats['mcv']:
+            if mcv_value == value:
+                equal = frequency
+                break
+        if equal is None:
+            remaining = non_null - sum(frequency for _, frequency in col_stats['mcv'])
+            others = col_stats['distinct'] - len(col_stats['mcv'])
+            equal = max(remaining, 0.0) / others if others > 0 else 0.0
+        return equal if operator == '=' else max(non_null - equal, 0.0)
+
+    below = _histogram_fraction(col_stats, value)
+    if operator in ('<', '<='):
+        return non_null * below
+    if operator in ('>', '>='):
+        return non_null * (1.0 - below)
+    return DEFAULT_SELECTIVITY.get(operator, 1 / 3)
+
+
+def choose_access_path(table_rows, matched_rows, index_name=None, index_cost=None, workers=1):
+    """Cost each access path and return the cheapest.
+
+    index_cost is the index type's own estimate (see indexes); without one a
+    row-locating index is assumed. Returns {'scan', 'index', 'workers',
+    'cost', 'costs'} where costs maps every candidate to its estimated cost.
+    """
+    scan_cost = table_rows * (SEQ_ROW_COST + FILTER_ROW_COST)
+    candidates = {'Full Scan': scan_cost}
+    if index_name is not None:
+        if index_cost is None:
+            index_cost = INDEX_LOOKUP_COST + matched_rows * INDEX_FETCH_COST
+        candidates['Index Scan'] = index_cost
+    if workers > 1:
+        candidates['Parallel Scan'] = (PARALLEL_STARTUP_COST + scan_cost / workers
+                                       + matched_rows * PARALLEL_TRANSFER_COST)
+
+    scan = min(candidates, key=candidates.get)
+    return {
+        'scan': scan,
+        'index': index_name if scan == 'Index Scan' else None,
+        'workers': workers if scan == 'Parallel Scan' else 1,
+        'cost': candidates[scan],
+        'costs': candidates,
+    }
+
+
+def split_ranges(path, parts, size=None):
+    """Split the first size bytes of a table file into roughly equal row ranges"""
+    if size is None:
+        size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        start = len(f.readline())
+    step = max(1, (size - start) // parts)
+    ranges = []
+    while start < size:
+        end = min(size, start + step)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def scan_range(path, start, end, col_idx, operator, value, dictionaries=None):
+    """Parallel scan worker: filter the rows whose line starts in [start, end).
+
+    dictionaries is the table's catalog entry of that name, needed when the
+    file has encoded columns. Returns (rows scanned, matching rows).
+    """
+    scanned = 0
+    rows = []
+    with open(path, 'rb') as f:
+        codec = None
+        matches_code = None
+        columns, encoded = dictionary.parse_header(f.readline().decode('utf-8'))
+        if encoded:
+            codec = dictionary.RowCodec(columns, encoded, dictionaries)
+            matches_code = codec.matcher(col_idx, lambda v: compare_values(v, operator, value))
+        if start > 0:
+            # Skip the partial line; it belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                break
+            if not line.strip():
+                continue
+            scanned += 1
+            row = line.decode('utf-8').strip().split(',')
+            if matches_code is not None:
+                if matches_code(row):
+                    rows.append(codec.decode(row))
+                continue
+            if codec is not None:
+                row = codec.decode(row)
+            if compare_values(row[col_idx], operator, value):
+                rows.append(tuple(row))
+    return scanned, rows
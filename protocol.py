@@ -0,0 +1,152 @@
+"""
+Length-prefixed binary wire protocol shared by the server and the client.
+
+Every frame is a 5-byte header (payload length as uint32, message type as one
+byte) followed by the payload. Every payload starts with the uint32 request id
+the client assigned to the statement, so replies can be matched to pipelined
+requests. Strings are UTF-8, prefixed with their uint32 byte length.
+"""
+import struct
+
+HEADER = struct.Struct('!IB')
+REQUEST_ID = struct.Struct('!I')
+COUNT = struct.Struct('!I')
+
+MAX_FRAME = 64 * 1024 * 1024
+
+# Client -> server
+QUERY = ord('Q')
+TERMINATE = ord('X')
+
+# Server -> client
+COLUMNS = ord('T')
+ROWS = ord('D')
+COMPLETE = ord('C')
+ERROR = ord('E')
+
+
+def _pack_strings(values):
+    """Pack a list of strings as a count followed by length-prefixed values"""
+    parts = [COUNT.pack(len(values))]
+    for value in values:
+        data = str(value).encode('utf-8')
+        parts.append(COUNT.pack(len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+def _unpack_strings(payload, offset):
+    """Unpack a list written by _pack_strings, returning (values, offset)"""
+    (count,) = COUNT.unpack_from(payload, offset)
+    offset += COUNT.size
+    values = []
+    for _ in range(count):
+        (length,) = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        values.append(payload[offset:offset + length].decode('utf-8'))
+        offset += length
+    return values, offset
+
+
+def encode_frame(kind, request_id, body=b''):
+    """Build a frame for a message type, request id and body"""
+    payload = REQUEST_ID.pack(request_id) + body
+    return HEADER.pack(len(payload), kind) + payload
+
+
+def encode_text(kind, request_id, text):
+    """Build a QUERY, COMPLETE or ERROR frame"""
+    return encode_frame(kind, request_id, text.encode('utf-8'))
+
+
+def encode_columns(request_id, columns):
+    """Build a COLUMNS frame"""
+    return encode_frame(COLUMNS, request_id, _pack_strings(columns))
+
+
+def encode_rows(request_id, rows):
+    """Build a ROWS frame carrying a batch of rows"""
+    parts = [COUNT.pack(len(rows))]
+    for row in rows:
+        parts.append(_pack_strings(row))
+    return encode_frame(ROWS, request_id, b''.join(parts))
+
+
+def request_id_of(payload):
+    """The request id a payload starts with, or 0 if it is too short to have one"""
+    return REQUEST_ID.unpack_from(payload, 0)[0] if len(payload) >= REQUEST_ID.size else 0
+
+
+def decode_payload(kind, payload):
+    """Decode a frame payload into (request_id, value); ValueError if it is malformed"""
+    try:
+        return _decode_payload(kind, payload)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed frame of message type {kind}: {e}") from e
+
+
+def _decode_payload(kind, payload):
+    """decode_payload, letting struct and decoding errors through"""
+    (request_id,) = REQUEST_ID.unpack_from(payload, 0)
+    offset = REQUEST_ID.size
+    
+    if kind == COLUMNS:
+        value, _ = _unpack_strings(payload, offset)
+    elif kind == ROWS:
+        (count,) = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        value = []
+        for _ in range(count):
+            row, offset = _unpack_strings(payload, offset)
+            value.append(row)
+    elif kind in (QUERY, COMPLETE, ERROR):
+        value = payload[offset:].decode('utf-8')
+    elif kind == TERMINATE:
+        value = None
+    else:
+        raise ValueError(f"Unknown message type: {kind}")
+    
+    return request_id, value
+
+
+def _check_length(length):
+    """Reject frames larger than MAX_FRAME"""
+    if length > MAX_FRAME:
+        raise ValueError(f"Frame too large: {length} bytes")
+
+
+async def read_frame(reader):
+    """Read one frame from an asyncio stream, returning (kind, payload).
+    
+    Returns None at the end of the stream, also when it ends partway through
+    a frame.
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except EOFError:
+        return None
+    length, kind = HEADER.unpack(header)
+    _check_length(length)
+    try:
+        return kind, await reader.readexactly(length)
+    except EOFError:
+        # The peer went away mid-frame; the partial frame is dropped
+        return None
+
+
+def _recv_exactly(sock, size):
+    """Read exactly size bytes from a blocking socket"""
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("Connection closed by server")
+        buf += chunk
+    return bytes(buf)
+
+
+def recv_frame(sock):
+    """Read one frame from a blocking socket, returning (kind, payload)"""
+    length, kind = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    _check_length(length)
+    return kind, _recv_exactly(sock, length)
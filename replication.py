@@ -0,0 +1,308 @@
+"""
+Log-shipping read replicas.
+
+A LogShipper runs next to the primary engine. For each table it ships, it
+first sends a snapshot of the rows together with the sequence number of the
+table's change log (see changelog) at that moment, then every transaction
+committed after it, and a heartbeat now and then. A Replica applies those
+messages to tables in a data directory of its own and serves read-only
+statements from it.
+
+Messages are JSON lines carried by a transport:
+
+    {"type": "snapshot", "table": "t", "seq": 40, "columns": [...], "rows": [...], "ts": ...}
+    {"type": "tx", "table": "t", "seq": 43, "ts": ..., "changes": [...]}
+    {"type": "heartbeat", "table": "t", "seq": 43, "ts": ...}
+
+FileTransport appends them to a file both sides can reach; PipeTransport
+writes them to a pipe. A replica is in sync with a table as of the primary
+time of the last transaction or heartbeat it has caught up with; its
+staleness is how long ago that was, by the replica's clock.
+"""
+import json
+import os
+import select
+import threading
+import time
+
+import changelog
+from engine import DatabaseEngine
+
+# Statements a replica serves; everything else changes data
+READ_STATEMENTS = ('SELECT', 'SHOW_TABLES', 'DESCRIBE', 'EXPLAIN', 'SHOW_STATS')
+
+
+def _encode(messages):
+    """Messages as JSON lines"""
+    return ''.join(json.dumps(message) + '\n' for message in messages).encode('utf-8')
+
+
+def _complete_lines(data):
+    """Split off the complete lines of data: (messages, rest)"""
+    end = data.rfind(b'\n') + 1
+    return [json.loads(line) for line in data[:end].splitlines()], data[end:]
+
+
+class FileTransport:
+    """Messages appended to a file; the receiving side follows it from where it left off"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+    
+    def send(self, messages):
+        """Append messages with one write"""
+        with open(self.path, 'ab') as f:
+            f.write(_encode(messages))
+    
+    def receive(self):
+        """Return the messages sent since the last call"""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        messages, rest = _complete_lines(data)
+        self.offset += len(data) - len(rest)
+        return messages
+
+
+class PipeTransport:
+    """Messages written to one end of a pipe and read, without blocking, from the other"""
+    
+    def __init__(self, read_fd=None, write_fd=None):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self._buffer = b''
+    
+    @classmethod
+    def pair(cls):
+        """A new pipe: (sending transport, receiving transport)"""
+        read_fd, write_fd = os.pipe()
+        return cls(write_fd=write_fd), cls(read_fd=read_fd)
+    
+    def send(self, messages):
+        """Write messages; blocks while the pipe is full"""
+        data = _encode(messages)
+        while data:
+            data = data[os.write(self.write_fd, data):]
+    
+    def receive(self):
+        """Return the messages that have arrived since the last call"""
+        while select.select([self.read_fd], [], [], 0)[0]:
+            chunk = os.read(self.read_fd, 65536)
+            if not chunk:
+                break
+            self._buffer += chunk
+        messages, self._buffer = _complete_lines(self._buffer)
+        return messages
+    
+    def close(self):
+        """Close this end of the pipe"""
+        os.close(self.read_fd if self.read_fd is not None else self.write_fd)
+
+
+class LogShipper:
+    """Sends tables and their committed changes from a primary engine to a transport.
+    
+    Every shipped table needs its change log on.
+    """
+    
+    def __init__(self, engine, tables, transport, heartbeat_interval=1.0):
+        self.engine = engine
+        self.tables = list(tables)
+        self.transport = transport
+        self.heartbeat_interval = heartbeat_interval
+        # table -> ChangeLogReader, once its snapshot is sent
+        self._readers = {}
+        # table -> sequence number the replica is complete up to once it has what was sent
+        self._head = {}
+        self._last_heartbeat = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+    
+    def ship(self):
+        """Send what is new: snapshots of tables not yet shipped, then committed transactions.
+        
+        Returns the number of messages sent.
+        """
+        messages = []
+        for table in self.tables:
+            if table not in self._readers:
+                messages.append(self._snapshot(table))
+            for commit, changes in self._readers[table].poll_transactions():
+                messages.append({'type': 'tx', 'table': table, 'seq': commit['seq'], 'ts': commit['ts'],
+                                 'changes': changes})
+                self._head[table] = commit['seq']
+        
+        now = time.time()
+        if now - self._last_heartbeat >= self.heartbeat_interval:
+            messages.extend({'type': 'heartbeat', 'table': table, 'seq': self._head[table], 'ts': now}
+                            for table in self.tables)
+            self._last_heartbeat = now
+        if messages:
+            self.transport.send(messages)
+        return len(messages)
+    
+    def _snapshot(self, table):
+        """Snapshot message of a table, and start following its log from there"""
+        # A shared lock keeps writers out, so the rows and the log position agree
+        with self.engine.storage.lock_table(table, exclusive=False):
+            columns, rows, _ = self.engine.query(f"SELECT * FROM {table}")
+            rows = [list(row) for row in rows]
+            seq = changelog.last_seq(self.engine.storage, table)
+            self._readers[table] = self.engine.subscribe(table, from_seq=seq + 1)
+        self._head[table] = seq
+        return {'type': 'snapshot', 'table': table, 'seq': seq, 'columns': columns, 'rows': rows,
+                'ts': time.time()}
+    
+    def start(self, poll_interval=0.1):
+        """Ship continuously from a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(poll_interval,), daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop the background thread after its current round"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+    
+    def _run(self, poll_interval):
+        """Background thread: ship every poll_interval seconds until stopped"""
+        while not self._stop.is_set():
+            self.ship()
+            self._stop.wait(poll_interval)
+
+
+class Replica:
+    """Read-only follower that applies shipped changes to its own data directory.
+    
+    How far each table has got is kept in its catalog entry, so a replica
+    restarted on the same directory skips what it already applied.
+    """
+    
+    def __init__(self, data_dir, transport, **engine_options):
+        self.engine = DatabaseEngine(data_dir, **engine_options)
+        self.transport = transport
+        # table -> {'seq': applied, 'head': latest known on the primary, 'synced_at': primary time}
+        self.state = {}
+        for table in self.engine.list_tables():
+            state = self.engine.storage.read_meta(table).get('replica')
+            if state is not None:
+                self.state[table] = state
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+    
+    def catch_up(self):
+        """Apply the messages that have arrived; returns how many there were"""
+        with self._lock:
+            messages = self.transport.receive()
+            self._apply_messages(messages)
+        return len(messages)
+    
+    def _apply_messages(self, messages):
+        """Apply messages in order, writing each changed table once"""
+        pending = {}
+        for message in messages:
+            table = message['table']
+            state = self.state.get(table)
+            if message['type'] == 'snapshot':
+                # A snapshot older than what is applied would roll the table back
+                if state is not None and message['seq'] <= state['seq']:
+                    continue
+                pending[table] = []
+                self.engine.storage.write_table(table, message['columns'],
+                                                [tuple(row) for row in message['rows']])
+                state = self.state[table] = {'seq': message['seq'], 'head': message['seq'],
+                                             'synced_at': message['ts']}
+            elif state is None:
+                continue
+            elif message['type'] == 'tx':
+                state['head'] = max(state['head'], message['seq'])
+                if message['seq'] > state['seq']:
+                    pending.setdefault(table, []).extend(message['changes'])
+                    state['seq'] = message['seq']
+                    state['synced_at'] = message['ts']
+            elif message['type'] == 'heartbeat':
+                state['head'] = max(state['head'], message['seq'])
+                if state['seq'] >= message['seq']:
+                    state['synced_at'] = message['ts']
+        
+        for table, changes in sorted(pending.items()):
+            self._apply(table, changes)
+    
+    def _apply(self, table, changes):
+        """Write a table's new changes and where it has got to"""
+        storage = self.engine.storage
+        with storage.lock_table(table):
+            if changes and all(change['op'] == 'insert' for change in changes):
+                storage.append_rows(table, [change['after'] for change in changes])
+            elif changes:
+                columns, rows = storage.read_table(table)
+                storage.write_table(table, columns, changelog.apply_changes(rows, changes))
+            meta = storage.read_meta(table)
+            meta['replica'] = dict(self.state[table])
+            storage.write_meta(table, meta)
+    
+    def lag(self):
+        """Replication lag per table: {'seq': entries behind, 'seconds': staleness}"""
+        now = time.time()
+        return {table: {'seq': state['head'] - state['seq'], 'seconds': max(0.0, now - state['synced_at'])}
+                for table, state in sorted(self.state.items())}
+    
+    def staleness(self, table=None):
+        """Seconds since the replica was last known to match the primary, for one table or the worst of all"""
+        lag = self.lag()
+        if table is not None:
+            if table not in lag:
+                raise ValueError(f"Table '{table}' is not replicated")
+            return lag[table]['seconds']
+        return max((entry['seconds'] for entry in lag.values()), default=float('inf'))
+    
+    def execute(self, command, max_staleness=None):
+        """Run a read-only statement.
+        
+        With max_staleness (seconds), the replica first catches up if it is
+        further behind than that, and raises ValueError if it still is.
+        """
+        parsed = self.engine.parser.parse(command)
+        if parsed['type'] not in READ_STATEMENTS:
+            raise ValueError("Replicas are read-only; write to the primary")
+        if max_staleness is not None:
+            table = parsed.get('table') or parsed.get('statement', {}).get('table')
+            if table is not None and table not in self.state:
+                raise ValueError(f"Table '{table}' is not replicated")
+            if self.staleness(table) > max_staleness:
+                self.catch_up()
+            staleness = self.staleness(table)
+            if staleness > max_staleness:
+                raise ValueError(f"Replica is {staleness:.1f}s behind the primary (bound {max_staleness}s)")
+        return self.engine.execute(command)
+    
+    def start(self, poll_interval=0.1):
+        """Catch up continuously from a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(poll_interval,), daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop the background thread after its current round"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+    
+    def _run(self, poll_interval):
+        """Background thread: catch up every poll_interval seconds until stopped"""
+        while not self._stop.is_set():
+            self.catch_up()
+            self._stop.wait(poll_interval)
+    
+    def close(self):
+        """Stop catching up and close the engine"""
+        self.stop()
+        self.engine.close()
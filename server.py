@@ -0,0 +1,152 @@
+"""
+Asyncio TCP server hosting one shared DatabaseEngine.
+
+Clients speak the frame protocol in protocol.py. Statements on a connection
+may be pipelined: they are read as soon as they arrive and answered in order.
+Execution and row fetching run on a thread pool so the event loop only moves
+bytes.
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import protocol
+from engine import DatabaseEngine
+
+
+def _next_batch(rows, size):
+    """Pull up to size rows from a result iterator"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+class DatabaseServer:
+    
+    def __init__(self, engine=None, host='127.0.0.1', port=5433, workers=4, batch_size=256):
+        self.engine = engine if engine is not None else DatabaseEngine()
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db-worker')
+        self._server = None
+        self._connections = {}
+    
+    async def start(self):
+        """Start listening; returns once the socket is bound"""
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        # Report the real port when started with port=0
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+    
+    async def serve_forever(self):
+        """Start the server and serve until cancelled"""
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+    
+    async def close(self):
+        """Stop accepting connections and shut down the worker pool"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        # Closing the transport ends each handler's read loop
+        for writer in self._connections.values():
+            writer.close()
+        if self._connections:
+            await asyncio.gather(*self._connections, return_exceptions=True)
+        self.pool.shutdown(wait=True)
+    
+    async def _handle_client(self, reader, writer):
+        """Serve one connection: read pipelined frames, answer in order"""
+        self._connections[asyncio.current_task()] = writer
+        queue = asyncio.Queue()
+        worker = asyncio.ensure_future(self._process_queue(queue, writer))
+        try:
+            while True:
+                frame = await protocol.read_frame(reader)
+                if frame is None or frame[0] == protocol.TERMINATE:
+                    break
+                queue.put_nowait(frame)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            queue.put_nowait(None)
+            try:
+                await worker
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+                del self._connections[asyncio.current_task()]
+    
+    async def _process_queue(self, queue, writer):
+        """Execute queued statements one at a time for a connection.
+        
+        A frame that is not a well-formed query gets an ERROR reply and ends
+        the connection. However this returns, the connection is closed, so
+        the handler's read loop ends too.
+        """
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is None:
+                    return
+                kind, payload = frame
+                try:
+                    if kind != protocol.QUERY:
+                        raise ValueError(f"Expected a query frame, got message type {kind}")
+                    request_id, sql = protocol.decode_payload(kind, payload)
+                except ValueError as e:
+                    writer.write(protocol.encode_text(protocol.ERROR, protocol.request_id_of(payload), str(e)))
+                    await writer.drain()
+                    return
+                await self._run_statement(request_id, sql, writer)
+        finally:
+            writer.close()
+    
+    async def _run_statement(self, request_id, sql, writer):
+        """Execute one statement and stream its result"""
+        loop = asyncio.get_running_loop()
+        try:
+            columns, rows, message = await loop.run_in_executor(self.pool, self.engine.query, sql)
+            if columns is not None:
+                writer.write(protocol.encode_columns(request_id, columns))
+                count = 0
+                while True:
+                    batch = await loop.run_in_executor(self.pool, _next_batch, rows, self.batch_size)
+                    if not batch:
+                        break
+                    count += len(batch)
+                    writer.write(protocol.encode_rows(request_id, batch))
+                    await writer.drain()
+                message = f"{count} row(s) returned."
+            writer.write(protocol.encode_text(protocol.COMPLETE, request_id, message or ''))
+        except Exception as e:
+            writer.write(protocol.encode_text(protocol.ERROR, request_id, str(e)))
+        await writer.drain()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Mini Database Engine server")
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=5433)
+    arg_parser.add_argument('--data-dir', default='data')
+    arg_parser.add_argument('--workers', type=int, default=4)
+    args = arg_parser.parse_args()
+    
+    server = DatabaseServer(DatabaseEngine(args.data_dir), args.host, args.port, args.workers)
+    print(f"Serving {args.data_dir} on {args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("\nGoodbye!")
+
+
+if __name__ == "__main__":
+    main()
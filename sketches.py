@@ -0,0 +1,61 @@
+"""
+HyperLogLog sketches for approximate distinct counts.
+
+A sketch is a bytearray of 2 ** HLL_PRECISION registers. Each value is
+hashed to 64 bits: the top bits pick a register, which keeps the longest run
+of leading zeros seen in the remaining bits. The estimate's standard error is
+1.04 / sqrt(registers), about 1.6% at the default precision, in a fixed
+HLL_SIZE bytes however many values are added. Small counts use linear
+counting and are close to exact. Sketches of the same precision merge by
+taking the larger of each register.
+"""
+import base64
+import hashlib
+import math
+
+HLL_PRECISION = 12
+HLL_SIZE = 1 << HLL_PRECISION
+_REMAINING_BITS = 64 - HLL_PRECISION
+
+
+def new_sketch():
+    """Empty sketch"""
+    return bytearray(HLL_SIZE)
+
+
+def add(sketch, value):
+    """Add one value to a sketch in place"""
+    h = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+    register = h >> _REMAINING_BITS
+    rank = _REMAINING_BITS - (h & ((1 << _REMAINING_BITS) - 1)).bit_length() + 1
+    if rank > sketch[register]:
+        sketch[register] = rank
+
+
+def merge(sketch, other):
+    """Fold another sketch into sketch in place"""
+    for i, rank in enumerate(other):
+        if rank > sketch[i]:
+            sketch[i] = rank
+
+
+def estimate(sketch):
+    """Estimated number of distinct values added"""
+    m = len(sketch)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / sum(2.0 ** -rank for rank in sketch)
+    zeros = sketch.count(0)
+    if raw <= 2.5 * m and zeros:
+        # Linear counting is more accurate while many registers are empty
+        return int(round(m * math.log(m / zeros)))
+    return int(round(raw))
+
+
+def dumps(sketch):
+    """Encode a sketch as text, e.g. for the catalog"""
+    return base64.b64encode(bytes(sketch)).decode('ascii')
+
+
+def loads(data):
+    """Decode a sketch encoded by dumps"""
+    return bytearray(base64.b64decode(data))
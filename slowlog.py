@@ -0,0 +1,68 @@
+"""
+Slow query log.
+
+Statements slower than a threshold are written as one JSON object per line:
+normalized SQL, duration, rows scanned and returned, and the plan. The file
+rotates by size. For high-QPS workloads sample_rate logs only a random
+fraction of qualifying statements; each entry records the rate so counts can
+be scaled back up.
+"""
+import json
+import logging
+import logging.handlers
+import random
+import re
+import time
+
+_STRING = re.compile(r"'[^']*'|\"[^\"]*\"")
+_VALUES = re.compile(r'VALUES\s*\(([^)]*)\)', re.IGNORECASE)
+_COMPARISON = re.compile(r'(=|<>|!=|<=|>=|<|>)\s*(?!\?)[^\s,()]+')
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+def normalize_sql(sql):
+    """Replace literals with ? so equivalent statements group together"""
+    text = ' '.join(sql.strip().rstrip(';').split())
+    text = _STRING.sub('?', text)
+    text = _VALUES.sub(lambda m: 'VALUES (' + ', '.join('?' for _ in m.group(1).split(',')) + ')', text)
+    text = _COMPARISON.sub(r'\1 ?', text)
+    return _NUMBER.sub('?', text)
+
+
+class SlowQueryLog:
+    
+    def __init__(self, path, threshold_ms=100.0, sample_rate=1.0, max_bytes=10 * 1024 * 1024, backup_count=5):
+        if not 0.0 < sample_rate <= 1.0:
+            raise ValueError("sample_rate must be in (0, 1]")
+        self.path = path
+        self.threshold = threshold_ms / 1000.0
+        self.sample_rate = sample_rate
+        self._handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+    
+    def should_log(self, duration):
+        """Decide whether a statement that took duration seconds is logged"""
+        if duration < self.threshold:
+            return False
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+    
+    def record(self, sql, duration, rows_scanned, rows_returned, plan, statement_type, error=None):
+        """Append one entry"""
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'type': statement_type,
+            'query': normalize_sql(sql),
+            'duration_ms': round(duration * 1000, 3),
+            'rows_scanned': rows_scanned,
+            'rows_returned': rows_returned,
+            'plan': plan,
+            'sample_rate': self.sample_rate,
+        }
+        if error is not None:
+            entry['error'] = error
+        self._handler.handle(logging.makeLogRecord({'msg': json.dumps(entry)}))
+    
+    def close(self):
+        """Close the log file"""
+        self._handler.close()
@@ -1,65 +1,1232 @@
+"""
+Table storage backends.
 
+StorageBackend is the interface the engine executes against: locking, table
+lifecycle, the per-table catalog, snapshots and reads and writes of rows.
+Rows are stored the same way by every backend - a header line followed by one
+comma-separated line per row - so byte offsets, signatures and the shared
+read methods mean the same everywhere. FileStorage keeps each table in
+data/<table>.db; MemoryStorage keeps everything in process memory. Columns
+can be dictionary-encoded (see dictionary); the shared methods decode rows
+on read and encode them on write. Rows are read as tuples of str, which are
+smaller than lists and shared rather than copied by code that passes them on.
+"""
+import itertools
+import json
 import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import ExitStack, contextmanager
 
+import dictionary
+import partitions
+from planner import compare_values
 
-class Storage:
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - fcntl is POSIX only
+    fcntl = None
+
+# Bytes per block for TABLESAMPLE SYSTEM
+SAMPLE_BLOCK_SIZE = 8192
+
+# Longest pause between attempts at a lock taken with a timeout
+LOCK_RETRY_DELAY = 0.05
+
+
+def _lock_timed_out(table_name):
+    """The error raised when a lock is not had in time"""
+    return ValueError(f"Timed out waiting for a lock on table '{table_name}'")
+
+
+class StorageBackend(ABC):
+    """Interface shared by every storage backend"""
+
+    # Whether pin_version can hand a table version to other processes
+    supports_pinning = False
     
-    def __init__(self, data_dir='data'):
-        self.data_dir = data_dir
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self._local = threading.local()
+        self._write_listeners = []
     
-    def _get_table_path(self, table_name):
-        """Get file path for a table"""
-        return os.path.join(self.data_dir, f"{table_name}.db")
+    @abstractmethod
+    def lock_table(self, table_name, exclusive=True, timeout=None):
+        """Context manager: hold a shared or exclusive, re-entrant lock on a table.
+        
+        With a timeout, ValueError is raised if the lock is not had within
+        that many seconds.
+        """
     
+    @abstractmethod
     def table_exists(self, table_name):
         """Check if table exists"""
-        return os.path.exists(self._get_table_path(table_name))
+    
+    @abstractmethod
+    def list_tables(self):
+        """Return the names of all tables, sorted"""
+    
+    @abstractmethod
+    def drop_table(self, table_name):
+        """Delete a table and everything stored alongside it"""
+    
+    @abstractmethod
+    def read_aux(self, table_name, suffix, offset=0):
+        """Read data stored alongside a table, from offset on (from the end if negative); None if there is none"""
+    
+    @abstractmethod
+    def write_aux(self, table_name, suffix, data):
+        """Atomically replace data stored alongside a table"""
+    
+    @abstractmethod
+    def append_aux(self, table_name, suffix, data):
+        """Append to data stored alongside a table, creating it if needed"""
+    
+    @abstractmethod
+    def delete_aux(self, table_name, suffix):
+        """Remove data stored alongside a table if present"""
+    
+    @abstractmethod
+    def table_signature(self, table_name):
+        """Identify the current table version; any write changes it"""
+    
+    @abstractmethod
+    def snapshot(self, tables=None):
+        """Context manager: read every table (or the named ones) and its catalog entry as they are now"""
+    
+    @abstractmethod
+    def _open_table(self, table_name):
+        """Context manager yielding (file, size, signature) for the version the thread reads"""
+    
+    @abstractmethod
+    def _replace_file(self, table_name, columns, rows):
+        """Replace a table's contents atomically; the table must be locked"""
+    
+    @abstractmethod
+    def append_rows(self, table_name, rows):
+        """Append several rows with one write"""
+    
+    @abstractmethod
+    def append_row(self, table_name, row):
+        """Append a row to table and return its byte offset"""
+    
+    def pin_version(self, table_name):
+        """Context manager yielding (path, size) of the current version for other processes"""
+        raise ValueError(f"{type(self).__name__} cannot share tables with other processes")
+    
+    def add_write_listener(self, callback):
+        """Call callback(table_name) after every write to a table"""
+        self._write_listeners.append(callback)
+    
+    def _notify_write(self, table_name):
+        """Tell listeners a table changed"""
+        for callback in self._write_listeners:
+            callback(table_name)
+    
+    def io_counters(self):
+        """Return (bytes_read, bytes_written) by the current thread"""
+        return getattr(self._local, 'bytes_read', 0), getattr(self._local, 'bytes_written', 0)
+    
+    def _count_io(self, bytes_read=0, bytes_written=0):
+        """Add to the current thread's I/O counters"""
+        self._local.bytes_read = getattr(self._local, 'bytes_read', 0) + bytes_read
+        self._local.bytes_written = getattr(self._local, 'bytes_written', 0) + bytes_written
+        if self.metrics is not None:
+            if bytes_read:
+                self.metrics.inc('bytes_read', bytes_read)
+            if bytes_written:
+                self.metrics.inc('bytes_written', bytes_written)
     
     def create_table(self, table_name, columns):
         """Create a new table file with column headers"""
-        if self.table_exists(table_name):
-            raise ValueError(f"Table '{table_name}' already exists")
+        with self.lock_table(table_name):
+            if self.table_exists(table_name):
+                raise ValueError(f"Table '{table_name}' already exists")
+            
+            self._replace_file(table_name, columns, [])
+    
+    def in_snapshot(self):
+        """Whether the current thread is reading from a snapshot"""
+        return getattr(self._local, 'snapshot', None) is not None
+    
+    def _capture_snapshot(self, snapshot, tables, capture):
+        """Fill snapshot with capture(name) for each table, under the table's shared lock.
         
-        path = self._get_table_path(table_name)
-        with open(path, 'w') as f:
-            f.write(','.join(columns) + '\n')
+        A partitioned table's partitions are captured under its lock, as its
+        captured catalog entry lists them: writers hold that lock across
+        every partition they change, so a row moving between partitions is
+        seen in exactly one. Locks are taken one table at a time, so a
+        snapshot never waits while holding one.
+        """
+        for table_name in self.list_tables() if tables is None else tables:
+            if partitions.is_partition(table_name):
+                continue
+            with self.lock_table(table_name, exclusive=False):
+                entry = capture(table_name)
+                if entry is None:
+                    continue
+                snapshot[table_name] = entry
+                scheme = json.loads(entry['meta']).get('partitioning') if entry['meta'] else None
+                for partition in scheme['partitions'] if scheme else []:
+                    physical = partitions.physical_name(table_name, partition['name'])
+                    partition_entry = capture(physical)
+                    if partition_entry is not None:
+                        snapshot[physical] = partition_entry
+    
+    def read_meta(self, table_name):
+        """Return the catalog entry for a table (indexes, statistics); inside a snapshot, the snapshot's"""
+        snapshot = getattr(self._local, 'snapshot', None)
+        if snapshot is not None:
+            entry = snapshot.get(table_name)
+            data = entry['meta'] if entry is not None else None
+        else:
+            data = self.read_aux(table_name, 'meta')
+        return json.loads(data) if data else {}
+    
+    def write_meta(self, table_name, meta):
+        """Replace the catalog entry for a table"""
+        self.write_aux(table_name, 'meta', json.dumps(meta, indent=1).encode('utf-8'))
+    
+    def track_rewrites(self, table_name):
+        """Give a table a rewrite_id, which every later rewrite replaces.
+        
+        Materialized views call this for their source: appends keep the id,
+        so a view that tracks a byte position can tell whether rows it already
+        processed may have changed. Tables nobody tracks skip the catalog
+        write on each rewrite.
+        """
+        with self.lock_table(table_name):
+            if not self.table_exists(table_name):
+                raise ValueError(f"Table '{table_name}' does not exist")
+            meta = self.read_meta(table_name)
+            if 'rewrite_id' not in meta:
+                meta['rewrite_id'] = uuid.uuid4().hex
+                self.write_meta(table_name, meta)
+    
+    def untrack_rewrites(self, table_name):
+        """Stop giving a table a new rewrite_id on each rewrite"""
+        with self.lock_table(table_name):
+            meta = self.read_meta(table_name)
+            if meta.pop('rewrite_id', None) is not None:
+                self.write_meta(table_name, meta)
+    
+    def _new_rewrite_id(self, table_name):
+        """Replace a tracked table's rewrite_id before it is rewritten; the table must be locked"""
+        meta = self.read_meta(table_name)
+        if 'rewrite_id' in meta:
+            meta['rewrite_id'] = uuid.uuid4().hex
+            self.write_meta(table_name, meta)
     
     def read_table(self, table_name):
-        """Read table data and return columns and rows"""
-        if not self.table_exists(table_name):
-            raise ValueError(f"Table '{table_name}' does not exist")
+        """Read table data and return columns and rows.
         
-        path = self._get_table_path(table_name)
-        with open(path, 'r') as f:
-            lines = f.readlines()
+        Reads take no lock: writers replace the file atomically, so an open
+        file is always a complete snapshot. A trailing line without a newline
+        is an append still in progress and is skipped.
+        """
+        with self._open_table(table_name) as (f, size, _):
+            data = f.read(size)
+        self._count_io(bytes_read=len(data))
         
-        if not lines:
+        lines = data.decode('utf-8').split('\n')
+        if len(lines) < 2:
             raise ValueError(f"Table '{table_name}' is corrupted")
         
-        columns = lines[0].strip().split(',')
+        columns, encoded = dictionary.parse_header(lines[0])
+        codec = self._codec(table_name, columns, encoded)
         rows = []
         
-        for line in lines[1:]:
+        # The last piece is empty, or an incomplete append
+        for line in lines[1:-1]:
             if line.strip():
-                rows.append(line.strip().split(','))
+                row = line.strip().split(',')
+                rows.append(tuple(row) if codec is None else codec.decode(row))
         
         return columns, rows
     
+    def iter_rows(self, table_name, chunk_size=1024 * 1024, where=None):
+        """Yield a table's column names, then its rows, reading chunk_size bytes at a time.
+        
+        The table version is opened when the first item is taken, so callers
+        that need a consistent read should take the column names right away.
+        With a WHERE clause only matching rows are yielded; on an encoded
+        column the rows are matched on their codes, before decoding.
+        """
+        with self._open_table(table_name) as (f, size, _):
+            columns, codec, header_size = self._read_header(table_name, f, size)
+            self._count_io(bytes_read=header_size)
+            yield columns
+            row_filter = self._row_filter(columns, codec, where)
+            
+            remaining = size - header_size
+            tail = b''
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                self._count_io(bytes_read=len(data))
+                lines = (tail + data).split(b'\n')
+                # The last piece is the start of the next chunk's first line
+                tail = lines.pop()
+                yield from self._parse_lines(lines, codec, row_filter)
+    
+    def iter_sample(self, table_name, percent, seed=None, block_size=SAMPLE_BLOCK_SIZE, where=None):
+        """Yield a table's column names, then the rows of a random sample of its blocks.
+        
+        TABLESAMPLE SYSTEM: the rows are divided into blocks of block_size
+        bytes and each block is kept with probability percent / 100. A kept
+        block yields the rows whose lines start in it; the others are never
+        read. The same seed keeps the same blocks of an unchanged table.
+        where filters as for iter_rows.
+        """
+        rng = random.Random(seed)
+        fraction = percent / 100
+        with self._open_table(table_name) as (f, size, _):
+            columns, codec, header_size = self._read_header(table_name, f, size)
+            self._count_io(bytes_read=header_size)
+            yield columns
+            row_filter = self._row_filter(columns, codec, where)
+            
+            for start in range(header_size, size, block_size):
+                if rng.random() >= fraction:
+                    continue
+                end = min(start + block_size, size)
+                # From the byte before the block: a row starts after a newline
+                f.seek(start - 1)
+                data = f.read(end - start + 1)
+                first = data.find(b'\n') + 1
+                if first and not data.endswith(b'\n') and end < size:
+                    # Finish the last row, which runs into the next block
+                    data += f.readline(size - end)
+                self._count_io(bytes_read=len(data))
+                if not first:
+                    continue
+                # The last piece is empty, or an incomplete append
+                yield from self._parse_lines(data[first:].split(b'\n')[:-1], codec, row_filter)
+    
+    def _read_header(self, table_name, f, size):
+        """Read the header of an open table version: (columns, codec or None, header size)"""
+        header = f.readline(size)
+        if not header.endswith(b'\n'):
+            raise ValueError(f"Table '{table_name}' is corrupted")
+        columns, encoded = dictionary.parse_header(header.decode('utf-8'))
+        return columns, self._codec(table_name, columns, encoded), len(header)
+    
+    def _codec(self, table_name, columns, encoded):
+        """Decoder for a table version with encoded columns; None if it has none.
+        
+        Must be called after the version is opened: dictionaries only grow,
+        so the catalog then covers every code in it.
+        """
+        if not encoded:
+            return None
+        return dictionary.RowCodec(columns, encoded, self.read_meta(table_name).get('dictionary', {}))
+    
+    def _row_filter(self, columns, codec, where):
+        """Split a WHERE clause into (test on raw codes, test on decoded rows); either may be None"""
+        if where is None:
+            return None, None
+        if where['column'] not in columns:
+            raise ValueError(f"Column '{where['column']}' does not exist")
+        col_idx = columns.index(where['column'])
+        
+        def predicate(value):
+            return compare_values(value, where['operator'], where['value'])
+        
+        matches_code = codec.matcher(col_idx, predicate) if codec is not None else None
+        if matches_code is not None:
+            return matches_code, None
+        return None, lambda row: predicate(row[col_idx])
+    
+    def _parse_lines(self, lines, codec=None, row_filter=(None, None)):
+        """Yield the rows of complete raw lines, decoded and filtered"""
+        matches_code, matches = row_filter
+        for line in lines:
+            line = line.decode('utf-8').strip()
+            if not line:
+                continue
+            row = line.split(',')
+            if matches_code is not None and not matches_code(row):
+                continue
+            if codec is not None:
+                row = codec.decode(row)
+            if matches is not None and not matches(row):
+                continue
+            yield tuple(row)
+    
+    def _encode_appended(self, table_name, rows):
+        """Encode rows to append as the current table version expects; the table must be locked"""
+        with self._open_table(table_name) as (f, size, _):
+            header = f.readline(size)
+        columns, encoded = dictionary.parse_header(header.decode('utf-8'))
+        if not encoded:
+            return rows
+        meta = self.read_meta(table_name)
+        rows, changed = dictionary.encode_rows(columns, rows, [columns[i] for i in encoded],
+                                               meta.setdefault('dictionary', {}))
+        if changed:
+            # Saved before the rows are written, so readers can always decode them
+            self.write_meta(table_name, meta)
+        return rows
+    
+    def read_columns(self, table_name):
+        """Read only the column names of a table"""
+        with self._open_table(table_name) as (f, size, _):
+            header = f.readline(size)
+        self._count_io(bytes_read=len(header))
+        
+        if not header.endswith(b'\n'):
+            raise ValueError(f"Table '{table_name}' is corrupted")
+        return dictionary.parse_header(header.decode('utf-8'))[0]
+    
+    def estimate_row_count(self, table_name, sample_size=64):
+        """Estimate the row count from the file size and the first rows"""
+        with self._open_table(table_name) as (f, size, _):
+            header = f.readline(size)
+            sample = []
+            while len(sample) < sample_size and f.tell() < size:
+                line = f.readline(size - f.tell())
+                if not line:
+                    break
+                sample.append(len(line))
+            self._count_io(bytes_read=f.tell())
+        
+        if len(sample) < sample_size:
+            return len(sample)
+        return int((size - len(header)) / (sum(sample) / len(sample)))
+    
+    def read_table_with_locators(self, table_name):
+        """Read a table as (columns, signature, [(offset, row), ...]).
+        
+        Offsets are byte positions of each row in the file version named by
+        the signature; fetch_rows reads rows back by offset.
+        """
+        with self._open_table(table_name) as (f, size, signature):
+            data = f.read(size)
+        self._count_io(bytes_read=len(data))
+        
+        header_end = data.find(b'\n')
+        if header_end < 0:
+            raise ValueError(f"Table '{table_name}' is corrupted")
+        columns, encoded = dictionary.parse_header(data[:header_end].decode('utf-8'))
+        codec = self._codec(table_name, columns, encoded)
+        
+        entries = []
+        offset = header_end + 1
+        while offset < len(data):
+            end = data.find(b'\n', offset)
+            if end < 0:
+                break
+            line = data[offset:end].decode('utf-8').strip()
+            if line:
+                row = line.split(',')
+                entries.append((offset, tuple(row) if codec is None else codec.decode(row)))
+            offset = end + 1
+        return columns, signature, entries
+    
+    def fetch_rows(self, table_name, offsets, signature):
+        """Read rows at byte offsets; None if the file no longer matches signature"""
+        try:
+            with self._open_table(table_name) as (f, size, current):
+                if current != list(signature):
+                    return None
+                _, codec, total = self._read_header(table_name, f, size)
+                rows = []
+                for offset in offsets:
+                    f.seek(offset)
+                    line = f.readline()
+                    total += len(line)
+                    row = line.decode('utf-8').strip().split(',')
+                    rows.append(tuple(row) if codec is None else codec.decode(row))
+        except ValueError:
+            return None
+        self._count_io(bytes_read=total)
+        return rows
+    
+    def fetch_ranges(self, table_name, ranges, signature):
+        """Read the rows in byte ranges [start, end), end None meaning end of file.
+        
+        Returns None if the file no longer matches signature.
+        """
+        try:
+            with self._open_table(table_name) as (f, size, current):
+                if current != list(signature):
+                    return None
+                _, codec, total = self._read_header(table_name, f, size)
+                rows = []
+                for start, end in ranges:
+                    f.seek(start)
+                    data = f.read((size if end is None else end) - start)
+                    total += len(data)
+                    # The last piece is empty unless the range ends mid-line
+                    rows.extend(self._parse_lines(data.split(b'\n')[:-1], codec))
+        except ValueError:
+            return None
+        self._count_io(bytes_read=total)
+        return rows
+    
+    def read_rows_from(self, table_name, offset=None):
+        """Read the complete rows stored at or after a byte offset.
+        
+        Returns (columns, signature, rows, end) where end is the offset just
+        past the last complete row: where the next read should start. offset
+        None starts at the first row. Returns None if the file is shorter
+        than offset.
+        """
+        with self._open_table(table_name) as (f, size, signature):
+            columns, codec, header_size = self._read_header(table_name, f, size)
+            if offset is None:
+                offset = header_size
+            if offset > size:
+                return None
+            f.seek(offset)
+            data = f.read(size - offset)
+        self._count_io(bytes_read=header_size + len(data))
+        
+        complete = data.rfind(b'\n') + 1
+        rows = list(self._parse_lines(data[:complete].split(b'\n')[:-1], codec))
+        return columns, signature, rows, offset + complete
+    
     def write_table(self, table_name, columns, rows):
-        """Write table data to file"""
+        """Write table data to file, encoding the columns the catalog marks for it"""
+        with self.lock_table(table_name):
+            meta = self.read_meta(table_name)
+            encoded_columns = [column for column in columns if column in meta.get('encoding', {})]
+            if encoded_columns:
+                rows, changed = dictionary.encode_rows(columns, rows, encoded_columns,
+                                                       meta.setdefault('dictionary', {}))
+                if changed:
+                    self.write_meta(table_name, meta)
+                columns = dictionary.format_header(columns, encoded_columns)
+            self._replace_file(table_name, columns, rows)
+    
+
+class FileStorage(StorageBackend):
+    """Tables as files in a data directory, shared safely between processes"""
+    
+    supports_pinning = True
+    
+    def __init__(self, data_dir='data', metrics=None):
+        super().__init__(metrics)
+        self.data_dir = data_dir
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+        self._remove_stale_pins()
+    
+    def _get_table_path(self, table_name):
+        """Get file path for a table"""
+        return os.path.join(self.data_dir, f"{table_name}.db")
+    
+    def _get_aux_path(self, table_name, suffix):
+        """Get path of a file stored alongside a table, e.g. its metadata"""
+        return os.path.join(self.data_dir, f"{table_name}.{suffix}")
+    
+    def _get_lock_path(self, table_name):
+        """Get lock file path for a table"""
+        return os.path.join(self.data_dir, f"{table_name}.lock")
+    
+    def _held_locks(self):
+        """Return the locks held by the current thread"""
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = {}
+        return held
+    
+    @contextmanager
+    def lock_table(self, table_name, exclusive=True, timeout=None):
+        """Hold a shared or exclusive lock on a table across processes.
+        
+        Locks are taken on a separate .lock file because writes replace the
+        .db file, and are re-entrant within a thread. Without fcntl (Windows)
+        this is a no-op.
+        """
+        if exclusive and getattr(self._local, 'snapshot', None) is not None:
+            raise ValueError("Cannot write inside a snapshot")
+        if fcntl is None:
+            yield
+            return
+        
+        held = self._held_locks()
+        entry = held.get(table_name)
+        if entry is not None:
+            # Re-entrant: upgrade a shared lock if needed, restore on exit
+            was_exclusive = entry['exclusive']
+            if exclusive and not was_exclusive:
+                self._flock(entry['fd'], fcntl.LOCK_EX, table_name, timeout)
+                entry['exclusive'] = True
+            entry['depth'] += 1
+            try:
+                yield
+            finally:
+                entry['depth'] -= 1
+                if entry['exclusive'] != was_exclusive:
+                    fcntl.flock(entry['fd'], fcntl.LOCK_SH)
+                    entry['exclusive'] = was_exclusive
+            return
+        
+        fd = os.open(self._get_lock_path(table_name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self._flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, table_name, timeout)
+            held[table_name] = {'fd': fd, 'depth': 1, 'exclusive': exclusive}
+            try:
+                yield
+            finally:
+                del held[table_name]
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+    
+    @staticmethod
+    def _flock(fd, operation, table_name, timeout):
+        """flock a lock file, retrying without blocking until timeout if one is given"""
+        if timeout is None:
+            fcntl.flock(fd, operation)
+            return
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(fd, operation | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise _lock_timed_out(table_name) from None
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, LOCK_RETRY_DELAY)
+    
+    def table_exists(self, table_name):
+        """Check if table exists"""
+        snapshot = getattr(self._local, 'snapshot', None)
+        if snapshot is not None:
+            return table_name in snapshot
+        return os.path.exists(self._get_table_path(table_name))
+    
+    def list_tables(self):
+        """Return the names of all tables, sorted"""
+        return sorted(file[:-3] for file in os.listdir(self.data_dir)
+                      if file.endswith('.db') and not file.startswith('.'))
+    
+    def drop_table(self, table_name):
+        """Delete a table and every file stored alongside it"""
+        with self.lock_table(table_name):
+            if not self.table_exists(table_name):
+                raise ValueError(f"Table '{table_name}' does not exist")
+            
+            os.remove(self._get_table_path(table_name))
+            prefix = f"{table_name}."
+            for file in os.listdir(self.data_dir):
+                # The lock file stays: other processes may be waiting on it
+                if file.startswith(prefix) and not file.endswith(('.db', '.lock')):
+                    os.remove(os.path.join(self.data_dir, file))
+        self._notify_write(table_name)
+    
+    def read_aux(self, table_name, suffix, offset=0):
+        """Read a file stored alongside a table, from offset on (from the end if negative); None if it does not exist"""
+        try:
+            with open(self._get_aux_path(table_name, suffix), 'rb') as f:
+                if offset < 0:
+                    offset = max(0, os.fstat(f.fileno()).st_size + offset)
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._count_io(bytes_read=len(data))
+        return data
+    
+    def write_aux(self, table_name, suffix, data):
+        """Atomically and durably write a file stored alongside a table"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, prefix=f".{table_name}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                self._fsync(f)
+            os.replace(tmp_path, self._get_aux_path(table_name, suffix))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._sync_dir()
+        self._count_io(bytes_written=len(data))
+    
+    def append_aux(self, table_name, suffix, data):
+        """Append to a file stored alongside a table with one write, on disk when this returns"""
+        path = self._get_aux_path(table_name, suffix)
+        created = not os.path.exists(path)
+        with open(path, 'ab') as f:
+            f.write(data)
+            self._fsync(f)
+        if created:
+            self._sync_dir()
+        self._count_io(bytes_written=len(data))
+    
+    def _fsync(self, f):
+        """Flush a file written through f to disk"""
+        f.flush()
+        os.fsync(f.fileno())
+        if self.metrics is not None:
+            self.metrics.inc('fsyncs')
+    
+    def _sync_dir(self):
+        """fsync the data directory, so files renamed or created in it survive a power loss"""
+        if not hasattr(os, 'O_DIRECTORY'):
+            # Windows cannot open a directory; its renames are journaled
+            return
+        fd = os.open(self.data_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
+    def delete_aux(self, table_name, suffix):
+        """Remove a file stored alongside a table if present"""
+        try:
+            os.remove(self._get_aux_path(table_name, suffix))
+        except FileNotFoundError:
+            pass
+    
+    def table_signature(self, table_name):
+        """Identify the current table file version.
+        
+        Rewrites create a new inode and appends change the size, so any write
+        changes the signature. Inside a snapshot this is the snapshot's version.
+        """
+        snapshot = getattr(self._local, 'snapshot', None)
+        if snapshot is not None:
+            if table_name not in snapshot:
+                raise ValueError(f"Table '{table_name}' does not exist")
+            return list(snapshot[table_name]['signature'])
+        try:
+            st = os.stat(self._get_table_path(table_name))
+        except FileNotFoundError:
+            raise ValueError(f"Table '{table_name}' does not exist")
+        return [st.st_ino, st.st_size, st.st_mtime_ns]
+    
+    @contextmanager
+    def snapshot(self, tables=None):
+        """Read every table, or those named in tables, as it is now until the block ends.
+        
+        Each table's current file is held open together with its size: later
+        rewrites replace the file but this version stays readable through the
+        open descriptor, and appends land past the recorded size. The OS frees
+        a replaced version once the last snapshot holding it closes. The
+        table's catalog entry is read with it, under a shared lock, so a
+        statement writing the table is seen whole or not at all - the
+        snapshot waits for one in progress - and statistics, dictionaries,
+        partitions and view definitions match the rows. Writes are refused
+        inside a snapshot. Snapshots are per thread; nesting reuses the outer
+        one.
+        """
+        if getattr(self._local, 'snapshot', None) is not None:
+            yield
+            return
+        
+        snapshot = {}
+        try:
+            self._capture_snapshot(snapshot, tables, self._snapshot_entry)
+            self._local.snapshot = snapshot
+            yield
+        finally:
+            self._local.snapshot = None
+            for entry in snapshot.values():
+                os.close(entry['fd'])
+    
+    def _snapshot_entry(self, table_name):
+        """Open a table's current version and read its catalog entry; None if it is gone"""
+        try:
+            fd = os.open(self._get_table_path(table_name), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        st = os.fstat(fd)
+        # Only complete rows are visible
+        size = st.st_size
+        if size:
+            tail = os.pread(fd, min(size, 4096), max(0, size - 4096))
+            size -= len(tail) - (tail.rfind(b'\n') + 1)
+        return {'fd': fd, 'size': size, 'signature': [st.st_ino, size, st.st_mtime_ns],
+                'meta': self.read_aux(table_name, 'meta')}
+    
+    @contextmanager
+    def _open_table(self, table_name):
+        """Open the table version the current thread reads.
+        
+        Yields (file, size, signature); callers must not read past size.
+        """
+        snapshot = getattr(self._local, 'snapshot', None)
+        if snapshot is not None:
+            entry = snapshot.get(table_name)
+            if entry is None:
+                raise ValueError(f"Table '{table_name}' does not exist")
+            f = os.fdopen(os.dup(entry['fd']), 'rb')
+            f.seek(0)
+            size, signature = entry['size'], list(entry['signature'])
+        else:
+            try:
+                f = open(self._get_table_path(table_name), 'rb')
+            except FileNotFoundError:
+                raise ValueError(f"Table '{table_name}' does not exist")
+            st = os.fstat(f.fileno())
+            size, signature = st.st_size, [st.st_ino, st.st_size, st.st_mtime_ns]
+        with f:
+            yield f, size, signature
+    
+    @contextmanager
+    def pin_version(self, table_name):
+        """Give the current table version a path of its own.
+        
+        Yields (path, size) for readers in other processes: the path is a
+        hard link to the current file, so it stays readable however the
+        table is rewritten meanwhile, and rows appended later lie past size.
+        The link is removed when the block ends.
+        """
+        pin_path = os.path.join(self.data_dir, f".{table_name}.{os.getpid()}.{uuid.uuid4().hex}.pin")
+        try:
+            os.link(self._get_table_path(table_name), pin_path)
+        except FileNotFoundError:
+            raise ValueError(f"Table '{table_name}' does not exist")
+        try:
+            yield pin_path, os.stat(pin_path).st_size
+        finally:
+            os.remove(pin_path)
+    
+    def _remove_stale_pins(self):
+        """Delete pins left behind by processes that no longer exist"""
+        for file in os.listdir(self.data_dir):
+            if not file.endswith('.pin'):
+                continue
+            try:
+                pid = int(file.split('.')[-3])
+                os.kill(pid, 0)
+            except (ValueError, IndexError):
+                continue
+            except ProcessLookupError:
+                os.remove(os.path.join(self.data_dir, file))
+            except PermissionError:
+                # Process exists but belongs to someone else
+                continue
+    
+    def _replace_file(self, table_name, columns, rows):
+        """Write a new table file and atomically rename it into place.
+        
+        A table with a rewrite_id (track_rewrites) gets a new one first, so
+        a crash can only make a rewrite look like it happened.
+        """
+        self._new_rewrite_id(table_name)
+        
         path = self._get_table_path(table_name)
-        with open(path, 'w') as f:
-            f.write(','.join(columns) + '\n')
-            for row in rows:
-                f.write(','.join(row) + '\n')
+        fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, prefix=f".{table_name}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(','.join(columns) + '\n')
+                for row in rows:
+                    f.write(','.join(row) + '\n')
+                self._fsync(f)
+                self._count_io(bytes_written=f.tell())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._sync_dir()
+        self._notify_write(table_name)
+    
+    def append_rows(self, table_name, rows):
+        """Append several rows with one write"""
+        with self.lock_table(table_name):
+            if not self.table_exists(table_name):
+                raise ValueError(f"Table '{table_name}' does not exist")
+            
+            rows = self._encode_appended(table_name, rows)
+            data = ''.join(','.join(row) + '\n' for row in rows).encode('utf-8')
+            with open(self._get_table_path(table_name), 'ab') as f:
+                f.write(data)
+            self._count_io(bytes_written=len(data))
+        self._notify_write(table_name)
     
     def append_row(self, table_name, row):
-        """Append a row to table"""
-        if not self.table_exists(table_name):
+        """Append a row to table and return its byte offset"""
+        with self.lock_table(table_name):
+            if not self.table_exists(table_name):
+                raise ValueError(f"Table '{table_name}' does not exist")
+            
+            path = self._get_table_path(table_name)
+            row, = self._encode_appended(table_name, [row])
+            line = (','.join(row) + '\n').encode('utf-8')
+            with open(path, 'ab') as f:
+                offset = f.tell()
+                f.write(line)
+            self._count_io(bytes_written=len(line))
+        self._notify_write(table_name)
+        return offset
+
+
+# The file backend is the default
+Storage = FileStorage
+
+
+class _BufferReader:
+    """Read-only file-like view of the first size bytes of a buffer"""
+    
+    def __init__(self, buffer, size):
+        self._buffer = buffer
+        self._size = size
+        self._pos = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+    
+    def seek(self, offset):
+        self._pos = offset
+    
+    def tell(self):
+        return self._pos
+    
+    def read(self, n=-1):
+        end = self._size if n < 0 else min(self._size, self._pos + n)
+        data = bytes(self._buffer[self._pos:end])
+        self._pos = max(self._pos, end)
+        return data
+    
+    def readline(self, limit=-1):
+        end = self._size if limit < 0 else min(self._size, self._pos + limit)
+        newline = self._buffer.find(b'\n', self._pos, end)
+        if newline >= 0:
+            end = newline + 1
+        return self.read(end - self._pos) if end > self._pos else b''
+
+
+class MemoryStorage(StorageBackend):
+    """Tables held in process memory; nothing touches the disk.
+    
+    Each table is a bytearray in the table file format. Appends extend it in
+    place and rewrites replace it with a new buffer, so readers and snapshots
+    holding the old buffer keep their version, as with files. Locks only
+    exclude other threads of this process, and everything is lost when the
+    process exits.
+    """
+    
+    def __init__(self, metrics=None):
+        super().__init__(metrics)
+        # name -> {'buffer': bytearray, 'version': int}; replaced whole on rewrite
+        self._tables = {}
+        self._aux = {}
+        self._versions = itertools.count(1)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+    
+    @contextmanager
+    def lock_table(self, table_name, exclusive=True, timeout=None):
+        """Hold a re-entrant lock on a table; shared locks are taken exclusively"""
+        if exclusive and self.in_snapshot():
+            raise ValueError("Cannot write inside a snapshot")
+        with self._locks_guard:
+            lock = self._locks.setdefault(table_name, threading.RLock())
+        if not lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise _lock_timed_out(table_name)
+        try:
+            yield
+        finally:
+            lock.release()
+    
+    def table_exists(self, table_name):
+        """Check if table exists"""
+        snapshot = getattr(self._local, 'snapshot', None)
+        if snapshot is not None:
+            return table_name in snapshot
+        return table_name in self._tables
+    
+    def list_tables(self):
+        """Return the names of all tables, sorted"""
+        return sorted(self._tables)
+    
+    def drop_table(self, table_name):
+        """Delete a table and everything stored alongside it"""
+        with self.lock_table(table_name):
+            if not self.table_exists(table_name):
+                raise ValueError(f"Table '{table_name}' does not exist")
+            
+            del self._tables[table_name]
+            for key in [key for key in self._aux if key[0] == table_name]:
+                del self._aux[key]
+        self._notify_write(table_name)
+    
+    def read_aux(self, table_name, suffix, offset=0):
+        """Read data stored alongside a table, from offset on (from the end if negative); None if there is none"""
+        data = self._aux.get((table_name, suffix))
+        if data is not None:
+            data = bytes(data[offset:])
+            self._count_io(bytes_read=len(data))
+        return data
+    
+    def write_aux(self, table_name, suffix, data):
+        """Atomically replace data stored alongside a table"""
+        self._aux[(table_name, suffix)] = bytes(data)
+        self._count_io(bytes_written=len(data))
+    
+    def append_aux(self, table_name, suffix, data):
+        """Append to data stored alongside a table"""
+        key = (table_name, suffix)
+        if not isinstance(self._aux.get(key), bytearray):
+            # Appended-to data is kept in a buffer that grows in place
+            self._aux[key] = bytearray(self._aux.get(key) or b'')
+        self._aux[key].extend(data)
+        self._count_io(bytes_written=len(data))
+    
+    def delete_aux(self, table_name, suffix):
+        """Remove data stored alongside a table if present"""
+        self._aux.pop((table_name, suffix), None)
+    
+    def table_signature(self, table_name):
+        """Identify the current table version: (buffer version, size)"""
+        with self._open_table(table_name) as (_, _, signature):
+            return signature
+    
+    @contextmanager
+    def snapshot(self, tables=None):
+        """Read every table, or those named in tables, and its catalog entry as they are now"""
+        if self.in_snapshot():
+            yield
+            return
+        
+        snapshot = {}
+        self._capture_snapshot(snapshot, tables, self._snapshot_entry)
+        self._local.snapshot = snapshot
+        try:
+            yield
+        finally:
+            self._local.snapshot = None
+    
+    def _snapshot_entry(self, table_name):
+        """A table's current buffer, size and catalog entry; None if it is gone"""
+        entry = self._tables.get(table_name)
+        if entry is None:
+            return None
+        size = len(entry['buffer'])
+        return {'buffer': entry['buffer'], 'size': size, 'signature': [entry['version'], size],
+                'meta': self._aux.get((table_name, 'meta'))}
+    
+    @contextmanager
+    def _open_table(self, table_name):
+        """Open the table version the current thread reads"""
+        snapshot = getattr(self._local, 'snapshot', None)
+        entry = (snapshot if snapshot is not None else self._tables).get(table_name)
+        if entry is None:
             raise ValueError(f"Table '{table_name}' does not exist")
+        buffer = entry['buffer']
+        if snapshot is not None:
+            size, signature = entry['size'], list(entry['signature'])
+        else:
+            size = len(buffer)
+            signature = [entry['version'], size]
+        yield _BufferReader(buffer, size), size, signature
+    
+    def _replace_file(self, table_name, columns, rows):
+        """Swap in a new buffer for the table, with a new rewrite_id as for files"""
+        self._new_rewrite_id(table_name)
         
-        path = self._get_table_path(table_name)
-        with open(path, 'a') as f:
-            f.write(','.join(row) + '\n')
+        data = ''.join(','.join(row) + '\n' for row in [columns] + list(rows)).encode('utf-8')
+        self._tables[table_name] = {'buffer': bytearray(data), 'version': next(self._versions)}
+        self._count_io(bytes_written=len(data))
+        self._notify_write(table_name)
+    
+    def append_rows(self, table_name, rows):
+        """Append several rows with one write"""
+        with self.lock_table(table_name):
+            if not self.table_exists(table_name):
+                raise ValueError(f"Table '{table_name}' does not exist")
+            
+            rows = self._encode_appended(table_name, rows)
+            data = ''.join(','.join(row) + '\n' for row in rows).encode('utf-8')
+            self._tables[table_name]['buffer'].extend(data)
+            self._count_io(bytes_written=len(data))
+        self._notify_write(table_name)
+    
+    def append_row(self, table_name, row):
+        """Append a row to table and return its byte offset"""
+        with self.lock_table(table_name):
+            if not self.table_exists(table_name):
+                raise ValueError(f"Table '{table_name}' does not exist")
+            
+            buffer = self._tables[table_name]['buffer']
+            offset = len(buffer)
+            row, = self._encode_appended(table_name, [row])
+            line = (','.join(row) + '\n').encode('utf-8')
+            buffer.extend(line)
+            self._count_io(bytes_written=len(line))
+        self._notify_write(table_name)
+        return offset
+
+
+class BatchStorage(MemoryStorage):
+    """Write-back overlay that runs a batch of statements in memory.
+    
+    The first time the batch touches a table, the table is locked
+    exclusively in the backing store and copied into memory; its catalog
+    entries are copied as they are read. Statements then work on the copies,
+    so a table is read from the backing store once however many statements
+    use it. flush() writes each changed table back once - as a single append
+    when the batch only appended to it - and releases the locks. Readers in
+    other processes see the tables as they were until then.
+    
+    Tables known in advance are locked by lock_tables() in name order, so
+    batches locking the same tables cannot deadlock. A lock taken while
+    others are held waits at most lock_timeout seconds and then raises
+    ValueError, so a batch that meets another locking in a different order
+    gives up instead of waiting for ever.
+    """
+    
+    def __init__(self, base, lock_timeout=None):
+        super().__init__(base.metrics)
+        self.base = base
+        self.lock_timeout = lock_timeout
+        # table -> size of the copy when loaded (None if created in the batch)
+        self._loaded = {}
+        self._rewritten = set()
+        self._dropped = set()
+        self._dirty_aux = set()
+        # (table, suffix) -> bytes appended to data the batch has not copied in
+        self._aux_appends = {}
+        self._held = ExitStack()
+        # Tables whose rows flush wrote back
+        self.written = []
+    
+    def _load(self, table_name):
+        """Lock a table in the backing store and copy it in, once per batch"""
+        if table_name in self._loaded:
+            return
+        # Holding no lock, waiting cannot deadlock
+        timeout = self.lock_timeout if self._loaded else None
+        self._held.enter_context(self.base.lock_table(table_name, timeout=timeout))
+        self._loaded[table_name] = None
+        if table_name not in self._dropped and self.base.table_exists(table_name):
+            with self.base._open_table(table_name) as (f, size, _):
+                data = f.read(size)
+            self._count_io(bytes_read=len(data))
+            self._tables[table_name] = {'buffer': bytearray(data), 'version': next(self._versions)}
+            self._loaded[table_name] = len(data)
+    
+    def lock_tables(self, tables):
+        """Lock tables in the backing store in name order and copy them in"""
+        for table_name in sorted(set(tables)):
+            self._load(table_name)
+    
+    def lock_table(self, table_name, exclusive=True, timeout=None):
+        """Hold a re-entrant lock on the in-memory copy of a table"""
+        self._load(table_name)
+        return super().lock_table(table_name, exclusive, timeout)
+    
+    def table_exists(self, table_name):
+        """Check if table exists"""
+        self._load(table_name)
+        return super().table_exists(table_name)
+    
+    def list_tables(self):
+        """Return the names of all tables, sorted"""
+        return sorted((set(self.base.list_tables()) - self._dropped) | set(self._tables))
+    
+    def drop_table(self, table_name):
+        """Delete a table and everything stored alongside it"""
+        self._load(table_name)
+        super().drop_table(table_name)
+        self._dropped.add(table_name)
+        self._rewritten.discard(table_name)
+        self._dirty_aux = {key for key in self._dirty_aux if key[0] != table_name}
+        self._aux_appends = {key: data for key, data in self._aux_appends.items() if key[0] != table_name}
+    
+    def read_aux(self, table_name, suffix, offset=0):
+        """Read data stored alongside a table, from offset on (from the end if negative); None if there is none"""
+        self._load(table_name)
+        key = (table_name, suffix)
+        if key in self._aux_appends:
+            appended = self._aux_appends[key]
+            if offset < 0:
+                # The end may lie entirely within the appended bytes; copy only what is asked for
+                if -offset <= len(appended):
+                    return bytes(appended[offset:])
+                return (self.base.read_aux(table_name, suffix, offset + len(appended)) or b'') + bytes(appended)
+            return ((self.base.read_aux(table_name, suffix) or b'') + bytes(appended))[offset:]
+        if key not in self._aux and table_name not in self._dropped:
+            self._aux[key] = self.base.read_aux(table_name, suffix)
+        return super().read_aux(table_name, suffix, offset)
+    
+    def write_aux(self, table_name, suffix, data):
+        """Atomically replace data stored alongside a table"""
+        self._load(table_name)
+        self._aux_appends.pop((table_name, suffix), None)
+        super().write_aux(table_name, suffix, data)
+        self._dirty_aux.add((table_name, suffix))
+    
+    def append_aux(self, table_name, suffix, data):
+        """Append to data stored alongside a table; only the new bytes are kept until the flush"""
+        self._load(table_name)
+        key = (table_name, suffix)
+        if key in self._aux or table_name in self._dropped:
+            # Copied in or replaced by the batch: the copy is written back whole
+            super().append_aux(table_name, suffix, data)
+            self._dirty_aux.add(key)
+        else:
+            self._aux_appends.setdefault(key, bytearray()).extend(data)
+    
+    def delete_aux(self, table_name, suffix):
+        """Remove data stored alongside a table if present"""
+        self._load(table_name)
+        self._aux_appends.pop((table_name, suffix), None)
+        # None hides the backing store's copy until the batch is flushed
+        self._aux[(table_name, suffix)] = None
+        self._dirty_aux.add((table_name, suffix))
+    
+    def snapshot(self, tables=None):
+        """Snapshots would only cover the tables the batch has loaded"""
+        raise ValueError("Snapshots are not available inside a batch")
+    
+    @contextmanager
+    def _open_table(self, table_name):
+        """Open the in-memory copy of a table"""
+        self._load(table_name)
+        with super()._open_table(table_name) as opened:
+            yield opened
+    
+    def _replace_file(self, table_name, columns, rows):
+        """Rewrite the in-memory copy; the table is written back whole"""
+        self._load(table_name)
+        super()._replace_file(table_name, columns, rows)
+        self._rewritten.add(table_name)
+    
+    def flush(self):
+        """Write every changed table back to the backing store and release the locks"""
+        try:
+            for table_name in sorted(self._dropped):
+                if self.base.table_exists(table_name):
+                    self.base.drop_table(table_name)
+            
+            for table_name in sorted(self._tables):
+                # Catalog first, as a rewrite records its rewrite_id there
+                for key in sorted(key for key in self._dirty_aux if key[0] == table_name):
+                    data = self._aux[key]
+                    if data is None:
+                        self.base.delete_aux(*key)
+                    else:
+                        self.base.write_aux(table_name, key[1], data)
+                for key in sorted(key for key in self._aux_appends if key[0] == table_name):
+                    self.base.append_aux(table_name, key[1], bytes(self._aux_appends[key]))
+                
+                loaded = self._loaded[table_name]
+                if loaded is None or table_name in self._rewritten:
+                    columns, rows = self.read_table(table_name)
+                    self.base.write_table(table_name, columns, rows)
+                    self.written.append(table_name)
+                elif len(self._tables[table_name]['buffer']) > loaded:
+                    # Only appended to: keep the file and add the new rows
+                    _, _, rows, _ = self.read_rows_from(table_name, loaded)
+                    self.base.append_rows(table_name, rows)
+                    self.written.append(table_name)
+        finally:
+            self._held.close()
@@ -0,0 +1,100 @@
+"""
+Tests for batches: write-back, and batches in two processes locking the same tables
+"""
+import multiprocessing
+
+import pytest
+
+from engine import DatabaseEngine
+
+pytest.importorskip('fcntl')
+
+ROUNDS = 10
+ROWS = 20000
+
+
+def _script_worker(data_dir, order, barrier, results):
+    """Run scripts writing tables a and b in the given order, ROUNDS times"""
+    engine = DatabaseEngine(data_dir)
+    barrier.wait(10)
+    try:
+        for i in range(ROUNDS):
+            # The scan keeps the first table locked a while before the second is used
+            engine.execute_script(f"SELECT COUNT(*) FROM {order[0]} WHERE v > 5; "
+                                  + ";".join(f"INSERT INTO {table} VALUES ({order}{i})" for table in order))
+        results.put((order, 'ok'))
+    except Exception as e:
+        results.put((order, repr(e)))
+
+
+def _batch_worker(data_dir, order, barrier, results):
+    """Write tables a and b in one batch in the given order, both processes holding their first table"""
+    engine = DatabaseEngine(data_dir, lock_timeout=0.5)
+    try:
+        with engine.batch():
+            engine.execute(f"INSERT INTO {order[0]} VALUES ({order})")
+            barrier.wait(10)
+            engine.execute(f"INSERT INTO {order[1]} VALUES ({order})")
+        results.put((order, 'ok'))
+    except ValueError as e:
+        results.put((order, str(e)))
+
+
+def _run_workers(target, data_dir):
+    """Run target in two processes, writing a then b and b then a; returns what each reported"""
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(2)
+    results = context.Queue()
+    workers = [context.Process(target=target, args=(data_dir, order, barrier, results))
+               for order in ('ab', 'ba')]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+    hung = [worker for worker in workers if worker.is_alive()]
+    for worker in hung:
+        worker.terminate()
+    assert not hung, "batches deadlocked"
+    return dict(results.get(timeout=5) for _ in workers)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """A data directory with tables a and b of ROWS rows"""
+    engine = DatabaseEngine(str(tmp_path / 'data'))
+    for table in ('a', 'b'):
+        engine.execute(f"CREATE TABLE {table} (v)")
+        engine.executemany(f"INSERT INTO {table} VALUES (?)", [(i,) for i in range(ROWS)])
+    engine.close()
+    return str(tmp_path / 'data')
+
+
+def test_batch_writes_back_once_at_the_end(data_dir):
+    engine = DatabaseEngine(data_dir)
+    with engine.batch():
+        engine.execute("INSERT INTO a VALUES (x)")
+        engine.execute("UPDATE a SET v = y WHERE v = x")
+        assert ('y',) not in engine.storage.base.read_table('a')[1]
+    assert engine.storage.read_table('a')[1][-1] == ('y',)
+
+
+def test_batch_locks_named_tables_on_entry(data_dir):
+    engine = DatabaseEngine(data_dir)
+    with engine.batch(['b', 'a']):
+        assert sorted(engine.storage._loaded) == ['a', 'b']
+
+
+def test_scripts_in_opposite_order_do_not_deadlock(data_dir):
+    assert _run_workers(_script_worker, data_dir) == {'ab': 'ok', 'ba': 'ok'}
+    engine = DatabaseEngine(data_dir)
+    assert len(engine.storage.read_table('a')[1]) == ROWS + 2 * ROUNDS
+    assert len(engine.storage.read_table('b')[1]) == ROWS + 2 * ROUNDS
+
+
+def test_batches_in_opposite_order_time_out_instead_of_deadlocking(data_dir):
+    results = _run_workers(_batch_worker, data_dir)
+    assert any('Timed out waiting for a lock' in result for result in results.values())
+    # A batch that timed out still writes back the statements that ran
+    engine = DatabaseEngine(data_dir)
+    written = engine.storage.read_table('a')[1] + engine.storage.read_table('b')[1]
+    assert ('ab',) in written and ('ba',) in written
@@ -0,0 +1,93 @@
+"""
+Tests for change data capture: log order, transactions and subscriber offsets
+"""
+import pytest
+
+import changelog
+from engine import MEMORY, DatabaseEngine
+
+
+@pytest.fixture(params=['file', 'memory'])
+def engine(request, tmp_path):
+    """An engine on each backend with a logged table t"""
+    engine = DatabaseEngine(str(tmp_path / 'data') if request.param == 'file' else MEMORY)
+    engine.execute("CREATE TABLE t (id, name)")
+    engine.execute("ALTER TABLE t SET CHANGE LOG ON")
+    yield engine
+    engine.close()
+
+
+def _ops(changes):
+    return [(change['op'], change.get('before'), change.get('after')) for change in changes]
+
+
+def test_changes_are_logged_in_statement_order(engine):
+    engine.execute("INSERT INTO t VALUES (1, ann)")
+    engine.execute("INSERT INTO t VALUES (2, bob)")
+    engine.execute("UPDATE t SET name = rob WHERE id = 2")
+    engine.execute("DELETE FROM t WHERE id = 1")
+    engine.execute("TRUNCATE TABLE t")
+    changes = engine.subscribe('t').poll()
+    assert _ops(changes) == [('insert', None, ['1', 'ann']), ('insert', None, ['2', 'bob']),
+                             ('update', ['2', 'bob'], ['2', 'rob']), ('delete', ['1', 'ann'], None),
+                             ('truncate', None, None)]
+    seqs = [change['seq'] for change in changes]
+    assert seqs == sorted(seqs) and len(set(seqs)) == len(seqs)
+
+
+def test_a_statement_is_one_transaction_with_its_commit_last(engine):
+    engine.executemany("INSERT INTO t VALUES (?, ?)", [(1, 'ann'), (2, 'bob')])
+    engine.execute("UPDATE t SET name = x")
+    transactions = engine.subscribe('t').poll_transactions()
+    commit, changes = transactions[-1]
+    assert [change['op'] for change in changes] == ['update', 'update']
+    assert {change['tx'] for change in changes} == {changes[0]['seq']}
+    assert commit['op'] == 'commit' and commit['seq'] == changes[-1]['seq'] + 1
+
+
+def test_subscribers_resume_from_the_next_sequence_number(engine):
+    engine.execute("INSERT INTO t VALUES (1, ann)")
+    reader = engine.subscribe('t')
+    first = reader.poll()
+    assert reader.poll() == []
+    engine.execute("INSERT INTO t VALUES (2, bob)")
+    engine.execute("INSERT INTO t VALUES (3, cy)")
+    assert [change['after'][0] for change in reader.poll()] == ['2', '3']
+
+    resumed = engine.subscribe('t', from_seq=first[-1]['seq'] + 1)
+    assert [change['after'][0] for change in resumed.poll()] == ['2', '3']
+
+
+def test_subscribing_past_a_checkpoint_starts_reading_at_its_offset(engine):
+    engine.executemany("INSERT INTO t VALUES (?, ?)", [(i, 'x') for i in range(5)])
+    engine.checkpoint('t')
+    checkpoint = engine.storage.read_meta('t')['change_log']['checkpoint']
+    engine.execute("INSERT INTO t VALUES (5, y)")
+    reader = engine.subscribe('t', from_seq=checkpoint['seq'] + 1)
+    assert reader.offset == checkpoint['offset'] > 0
+    assert _ops(reader.poll()) == [('insert', None, ['5', 'y'])]
+    # From earlier on, the log is read from its start
+    assert len(engine.subscribe('t', from_seq=1).poll()) == 6
+
+
+def test_open_transactions_and_torn_lines_are_not_delivered(engine):
+    reader = engine.subscribe('t')
+    with engine.storage.lock_table('t'):
+        transaction = changelog.begin(engine.storage, 't', [changelog.insert(('1', 'ann'))])
+        assert reader.poll() == []
+        changelog.end(engine.storage, 't', transaction)
+    assert _ops(reader.poll()) == [('insert', None, ['1', 'ann'])]
+
+    engine.storage.append_aux('t', changelog.LOG_SUFFIX, b'{"seq": 99, "tx": 99, "op": "ins')
+    assert reader.poll() == []
+    engine.execute("INSERT INTO t VALUES (2, bob)")
+    assert _ops(reader.poll()) == [('insert', None, ['2', 'bob'])]
+
+
+def test_aborted_transactions_are_skipped(engine):
+    reader = engine.subscribe('t')
+    with engine.storage.lock_table('t'):
+        transaction = changelog.begin(engine.storage, 't', [changelog.insert(('1', 'ann'))])
+        changelog.end(engine.storage, 't', transaction, 'abort')
+    engine.execute("INSERT INTO t VALUES (2, bob)")
+    assert _ops(reader.poll()) == [('insert', None, ['2', 'bob'])]
@@ -0,0 +1,75 @@
+"""
+Tests for dictionary encoding: codes on disk, shared values in memory and predicates on codes
+"""
+import pytest
+
+import dictionary
+from engine import MEMORY, DatabaseEngine
+
+STATUSES = ['active', 'idle', 'gone']
+
+
+@pytest.fixture(params=['file', 'memory'])
+def engine(request, tmp_path):
+    """An engine on each backend with a table t (id, status) whose status is dictionary-encoded"""
+    engine = DatabaseEngine(str(tmp_path / 'data') if request.param == 'file' else MEMORY)
+    engine.execute("CREATE TABLE t (id, status)")
+    engine.executemany("INSERT INTO t VALUES (?, ?)", [(i, STATUSES[i % 3]) for i in range(30)])
+    engine.execute("ALTER TABLE t ALTER COLUMN status SET ENCODING DICTIONARY")
+    yield engine
+    engine.close()
+
+
+def _raw_lines(engine):
+    """The table file's lines as stored"""
+    with engine.storage._open_table('t') as (f, size, _):
+        return f.read(size).decode('utf-8').splitlines()
+
+
+def test_encoded_column_is_stored_as_codes(engine):
+    lines = _raw_lines(engine)
+    assert lines[0] == 'id,status' + dictionary.ENCODED_SUFFIX
+    assert lines[1:4] == ['0,0', '1,1', '2,2']
+    assert engine.storage.read_meta('t')['dictionary']['status'] == STATUSES
+    assert "status (DICTIONARY, 3 value(s))" in engine.execute("DESCRIBE t")
+
+
+def test_rows_decode_to_shared_values(engine):
+    _, rows = engine.storage.read_table('t')
+    assert [row[1] for row in rows[:3]] == STATUSES
+    assert rows[0][1] is rows[3][1]
+
+
+def test_predicates_match_codes(engine):
+    assert "on dictionary codes" in engine.execute("EXPLAIN SELECT * FROM t WHERE status = idle")
+    assert len(list(engine.query("SELECT * FROM t WHERE status = idle")[1])) == 10
+    assert len(list(engine.query("SELECT * FROM t WHERE status > gone")[1])) == 10
+    assert list(engine.query("SELECT * FROM t WHERE status = unknown")[1]) == []
+
+
+def test_writes_grow_the_dictionary(engine):
+    engine.execute("INSERT INTO t VALUES (30, new)")
+    engine.execute("UPDATE t SET status = retired WHERE id = 0")
+    assert engine.storage.read_meta('t')['dictionary']['status'] == STATUSES + ['new', 'retired']
+    assert sorted(engine.query("SELECT * FROM t WHERE id = 0")[1]) == [('0', 'retired')]
+    assert _raw_lines(engine)[-1] == '30,3'
+
+
+def test_plain_encoding_stores_text_again(engine):
+    engine.execute("ALTER TABLE t ALTER COLUMN status SET ENCODING PLAIN")
+    assert _raw_lines(engine)[:2] == ['id,status', '0,active']
+    assert len(list(engine.query("SELECT * FROM t WHERE status = gone")[1])) == 10
+
+
+def test_dictionary_size_is_capped(engine, monkeypatch):
+    monkeypatch.setattr(dictionary, 'MAX_DICTIONARY_SIZE', 4)
+    engine.execute("INSERT INTO t VALUES (30, fourth)")
+    with pytest.raises(ValueError, match="more than 4 distinct values"):
+        engine.execute("INSERT INTO t VALUES (31, fifth)")
+    assert len(engine.storage.read_table('t')[1]) == 31
+
+
+def test_partitioned_tables_cannot_be_encoded(engine):
+    engine.execute("CREATE TABLE h (id, v) PARTITION BY HASH (id) PARTITIONS 2")
+    with pytest.raises(ValueError, match="cannot be dictionary-encoded"):
+        engine.execute("ALTER TABLE h ALTER COLUMN v SET ENCODING DICTIONARY")
@@ -0,0 +1,80 @@
+"""
+Tests for the storage backend interface and the in-memory backend
+"""
+import os
+
+import pytest
+
+from engine import MEMORY, DatabaseEngine
+from storage import FileStorage, MemoryStorage, StorageBackend
+
+
+@pytest.fixture(params=['file', 'memory'])
+def storage(request, tmp_path):
+    """Each backend, empty"""
+    return FileStorage(str(tmp_path / 'data')) if request.param == 'file' else MemoryStorage()
+
+
+def test_backends_store_tables_the_same_way(storage):
+    assert isinstance(storage, StorageBackend)
+    storage.create_table('t', ['id', 'name'])
+    assert storage.append_row('t', ('1', 'ann')) == len(b'id,name\n')
+    storage.append_rows('t', [('2', 'bob'), ('3', 'cy')])
+    assert storage.read_table('t') == (['id', 'name'], [('1', 'ann'), ('2', 'bob'), ('3', 'cy')])
+    assert list(storage.iter_rows('t')) == [['id', 'name'], ('1', 'ann'), ('2', 'bob'), ('3', 'cy')]
+
+    signature = storage.table_signature('t')
+    storage.write_table('t', ['id', 'name'], [('2', 'bob')])
+    assert storage.table_signature('t') != signature
+    assert storage.read_table('t')[1] == [('2', 'bob')]
+    with pytest.raises(ValueError):
+        storage.create_table('t', ['id'])
+
+
+def test_catalog_and_aux_data_go_with_the_table(storage):
+    storage.create_table('t', ['id'])
+    storage.write_meta('t', {'stats': {'rows': 1}})
+    storage.append_aux('t', 'cdc', b'one\n')
+    storage.append_aux('t', 'cdc', b'two\n')
+    assert storage.read_meta('t') == {'stats': {'rows': 1}}
+    assert storage.read_aux('t', 'cdc') == b'one\ntwo\n'
+    assert storage.read_aux('t', 'cdc', 4) == b'two\n'
+    assert storage.read_aux('t', 'cdc', -4) == b'two\n'
+    storage.delete_aux('t', 'cdc')
+    assert storage.read_aux('t', 'cdc') is None
+
+    storage.append_aux('t', 'cdc', b'three\n')
+    storage.drop_table('t')
+    assert storage.list_tables() == [] and not storage.table_exists('t')
+    assert storage.read_meta('t') == {} and storage.read_aux('t', 'cdc') is None
+
+
+def test_memory_engine_touches_no_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    engine = DatabaseEngine(MEMORY)
+    engine.execute("CREATE TABLE t (id, name)")
+    engine.executemany("INSERT INTO t VALUES (?, ?)", [(i, 'x') for i in range(100)])
+    engine.execute("CREATE INDEX t_id ON t (id)")
+    engine.execute("UPDATE t SET name = y WHERE id = 5")
+    engine.execute("ALTER TABLE t SET CHANGE LOG ON")
+    engine.execute("DELETE FROM t WHERE id = 6")
+    assert sorted(engine.query("SELECT * FROM t WHERE id = 5")[1]) == [('5', 'y')]
+    assert list(engine.query("SELECT COUNT(*) FROM t")[1]) == [['99']]
+    engine.execute("DROP TABLE t")
+    engine.close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_memory_engines_are_independent():
+    first, second = DatabaseEngine(MEMORY), DatabaseEngine(MEMORY)
+    first.execute("CREATE TABLE t (id)")
+    assert not second.storage.table_exists('t')
+    assert DatabaseEngine(storage=first.storage).list_tables() == ['t']
+
+
+def test_memory_tables_cannot_be_shared_with_other_processes():
+    storage = MemoryStorage()
+    storage.create_table('t', ['id'])
+    with pytest.raises(ValueError, match="cannot share tables"):
+        with storage.pin_version('t'):
+            pass
@@ -0,0 +1,118 @@
+"""
+Tests for partitioned tables: routing, pruning, moves between partitions and consistent reads
+"""
+import threading
+
+import pytest
+
+import partitions
+from engine import MEMORY, DatabaseEngine
+
+RANGE_TABLE = ("CREATE TABLE p (id, k) PARTITION BY RANGE (k) "
+               "(PARTITION low VALUES LESS THAN (50), PARTITION high VALUES LESS THAN (100))")
+
+
+@pytest.fixture(params=['file', 'memory'])
+def engine(request, tmp_path):
+    """An engine on each backend with a RANGE table p: 300 rows, k cycling 0-99"""
+    engine = DatabaseEngine(str(tmp_path / 'data') if request.param == 'file' else MEMORY)
+    engine.execute(RANGE_TABLE)
+    engine.executemany("INSERT INTO p VALUES (?, ?)", [(str(i), str(i % 100)) for i in range(300)])
+    yield engine
+    engine.close()
+
+
+def _rows(engine, command="SELECT * FROM p"):
+    return sorted(engine.query(command)[1])
+
+
+def _partition_rows(engine, table, partition):
+    return engine.storage.read_table(partitions.physical_name(table, partition))[1]
+
+
+def test_rows_are_routed_and_selects_prune(engine):
+    assert len(_partition_rows(engine, 'p', 'low')) == 150
+    assert len(_partition_rows(engine, 'p', 'high')) == 150
+    assert "partitions: low of 2" in engine.execute("EXPLAIN SELECT * FROM p WHERE k < 10")
+    assert "partitions: high of 2" in engine.execute("EXPLAIN SELECT * FROM p WHERE k = 75")
+    assert len(_rows(engine, "SELECT * FROM p WHERE k < 10")) == 30
+
+
+def test_update_moves_rows_between_partitions(engine):
+    assert engine.execute("UPDATE p SET k = 90 WHERE id = 5") == "1 row(s) updated."
+    assert ('5', '90') in _partition_rows(engine, 'p', 'high')
+    assert ('5', '5') not in _partition_rows(engine, 'p', 'low')
+    assert len(_rows(engine)) == 300
+
+
+def test_update_without_a_partition_fails_before_writing(engine):
+    before = _rows(engine)
+    with pytest.raises(ValueError):
+        engine.execute("UPDATE p SET k = 500 WHERE k < 60")
+    assert _rows(engine) == before
+
+
+def test_drop_and_truncate_partition(engine):
+    engine.execute("ALTER TABLE p TRUNCATE PARTITION high")
+    assert len(_rows(engine)) == 150
+    engine.execute("ALTER TABLE p ADD PARTITION top VALUES LESS THAN (200)")
+    engine.execute("INSERT INTO p VALUES (1000, 150)")
+    engine.execute("ALTER TABLE p DROP PARTITION low")
+    assert _rows(engine) == [('1000', '150')]
+    assert not engine.storage.table_exists(partitions.physical_name('p', 'low'))
+    with pytest.raises(ValueError):
+        engine.execute("ALTER TABLE p DROP PARTITION low")
+
+
+def test_hash_partitions(engine):
+    engine.execute("CREATE TABLE h (id, v) PARTITION BY HASH (id) PARTITIONS 4")
+    engine.executemany("INSERT INTO h VALUES (?, ?)", [(str(i), 'x') for i in range(100)])
+    scheme = engine.storage.read_meta('h')['partitioning']
+    for partition in scheme['partitions']:
+        for row in _partition_rows(engine, 'h', partition['name']):
+            assert partitions.route(scheme, row[0]) == partition['name']
+    assert f"partitions: {partitions.route(scheme, '7')} of 4" in engine.execute("EXPLAIN SELECT * FROM h WHERE id = 7")
+    assert _rows(engine, "SELECT * FROM h WHERE id = 7") == [('7', 'x')]
+
+
+def test_reads_never_see_a_row_mid_move(engine):
+    # An UPDATE moving a row rewrites both partitions; no read may see one without the other
+    stop = threading.Event()
+    moves = []
+
+    def flip():
+        k = 10
+        while not stop.is_set():
+            k = 90 if k == 10 else 10
+            engine.execute(f"UPDATE p SET k = {k} WHERE id = 10")
+            moves.append(k)
+
+    thread = threading.Thread(target=flip)
+    thread.start()
+    try:
+        counts = set()
+        reads = 0
+        while (reads < 100 or len(moves) < 10) and thread.is_alive():
+            reads += 1
+            rows = list(engine.query("SELECT * FROM p")[1])
+            counts.add(len(rows))
+            assert sum(1 for row in rows if row[0] == '10') == 1
+            counts.add(int(_rows(engine, "SELECT COUNT(*) FROM p")[0][0]))
+    finally:
+        stop.set()
+        thread.join(10)
+    assert len(moves) >= 10
+    assert counts == {300}
+
+
+def test_snapshot_keeps_its_partitions_when_one_is_added(engine):
+    before = _rows(engine)
+    with engine.snapshot():
+        thread = threading.Thread(target=lambda: [
+            engine.execute("ALTER TABLE p ADD PARTITION top VALUES LESS THAN (200)"),
+            engine.execute("INSERT INTO p VALUES (1000, 150)")])
+        thread.start()
+        thread.join(10)
+        assert _rows(engine) == before
+        assert "top" not in engine.execute("DESCRIBE p")
+    assert ('1000', '150') in _rows(engine)
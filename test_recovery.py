@@ -0,0 +1,139 @@
+"""
+Tests for crash recovery: durable log and checkpoint writes, and rebuilding tables from them
+"""
+import json
+import os
+
+import pytest
+
+import changelog
+import crash_harness
+from engine import DatabaseEngine
+from storage import FileStorage
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """A data directory with a logged table t of three rows"""
+    engine = DatabaseEngine(str(tmp_path / 'data'))
+    engine.execute("CREATE TABLE t (id, name)")
+    engine.execute("ALTER TABLE t SET CHANGE LOG ON")
+    engine.executemany("INSERT INTO t VALUES (?, ?)", [(1, 'ann'), (2, 'bob'), (3, 'cy')])
+    engine.close()
+    return str(tmp_path / 'data')
+
+
+def _path(data_dir, name):
+    return os.path.join(data_dir, name)
+
+
+def _damage_table(data_dir):
+    """Append a row the log knows nothing of, as a crash mid-write could"""
+    with open(_path(data_dir, 't.db'), 'a') as f:
+        f.write('9,ghost\n')
+
+
+def _rows(engine):
+    return sorted(engine.query("SELECT * FROM t")[1])
+
+
+def test_a_damaged_table_is_rebuilt_from_checkpoint_and_log(data_dir):
+    _damage_table(data_dir)
+    engine = DatabaseEngine(data_dir)
+    assert _rows(engine) == [('1', 'ann'), ('2', 'bob'), ('3', 'cy')]
+    assert engine.metrics.counters['tables_recovered'] == 1
+
+
+def test_a_transaction_left_open_is_aborted_on_open(data_dir):
+    # A crash right after logging a statement's changes, before the table was written
+    storage = FileStorage(data_dir)
+    transaction = changelog.begin(storage, 't', [changelog.insert(('4', 'dee'))])
+    engine = DatabaseEngine(data_dir)
+    assert _rows(engine) == [('1', 'ann'), ('2', 'bob'), ('3', 'cy')]
+    _, open_transactions, last_outcome = changelog.scan(engine.storage, 't')
+    assert open_transactions == [] and last_outcome['op'] == 'commit'
+    assert any(entry['op'] == 'abort' and entry['tx'] == transaction[0]
+               for entry in map(json.loads, engine.storage.read_aux('t', changelog.LOG_SUFFIX).splitlines()))
+    assert engine.subscribe('t').poll()[-1]['after'] == ['3', 'cy']
+
+
+def _record_fsyncs(monkeypatch, events):
+    """Record the inode of every file FileStorage syncs"""
+    fsync = FileStorage._fsync
+    monkeypatch.setattr(FileStorage, '_fsync',
+                        lambda self, f: (events.append(os.fstat(f.fileno()).st_ino), fsync(self, f)))
+
+
+def test_the_log_is_on_disk_before_the_table_is_written(data_dir, monkeypatch):
+    events = []
+    _record_fsyncs(monkeypatch, events)
+    for name in ('append_row', 'append_rows', '_replace_file'):
+        write = getattr(FileStorage, name)
+        monkeypatch.setattr(FileStorage, name,
+                            lambda self, *args, write=write: (events.append('table write'), write(self, *args))[1])
+    engine = DatabaseEngine(data_dir)
+    engine.execute("INSERT INTO t VALUES (4, dee)")
+    assert os.stat(_path(data_dir, 't.cdc')).st_ino in events[:events.index('table write')]
+
+
+def test_checkpoints_and_catalog_are_synced_before_they_replace_the_old_ones(data_dir, monkeypatch):
+    synced = []
+    replaced = []
+    _record_fsyncs(monkeypatch, synced)
+    replace = os.replace
+
+    def checked_replace(src, dst):
+        assert os.stat(src).st_ino in synced
+        replaced.append(os.path.basename(dst))
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', checked_replace)
+    engine = DatabaseEngine(data_dir)
+    engine.execute("ANALYZE t")
+    engine.checkpoint('t')
+    assert {'t.meta', 't.ckpt'} <= set(replaced)
+
+
+@pytest.mark.parametrize('data', [b'', b'{"seq": 3, "offset": 10, "columns": ["id", "name"], "count": 3}\n1,ann\n2,b'])
+def test_a_broken_checkpoint_is_reported_when_a_rebuild_needs_it(data_dir, data):
+    with open(_path(data_dir, 't.ckpt'), 'wb') as f:
+        f.write(data)
+    # Nothing to rebuild: the checkpoint is not needed
+    assert _rows(DatabaseEngine(data_dir)) == [('1', 'ann'), ('2', 'bob'), ('3', 'cy')]
+
+    _damage_table(data_dir)
+    with pytest.raises(ValueError, match="Cannot recover table 't': Checkpoint of table 't' is empty or corrupt"):
+        DatabaseEngine(data_dir)
+
+
+def test_read_checkpoint_rejects_a_checkpoint_cut_short(data_dir):
+    storage = FileStorage(data_dir)
+    data = storage.read_aux('t', changelog.CHECKPOINT_SUFFIX)
+    assert changelog.read_checkpoint(storage, 't')['columns'] == ['id', 'name']
+    for cut in (0, len(data) // 2, len(data) - 1):
+        storage.write_aux('t', changelog.CHECKPOINT_SUFFIX, data[:cut])
+        with pytest.raises(ValueError):
+            changelog.read_checkpoint(storage, 't')
+
+
+def test_statements_that_change_nothing_log_nothing(data_dir):
+    engine = DatabaseEngine(data_dir)
+    size = os.path.getsize(_path(data_dir, 't.cdc'))
+    assert engine.execute("UPDATE t SET name = x WHERE id = 99") == "0 row(s) updated."
+    assert engine.execute("DELETE FROM t WHERE id = 99") == "0 row(s) deleted."
+    engine.execute("ALTER TABLE t ALTER COLUMN name SET ENCODING PLAIN")
+    assert os.path.getsize(_path(data_dir, 't.cdc')) == size
+
+    # A rewrite that changes no rows is still marked, so the table is not rebuilt on open
+    engine.execute("ALTER TABLE t ALTER COLUMN name SET ENCODING DICTIONARY")
+    assert os.path.getsize(_path(data_dir, 't.cdc')) > size
+    engine.close()
+    engine = DatabaseEngine(data_dir)
+    assert engine.metrics.counters.get('tables_recovered', 0) == 0
+    assert _rows(engine) == [('1', 'ann'), ('2', 'bob'), ('3', 'cy')]
+
+
+def test_crash_harness_recovers_every_crash_point(capsys):
+    # One short run per crash point, seeded so a failure can be replayed with the same arguments
+    argv = ['--runs', str(len(crash_harness.CRASH_POINTS)), '--seed', '3', '--statements', '30']
+    assert crash_harness.main(argv) == 0, capsys.readouterr().out
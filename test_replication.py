@@ -0,0 +1,115 @@
+"""
+Tests for read replicas: applying shipped changes, restarts and lag
+"""
+import pytest
+
+from engine import DatabaseEngine
+from replication import FileTransport, LogShipper, PipeTransport, Replica
+
+
+@pytest.fixture
+def primary(tmp_path):
+    """A primary engine with a logged table t of two rows"""
+    engine = DatabaseEngine(str(tmp_path / 'primary'))
+    engine.execute("CREATE TABLE t (id, name)")
+    engine.execute("ALTER TABLE t SET CHANGE LOG ON")
+    engine.executemany("INSERT INTO t VALUES (?, ?)", [(1, 'ann'), (2, 'bob')])
+    yield engine
+    engine.close()
+
+
+def _rows(engine, table='t'):
+    return sorted(engine.query(f"SELECT * FROM {table}")[1])
+
+
+def _replica(tmp_path, path='ship.log'):
+    """A replica on tmp_path/replica following a file transport"""
+    return Replica(str(tmp_path / 'replica'), FileTransport(str(tmp_path / path)))
+
+
+def test_replica_applies_the_snapshot_then_each_transaction(primary, tmp_path):
+    shipper = LogShipper(primary, ['t'], FileTransport(str(tmp_path / 'ship.log')))
+    replica = _replica(tmp_path)
+    shipper.ship()
+    replica.catch_up()
+    assert _rows(replica.engine) == _rows(primary)
+
+    primary.execute("INSERT INTO t VALUES (3, cy)")
+    primary.execute("UPDATE t SET name = rob WHERE id = 2")
+    primary.execute("DELETE FROM t WHERE id = 1")
+    shipper.ship()
+    replica.catch_up()
+    assert _rows(replica.engine) == [('2', 'rob'), ('3', 'cy')]
+    replica.close()
+
+
+def test_pipe_transport_carries_the_same_messages(primary, tmp_path):
+    send, receive = PipeTransport.pair()
+    shipper = LogShipper(primary, ['t'], send)
+    replica = Replica(str(tmp_path / 'replica'), receive)
+    primary.execute("INSERT INTO t VALUES (3, cy)")
+    shipper.ship()
+    replica.catch_up()
+    assert _rows(replica.engine) == _rows(primary)
+    replica.close()
+    send.close()
+    receive.close()
+
+
+def test_a_restarted_replica_skips_what_it_already_applied(primary, tmp_path):
+    shipper = LogShipper(primary, ['t'], FileTransport(str(tmp_path / 'ship.log')))
+    replica = _replica(tmp_path)
+    shipper.ship()
+    primary.execute("INSERT INTO t VALUES (3, cy)")
+    shipper.ship()
+    replica.catch_up()
+    replica.close()
+
+    # A new transport reads the whole file again
+    replica = _replica(tmp_path)
+    assert replica.state['t']['seq'] == replica.engine.storage.read_meta('t')['replica']['seq']
+    primary.execute("INSERT INTO t VALUES (4, dee)")
+    shipper.ship()
+    replica.catch_up()
+    assert _rows(replica.engine) == _rows(primary)
+    replica.close()
+
+
+def test_lag_counts_entries_behind_until_caught_up(primary, tmp_path):
+    shipper = LogShipper(primary, ['t'], FileTransport(str(tmp_path / 'ship.log')), heartbeat_interval=0)
+    replica = _replica(tmp_path)
+    shipper.ship()
+    replica.catch_up()
+    assert replica.lag()['t']['seq'] == 0
+
+    primary.execute("INSERT INTO t VALUES (3, cy)")
+    shipper.ship()
+    # Only the heartbeat has been applied: the replica knows it is behind
+    messages = replica.transport.receive()
+    replica._apply_messages([message for message in messages if message['type'] == 'heartbeat'])
+    assert replica.lag()['t']['seq'] > 0
+    replica._apply_messages(messages)
+    assert replica.lag()['t']['seq'] == 0
+    assert replica.staleness('t') < 5
+    replica.close()
+
+
+def test_replicas_are_read_only_and_bound_staleness(primary, tmp_path):
+    shipper = LogShipper(primary, ['t'], FileTransport(str(tmp_path / 'ship.log')))
+    replica = _replica(tmp_path)
+    with pytest.raises(ValueError, match="read-only"):
+        replica.execute("INSERT INTO t VALUES (3, cy)")
+    with pytest.raises(ValueError, match="not replicated"):
+        replica.execute("SELECT * FROM t", max_staleness=1.0)
+
+    shipper.ship()
+    replica.catch_up()
+    # A stale read catches up first
+    primary.execute("INSERT INTO t VALUES (3, cy)")
+    shipper.ship()
+    replica.state['t']['synced_at'] -= 60
+    assert "cy" in replica.execute("SELECT * FROM t", max_staleness=1.0)
+    replica.state['t']['synced_at'] -= 60
+    with pytest.raises(ValueError, match="behind the primary"):
+        replica.execute("SELECT * FROM t", max_staleness=1.0)
+    replica.close()
@@ -0,0 +1,148 @@
+"""
+Tests for the server, the wire protocol and the clients, against an in-process server
+"""
+import asyncio
+import socket
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+import protocol
+from client import AsyncConnection, AsyncConnectionPool, Connection, ConnectionPool
+from engine import DatabaseEngine
+from server import DatabaseServer
+
+ROWS = 2000
+
+
+def _engine(rows=ROWS):
+    """In-memory engine with a table t of rows rows"""
+    engine = DatabaseEngine(':memory:')
+    engine.execute("CREATE TABLE t (id, name)")
+    engine.storage.append_rows('t', [(str(i), f"n{i}") for i in range(rows)])
+    return engine
+
+
+@contextmanager
+def running_server(batch_size=100):
+    """A DatabaseServer on a free port, with its event loop in a background thread"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server = DatabaseServer(_engine(), port=0, batch_size=batch_size)
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result(5)
+    try:
+        yield server
+    finally:
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(5)
+        loop.close()
+
+
+def _connections(server):
+    """Connections the server is serving"""
+    return len(server._connections)
+
+
+def test_pipelined_statements_are_answered_in_order():
+    with running_server() as server, Connection(port=server.port, timeout=5) as conn:
+        results = conn.pipeline(["SELECT * FROM t WHERE id = 1", "INSERT INTO t VALUES (5000, x)",
+                                 "SELECT * FROM t WHERE id = 5000"])
+        # Read out of order: the connection buffers the replies in between
+        assert results[2].fetchall() == [['5000', 'x']]
+        assert results[0].fetchall() == [['1', 'n1']]
+        assert results[1].columns is None
+        assert results[1].message
+
+
+def test_rows_are_fetched_incrementally():
+    with running_server(batch_size=100) as server, Connection(port=server.port, timeout=5) as conn:
+        result = conn.execute("SELECT * FROM t")
+        assert result.columns == ['id', 'name']
+        first = result.fetchmany(150)
+        assert len(first) == 150
+        # Only the batches needed so far have been read off the socket
+        assert len(result._buffer) < 100
+        rest = result.fetchall()
+        assert len(first) + len(rest) == ROWS
+        assert result.message == f"{ROWS} row(s) returned."
+
+
+def test_errors_are_reported_and_the_connection_stays_usable():
+    with running_server() as server, Connection(port=server.port, timeout=5) as conn:
+        with pytest.raises(ValueError):
+            conn.execute("SELECT * FROM missing").fetchall()
+        assert conn.execute("SELECT * FROM t WHERE id = 2").fetchall() == [['2', 'n2']]
+
+
+def test_pool_reuses_connections():
+    with running_server() as server:
+        pool = ConnectionPool(port=server.port, size=2, timeout=5)
+        for i in range(5):
+            columns, rows, _ = pool.execute(f"SELECT * FROM t WHERE id = {i}")
+            assert columns == ['id', 'name'] and rows == [[str(i), f"n{i}"]]
+        # A result left unread is drained before the connection goes back
+        with pool.connection() as conn:
+            conn.execute("SELECT * FROM t")
+        assert pool.execute("SELECT * FROM t WHERE id = 7")[1] == [['7', 'n7']]
+        assert _connections(server) == 1
+        pool.close()
+
+
+def test_malformed_frames_get_an_error_and_close_the_connection():
+    with running_server() as server:
+        for frame in (protocol.encode_frame(77, 5), protocol.HEADER.pack(2, protocol.QUERY) + b'ab'):
+            with socket.create_connection(('127.0.0.1', server.port), timeout=5) as sock:
+                sock.sendall(frame + protocol.encode_text(protocol.QUERY, 6, "SHOW TABLES"))
+                kind, payload = protocol.recv_frame(sock)
+                assert kind == protocol.ERROR
+                assert sock.recv(1) == b''
+        # Cut off mid-frame
+        with socket.create_connection(('127.0.0.1', server.port), timeout=5) as sock:
+            sock.sendall(protocol.HEADER.pack(100, protocol.QUERY) + b'abc')
+        with Connection(port=server.port, timeout=5) as conn:
+            assert conn.execute("SELECT * FROM t WHERE id = 3").fetchall() == [['3', 'n3']]
+            assert _connections(server) == 1
+
+
+def test_async_connection_serves_concurrent_statements():
+    async def run(port):
+        async with await AsyncConnection.connect(port=port) as conn:
+            results = await asyncio.gather(*[conn.execute(f"SELECT * FROM t WHERE id = {i}") for i in range(10)])
+            return [await result.fetchall() for result in results]
+
+    with running_server() as server:
+        rows = asyncio.run(run(server.port))
+        assert rows == [[[str(i), f"n{i}"]] for i in range(10)]
+
+
+def test_async_unread_result_does_not_block_the_connection():
+    async def run(port):
+        async with await AsyncConnection.connect(port=port) as conn:
+            unread = await conn.execute("SELECT * FROM t")
+            count = await asyncio.wait_for(conn.execute("SELECT COUNT(*) FROM t"), 5)
+            counted = await asyncio.wait_for(count.fetchall(), 5)
+            return counted, len(await unread.fetchall())
+
+    with running_server(batch_size=10) as server:
+        # A connection that blocks on the unread result hangs instead of failing
+        counted, read_later = asyncio.run(asyncio.wait_for(run(server.port), 10))
+        assert counted == [[str(ROWS)]]
+        assert read_later == ROWS
+
+
+def test_async_pool_reuses_connections():
+    async def run(port):
+        pool = AsyncConnectionPool(port=port, size=2)
+        try:
+            results = await asyncio.gather(*[pool.execute(f"SELECT * FROM t WHERE id = {i}") for i in range(6)])
+            return [rows for _, rows, _ in results], len(pool._connections)
+        finally:
+            await pool.close()
+
+    with running_server() as server:
+        rows, opened = asyncio.run(run(server.port))
+        assert rows == [[[str(i), f"n{i}"]] for i in range(6)]
+        assert opened == 2
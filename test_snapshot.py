@@ -0,0 +1,96 @@
+"""
+Tests for snapshots: every table and its catalog entry read as of one moment
+"""
+import threading
+import time
+
+import pytest
+
+from engine import MEMORY, DatabaseEngine
+
+
+@pytest.fixture(params=['file', 'memory'])
+def engine(request, tmp_path):
+    """An engine on each backend, with a table t of three rows"""
+    engine = DatabaseEngine(str(tmp_path / 'data') if request.param == 'file' else MEMORY)
+    engine.execute("CREATE TABLE t (id, name)")
+    for i, name in enumerate(['ann', 'bob', 'cy']):
+        engine.execute(f"INSERT INTO t VALUES ({i}, {name})")
+    yield engine
+    engine.close()
+
+
+def _in_thread(target):
+    """Run target in another thread, which reads and writes outside this one's snapshot"""
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join(10)
+
+
+def _rows(engine, command="SELECT * FROM t"):
+    return sorted(engine.query(command)[1])
+
+
+def test_snapshot_reads_rows_as_of_its_start(engine):
+    before = _rows(engine)
+    with engine.snapshot():
+        _in_thread(lambda: [engine.execute("UPDATE t SET name = zed WHERE id = 0"),
+                            engine.execute("INSERT INTO t VALUES (3, dee)"),
+                            engine.execute("DELETE FROM t WHERE id = 1")])
+        assert _rows(engine) == before
+        assert _rows(engine, "SELECT * FROM t WHERE id = 0") == [('0', 'ann')]
+    assert _rows(engine) == [('0', 'zed'), ('2', 'cy'), ('3', 'dee')]
+
+
+def test_snapshot_reads_the_catalog_as_of_its_start(engine):
+    with engine.snapshot():
+        _in_thread(lambda: [engine.execute("ANALYZE t"),
+                            engine.execute("ALTER TABLE t ALTER COLUMN name SET ENCODING DICTIONARY"),
+                            engine.execute("INSERT INTO t VALUES (3, dee)")])
+        assert 'stats' not in engine.storage.read_meta('t')
+        assert 'DICTIONARY' not in engine.execute("DESCRIBE t")
+        assert len(_rows(engine)) == 3
+    assert 'stats' in engine.storage.read_meta('t')
+    assert 'DICTIONARY' in engine.execute("DESCRIBE t")
+    assert ('3', 'dee') in _rows(engine)
+
+
+def test_snapshot_decodes_rows_with_its_own_dictionary(engine):
+    engine.execute("ALTER TABLE t ALTER COLUMN name SET ENCODING DICTIONARY")
+    with engine.snapshot():
+        # New values grow the dictionary, the rewrite renumbers the codes
+        _in_thread(lambda: [engine.execute("INSERT INTO t VALUES (3, dee)"),
+                            engine.execute("DELETE FROM t WHERE id = 0")])
+        assert _rows(engine) == [('0', 'ann'), ('1', 'bob'), ('2', 'cy')]
+
+
+def test_snapshot_sees_a_write_in_progress_whole(engine):
+    written = threading.Event()
+
+    def writer():
+        # Rows and catalog change under one lock, as a statement changes them
+        with engine.storage.lock_table('t'):
+            engine.storage.write_table('t', ['id', 'name'], [('9', 'new')])
+            written.set()
+            time.sleep(0.2)
+            meta = engine.storage.read_meta('t')
+            meta['marker'] = True
+            engine.storage.write_meta('t', meta)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    written.wait(5)
+    with engine.snapshot():
+        assert _rows(engine) == [('9', 'new')]
+        assert engine.storage.read_meta('t').get('marker')
+    thread.join(5)
+
+
+def test_writes_inside_a_snapshot_raise(engine):
+    with engine.snapshot():
+        with pytest.raises(ValueError):
+            engine.execute("INSERT INTO t VALUES (3, dee)")
+        with pytest.raises(ValueError):
+            engine.execute("ANALYZE t")
+    engine.execute("INSERT INTO t VALUES (3, dee)")
+    assert len(_rows(engine)) == 4
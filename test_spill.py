@@ -0,0 +1,87 @@
+"""
+Tests for memory budgets: sorts and aggregations that spill return what they would in memory
+"""
+import os
+
+import pytest
+
+import memory
+from engine import MEMORY, DatabaseEngine
+
+ROWS = [(i, i % 500, f"name{i % 37}") for i in range(20000)]
+
+
+def _engine(query_memory_limit, spill_dir=None):
+    """A memory engine with a table t (id, g, name) of ROWS"""
+    engine = DatabaseEngine(MEMORY, query_memory_limit=query_memory_limit, spill_dir=spill_dir)
+    engine.execute("CREATE TABLE t (id, g, name)")
+    engine.executemany("INSERT INTO t VALUES (?, ?, ?)", ROWS)
+    return engine
+
+
+@pytest.fixture
+def engines(tmp_path):
+    """An engine that must spill, with its spill directory, and one with no limit"""
+    spill_dir = tmp_path / 'spill'
+    spill_dir.mkdir()
+    return _engine(64 * 1024, str(spill_dir)), str(spill_dir), _engine(None)
+
+
+def _rows(engine, command):
+    return [tuple(row) for row in engine.query(command)[1]]
+
+
+@pytest.mark.parametrize('command', [
+    "SELECT * FROM t ORDER BY id",
+    "SELECT * FROM t ORDER BY g DESC, id",
+    "SELECT name, id FROM t WHERE g < 100 ORDER BY name, id DESC",
+])
+def test_spilled_sort_matches_the_in_memory_sort(engines, command):
+    small, spill_dir, unlimited = engines
+    assert _rows(small, command) == _rows(unlimited, command)
+    assert small.metrics.counters['spill_files'] > 1
+    assert small.memory.reserved == 0
+    assert os.listdir(spill_dir) == []
+
+
+@pytest.mark.parametrize('command', [
+    "SELECT g, COUNT(*), SUM(id), MIN(name), MAX(id) FROM t GROUP BY g",
+    "SELECT id, AVG(g) FROM t GROUP BY id",
+    "SELECT g, name, COUNT(*) FROM t GROUP BY g, name",
+])
+def test_spilled_aggregate_matches_the_in_memory_aggregate(engines, command):
+    small, spill_dir, unlimited = engines
+    # Groups of a spilled aggregation come back in another order
+    assert sorted(_rows(small, command)) == sorted(_rows(unlimited, command))
+    assert small.metrics.counters['spill_files'] > 1
+    assert small.memory.reserved == 0
+    assert os.listdir(spill_dir) == []
+
+
+def test_many_runs_are_merged_in_rounds(engines, monkeypatch):
+    small, _, unlimited = engines
+    monkeypatch.setattr(memory, 'MERGE_FAN_IN', 4)
+    command = "SELECT * FROM t ORDER BY name, id"
+    assert _rows(small, command) == _rows(unlimited, command)
+    assert small.metrics.counters['spill_files'] > memory.MERGE_FAN_IN
+
+
+def test_a_spilled_aggregate_is_sorted_by_order_by(engines):
+    small, _, unlimited = engines
+    command = "SELECT g, COUNT(*) FROM t GROUP BY g ORDER BY g"
+    assert _rows(small, command) == _rows(unlimited, command)
+
+
+def test_without_a_limit_nothing_spills(engines):
+    _, _, unlimited = engines
+    _rows(unlimited, "SELECT * FROM t ORDER BY name")
+    _rows(unlimited, "SELECT g, COUNT(*) FROM t GROUP BY g")
+    assert 'spill_files' not in unlimited.metrics.counters
+
+
+def test_few_groups_aggregate_in_memory_under_a_small_limit(engines):
+    small, _, unlimited = engines
+    # Only the groups are held, not the rows
+    command = "SELECT name, AVG(id) FROM t GROUP BY name"
+    assert sorted(_rows(small, command)) == sorted(_rows(unlimited, command))
+    assert 'spill_files' not in small.metrics.counters
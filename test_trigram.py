@@ -0,0 +1,67 @@
+"""
+Tests for trigram indexes: LIKE lookups, rechecks, fallbacks and maintenance on write
+"""
+import re
+
+import pytest
+
+from engine import MEMORY, DatabaseEngine
+from indexes import TrigramIndex
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo']
+
+
+@pytest.fixture(params=['file', 'memory'])
+def engine(request, tmp_path):
+    """An engine on each backend with a table t of 2000 titles and a trigram index on them"""
+    engine = DatabaseEngine(str(tmp_path / 'data') if request.param == 'file' else MEMORY)
+    engine.execute("CREATE TABLE t (id, title)")
+    engine.executemany("INSERT INTO t VALUES (?, ?)", [(i, f"{WORDS[i % 5]}-{i}") for i in range(2000)])
+    engine.execute("CREATE INDEX t_title ON t USING TRIGRAM (title)")
+    yield engine
+    engine.close()
+
+
+def _like(pattern, titles):
+    """The titles a LIKE pattern matches, worked out without the engine"""
+    regex = re.compile(''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern) + '$')
+    return sorted(title for title in titles if regex.match(title))
+
+
+def _titles(engine, where):
+    return sorted(row[1] for row in engine.query(f"SELECT * FROM t WHERE {where}")[1])
+
+
+@pytest.mark.parametrize('pattern', ['%lie-17%', 'echo-19%', '%-1999', '%ta-1_0%', 'bravo-1', '%zulu%'])
+def test_like_uses_the_index_and_matches_a_scan(engine, pattern):
+    assert "Index Scan on t using t_title" in engine.execute(f"EXPLAIN SELECT * FROM t WHERE title LIKE '{pattern}'")
+    titles = [row[1] for row in engine.storage.read_table('t')[1]]
+    assert _titles(engine, f"title LIKE '{pattern}'") == _like(pattern, titles)
+
+
+def test_patterns_without_a_trigram_scan(engine):
+    assert "Full Scan on t" in engine.execute("EXPLAIN SELECT * FROM t WHERE title LIKE '%a_b%'")
+    assert not TrigramIndex.supports('LIKE', '%a_b%')
+    titles = [row[1] for row in engine.storage.read_table('t')[1]]
+    assert _titles(engine, "title LIKE '%o-1_'") == _like('%o-1_', titles)
+
+
+def test_matching_is_case_sensitive(engine):
+    assert _titles(engine, "title LIKE '%ALPHA%'") == []
+    assert len(_titles(engine, "title LIKE '%alpha%'")) == 400
+
+
+def test_equality_uses_the_index(engine):
+    assert "using t_title" in engine.execute("EXPLAIN SELECT * FROM t WHERE title = delta-1003")
+    assert _titles(engine, "title = delta-1003") == ['delta-1003']
+
+
+def test_index_follows_inserts_updates_and_deletes(engine):
+    engine.execute("INSERT INTO t VALUES (2000, foxtrot-2000)")
+    assert _titles(engine, "title LIKE '%foxtrot%'") == ['foxtrot-2000']
+    engine.execute("UPDATE t SET title = golf-7 WHERE id = 7")
+    engine.execute("DELETE FROM t WHERE id = 8")
+    assert _titles(engine, "title LIKE '%golf%'") == ['golf-7']
+    assert _titles(engine, "title LIKE '%-8'") == []
+    titles = [row[1] for row in engine.storage.read_table('t')[1]]
+    assert _titles(engine, "title LIKE 'charlie-7%'") == _like('charlie-7%', titles)
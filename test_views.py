@@ -0,0 +1,40 @@
+"""
+Tests for materialized views: refreshes and the rewrite tracking of their sources
+"""
+import pytest
+
+from engine import MEMORY, DatabaseEngine
+
+
+@pytest.fixture(params=['file', 'memory'])
+def engine(request, tmp_path):
+    """An engine on each backend with a table t and a view v over it"""
+    engine = DatabaseEngine(str(tmp_path / 'data') if request.param == 'file' else MEMORY)
+    engine.execute("CREATE TABLE t (id, n)")
+    engine.executemany("INSERT INTO t VALUES (?, ?)", [(i, i % 3) for i in range(9)])
+    engine.execute("CREATE MATERIALIZED VIEW v AS SELECT id FROM t WHERE n = 0")
+    yield engine
+    engine.close()
+
+
+def _tracked(engine, table):
+    return 'rewrite_id' in engine.storage.read_meta(table)
+
+
+def test_refresh_appends_new_rows_and_recomputes_after_a_rewrite(engine):
+    engine.execute("INSERT INTO t VALUES (9, 0)")
+    assert "(incremental)" in engine.execute("REFRESH MATERIALIZED VIEW v")
+    engine.execute("DELETE FROM t WHERE id = 0")
+    assert "(full)" in engine.execute("REFRESH MATERIALIZED VIEW v")
+    assert sorted(engine.query("SELECT * FROM v")[1]) == [('3',), ('6',), ('9',)]
+
+
+@pytest.mark.parametrize('drop', ["DROP MATERIALIZED VIEW {}", "DROP TABLE {}"])
+def test_dropping_the_last_view_stops_tracking_its_source(engine, drop):
+    engine.execute("CREATE MATERIALIZED VIEW w AS SELECT n FROM t")
+    assert _tracked(engine, 't')
+    engine.execute(drop.format('v'))
+    assert _tracked(engine, 't')
+    engine.execute(drop.format('w'))
+    assert not _tracked(engine, 't')
+    assert not engine.storage.table_exists('w')